@@ -0,0 +1,223 @@
+# Dashboard callback benchmark: imports dashboard and calls update_charts, update_drilldown_chart and
+# update_filters_from_chart_click directly (no browser, no server) on random filter states, against a
+# warehouse loaded from generated data (see etl_benchmark.py). Reports p50/p95/p99 latencies of each
+# callback, split into phases:
+#   fetch      filter options, warehouse version, connection and rollup catalog, filter engine, result cache
+#   filter     filter state of the UI values and the filter engine's row selection
+#   aggregate  the chart aggregates (with the sql backend this includes the filtering done by the query)
+#   figure     the rest of the callback: plotly figures and Dash components (the click handling itself
+#              for update_filters_from_chart_click)
+#
+#   python benchmarks/dashboard_benchmark.py                           # scale 1, sql backend, 200 states
+#   python benchmarks/dashboard_benchmark.py --scale 10 --backends sql memory
+#   python benchmarks/dashboard_benchmark.py --cached                  # keep the result cache between calls
+import argparse
+import functools
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+
+from etl_benchmark import ROOT, WORK_DIR, ensure_data, run_pipeline, scale_name
+
+# Phases of a callback, in report order; figure is the callback time not spent in the others
+PHASES = ['fetch', 'filter', 'aggregate', 'figure']
+
+# Callbacks in report order
+CALLBACKS = ['update_charts', 'update_drilldown_chart', 'update_filters_from_chart_click']
+
+# Share of the filter states that set each filter (the others are left at "All")
+FILTER_SHARE = 0.3
+
+# Percentiles reported
+PERCENTILES = [50, 95, 99]
+
+# Exclusive time per phase: a phase nested in another (e.g. the engine's row selection inside an
+# aggregate) is counted in the inner phase only
+class PhaseTimer:
+    def __init__(self):
+        self.totals = {}
+        self._stack = []
+
+    def reset(self):
+        self.totals = {}
+
+    def wrap(self, phase, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._stack.append(0.0)
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start_time
+                children = self._stack.pop()
+                self.totals[phase] = self.totals.get(phase, 0.0) + elapsed - children
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return wrapper
+
+# Time the dashboard's data access by wrapping the functions the callbacks look up at call time
+def instrument_dashboard(dashboard, timer):
+    from olap.filters import FilterEngine
+    from olap.query import CubeQuery
+    for name in ['get_filter_options', 'get_filter_engine', 'warehouse_version']:
+        setattr(dashboard, name, timer.wrap('fetch', getattr(dashboard, name)))
+    for name in ['chart_filters', 'normalize_filters', 'filter_key']:
+        setattr(dashboard, name, timer.wrap('filter', getattr(dashboard, name)))
+    dashboard.RESULT_CACHE.get = timer.wrap('fetch', dashboard.RESULT_CACHE.get)
+    dashboard.RESULT_CACHE.put = timer.wrap('fetch', dashboard.RESULT_CACHE.put)
+    # Version check of the cube after a query of the memory backend
+    store = dashboard.get_cube_store()
+    store.version = timer.wrap('fetch', store.version)
+    CubeQuery.connection = timer.wrap('fetch', CubeQuery.connection)
+    CubeQuery.aggregate = timer.wrap('aggregate', CubeQuery.aggregate)
+    FilterEngine.rows = timer.wrap('filter', FilterEngine.rows)
+
+# Random filter state of the UI: each filter set with FILTER_SHARE, to one of its values (a sub-range of
+# the ages, a subset of the coverage types), plus a drill-down year range
+def random_state(rng, options):
+    def pick(values):
+        return str(rng.choice(list(values))) if rng.random() < FILTER_SHARE else "All"
+    low_age, high_age = (int(age) for age in options["age_range"])
+    age_range = [low_age, high_age]
+    if rng.random() < FILTER_SHARE:
+        age_range = sorted(rng.sample(range(low_age, high_age + 1), 2))
+    coverage_type = ["All"]
+    if rng.random() < FILTER_SHARE:
+        coverage_type = rng.sample(list(options["coverage_types"]), rng.randint(1, len(options["coverage_types"])))
+    years = [int(year) for year in options["years"]]
+    drilldown_years = sorted(rng.sample(years, 2)) if len(years) > 1 else [years[0], years[0]]
+    filters = (
+        pick(options["years"]), pick(options["months"]), pick(options["weekdays"]), pick(options["statuses"]),
+        pick(options["specialties"]), pick(options["insurance"]), pick(options["genders"]), age_range,
+        pick(options["doctor_genders"]), coverage_type
+    )
+    return filters, drilldown_years
+
+# A click on one of the five charts, as Dash passes it: the chart's id and the clicked point
+def random_click(rng, options):
+    chart, values, key = rng.choice([
+        ("gender-pie-chart", options["genders"], 'label'),
+        ("status-pie-chart", options["statuses"], 'label'),
+        ("insurance-gender-chart", options["insurance"], 'x'),
+        ("specialty-gender-chart", options["specialties"], 'x'),
+        ("profitable-specialties-chart", options["specialties"], 'y')
+    ])
+    return chart, {'points': [{key: str(rng.choice(list(values)))}]}
+
+# Call the click callback inside a callback context that reports the click as its trigger
+def click_chart(dashboard, chart, click_data, filters):
+    from dash._callback_context import context_value
+    token = context_value.set(SimpleNamespace(triggered_inputs=[{'prop_id': f"{chart}.clickData", 'value': click_data}]))
+    try:
+        clicks = [click_data if chart_id == chart else None for chart_id in [
+            "gender-pie-chart", "status-pie-chart", "insurance-gender-chart", "specialty-gender-chart", "profitable-specialties-chart"
+        ]]
+        return dashboard.update_filters_from_chart_click(*clicks, *filters)
+    finally:
+        context_value.reset(token)
+
+# Time one callback call: its phases and its total, in seconds
+def timed_call(timer, func, *args):
+    timer.reset()
+    start_time = time.perf_counter()
+    result = func(*args)
+    total = time.perf_counter() - start_time
+    phases = {phase: timer.totals.get(phase, 0.0) for phase in PHASES[:-1]}
+    phases['figure'] = max(0.0, total - sum(phases.values()))
+    phases['total'] = total
+    return result, phases
+
+# Run the callbacks on the filter states: the charts and the drill-down of each state, then a chart click
+def sweep(dashboard, timer, states, cached=False):
+    samples = {callback: [] for callback in CALLBACKS}
+    for filters, drilldown_years, (chart, click_data) in states:
+        if not cached:
+            dashboard.RESULT_CACHE.clear()
+        _, phases = timed_call(timer, dashboard.update_charts, 0, *filters)
+        samples['update_charts'].append(phases)
+        _, phases = timed_call(timer, dashboard.update_drilldown_chart, drilldown_years, *filters)
+        samples['update_drilldown_chart'].append(phases)
+        _, phases = timed_call(timer, click_chart, dashboard, chart, click_data, filters)
+        samples['update_filters_from_chart_click'].append(phases)
+    return samples
+
+# Percentiles per callback and phase in milliseconds
+def summarize(samples):
+    summary = {}
+    for callback, calls in samples.items():
+        summary[callback] = {
+            phase: {f"p{p}": round(float(np.percentile([call[phase] for call in calls], p)) * 1000, 2) for p in PERCENTILES}
+            for phase in [*PHASES, 'total']
+        }
+    return summary
+
+def print_summary(backend, summary, calls):
+    print(f"\nBackend '{backend}', {calls} filter states (ms; percentiles of each phase taken separately)")
+    print(f"{'callback':<34} {'phase':<10}" + ''.join(f"{f'p{p}':>10}" for p in PERCENTILES))
+    for callback, phases in summary.items():
+        for phase, values in phases.items():
+            name = callback if phase == PHASES[0] else ''
+            print(f"{name:<34} {phase:<10}" + ''.join(f"{values[f'p{p}']:>10.2f}" for p in PERCENTILES))
+
+# Warehouse of the scale, loaded by the ETL benchmark's pipeline run unless it is already there
+def ensure_warehouse(scale, seed, rebuild=False):
+    folder = WORK_DIR / f"scale_{scale_name(scale)}"
+    ensure_data(folder, scale, seed)
+    db_path = folder / 'warehouse' / 'warehouse.db'
+    if rebuild or not db_path.exists():
+        print(f"Loading the warehouse of scale {scale_name(scale)}...")
+        run_pipeline(folder)
+    return folder, db_path
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard callbacks on random filter states")
+    parser.add_argument('--scale', type=float, default=1, help="scale factor of the generated warehouse")
+    parser.add_argument('--seed', type=int, default=1516, help="random seed of the generated data and the filter states")
+    parser.add_argument('--calls', type=int, default=200, help="filter states per backend")
+    parser.add_argument('--warmup', type=int, default=3, help="filter states run first and not reported")
+    parser.add_argument('--backends', nargs='+', choices=['sql', 'memory'], default=['sql'], help="QUERY_BACKEND values to run")
+    parser.add_argument('--cached', action='store_true', help="keep the result cache between filter states")
+    parser.add_argument('--rebuild', action='store_true', help="load the warehouse again even if it exists")
+    parser.add_argument('--output', help="also write the percentiles to this JSON file")
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = parse_args(args)
+    folder, db_path = ensure_warehouse(args.scale, args.seed, args.rebuild)
+
+    # The dashboard reads its settings at import; it runs in the scale's folder so its logs go there
+    os.environ['DB_PATH'] = str(db_path)
+    os.environ.pop('METRICS_PORT', None)
+    os.chdir(folder)
+    sys.path.insert(0, str(ROOT))
+    import dashboard
+
+    timer = PhaseTimer()
+    instrument_dashboard(dashboard, timer)
+    options = dashboard.get_filter_options()
+    rng = random.Random(args.seed)
+    states = [(*random_state(rng, options), random_click(rng, options)) for _ in range(args.warmup + args.calls)]
+
+    results = {}
+    for backend in args.backends:
+        dashboard.QUERY_BACKEND = backend
+        dashboard.RESULT_CACHE.clear()
+        sweep(dashboard, timer, states[:args.warmup], args.cached)
+        samples = sweep(dashboard, timer, states[args.warmup:], args.cached)
+        results[backend] = summarize(samples)
+        print_summary(backend, results[backend], args.calls)
+
+    if args.output:
+        report = {'scale': args.scale, 'calls': args.calls, 'cached': args.cached, 'backends': results}
+        Path(args.output).write_text(json.dumps(report, indent=2) + '\n')
+        print(f"\nWrote the percentiles to '{args.output}'")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
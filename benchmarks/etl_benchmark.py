@@ -0,0 +1,171 @@
+# ETL benchmark: runs the pipeline (a full refresh) on generated data at several scale factors and
+# compares the time of every instrumented ETL step (see etl/etl_instrumentation.py) with a stored
+# baseline. Fails (exit code 1) when a step is slower than the baseline by more than the tolerance.
+#
+#   python benchmarks/etl_benchmark.py                      # scale 1
+#   python benchmarks/etl_benchmark.py --scales 1 10 100    # 100 takes a while and several GB of disk
+#   python benchmarks/etl_benchmark.py --save-baseline      # record the current timings as the baseline
+#   python benchmarks/etl_benchmark.py --chunksize 100000   # benchmark the streaming pipeline
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Repository root, where the pipeline is imported from
+ROOT = Path(__file__).resolve().parent.parent
+
+# Generated sources and warehouses, one folder per scale (not versioned)
+WORK_DIR = ROOT / 'benchmarks' / 'data'
+
+# Stored timings per scale to compare with
+BASELINE_PATH = ROOT / 'benchmarks' / 'etl_baseline.json'
+
+# A step counts as slower when it takes this much longer than the baseline...
+TOLERANCE = 0.25
+# ...and both take at least this long, shorter steps are too noisy to compare
+MIN_STEP_S = 0.05
+
+# Steps listed per scale: the end-to-end load and the slowest steps
+TOP_STEPS = 15
+
+def scale_name(scale):
+    return f"{scale:g}"
+
+# Generate the sources of a scale unless they are already there
+def ensure_data(folder, scale, seed, regenerate=False):
+    manifest_path = folder / 'manifest.json'
+    if not regenerate and manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest['scale'] == scale and manifest['seed'] == seed:
+            return manifest
+    subprocess.run(
+        [sys.executable, str(ROOT / 'benchmarks' / 'generate_data.py'), '--scale', str(scale), '--seed', str(seed), str(folder)],
+        check=True
+    )
+    return json.loads(manifest_path.read_text())
+
+# Run a full refresh of the pipeline in a fresh interpreter inside the scale's folder, which holds the
+# generated data/ and gets its own warehouse/ and logs/; returns the run report
+def run_pipeline(folder, chunksize=None, verbose=False):
+    shutil.rmtree(folder / 'warehouse', ignore_errors=True)
+    report_path = folder / 'logs' / 'etl_run_report.json'
+    if report_path.exists():
+        report_path.unlink()
+
+    # The insurance companies come from the generated JSON file, not the API
+    env = dict(os.environ, PYTHONPATH=str(ROOT), INSURANCE_API_URL='')
+    code = f"from pipeline import etl_pipeline; etl_pipeline(full_refresh=True, chunksize={chunksize!r})"
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=folder, env=env,
+        stdout=None if verbose else subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Pipeline run in '{folder}' failed:\n{result.stderr[-3000:]}")
+    return json.loads(report_path.read_text())
+
+# Median over the runs of the total and of every step's time, with the step's calls and rows
+def summarize(reports):
+    steps = {}
+    for report in reports:
+        for stage, total in report['summary'].items():
+            steps.setdefault(stage, []).append(total)
+    return {
+        'wall_s': round(statistics.median(report['wall_s'] for report in reports), 3),
+        'peak_rss_mb': max(report['peak_rss_mb'] or 0 for report in reports),
+        'steps': {
+            stage: {
+                'wall_s': round(statistics.median(total['wall_s'] for total in totals), 4),
+                'calls': totals[-1]['calls'],
+                'rows_in': totals[-1]['rows_in'],
+                'rows_out': totals[-1]['rows_out']
+            }
+            for stage, totals in steps.items()
+        }
+    }
+
+def read_baseline(path=BASELINE_PATH):
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def save_baseline(results, path=BASELINE_PATH):
+    baseline = read_baseline(path)
+    baseline.update(results)
+    Path(path).write_text(json.dumps(baseline, indent=2) + '\n')
+    print(f"Saved the baseline of scale {', '.join(results)} to '{path}'")
+
+def change(current, previous):
+    if previous is None or previous <= 0:
+        return None
+    return current / previous - 1
+
+def is_slower(current, previous, tolerance):
+    ratio = change(current, previous)
+    return ratio is not None and ratio > tolerance and min(current, previous) >= MIN_STEP_S
+
+# Comparison table of one scale; returns the steps slower than the baseline
+def print_comparison(scale, result, baseline, tolerance, top=TOP_STEPS):
+    baseline_steps = baseline.get('steps', {}) if baseline else {}
+    print(f"\nScale {scale}: {result['wall_s']:.2f}s end to end, peak RSS {result['peak_rss_mb']:.0f} MB"
+          + (f" (baseline {baseline['wall_s']:.2f}s)" if baseline else " (no baseline)"))
+    print(f"{'step':<44} {'calls':>5} {'rows in':>10} {'wall s':>8} {'base s':>8} {'change':>8}")
+
+    slower = []
+    ranked = sorted(result['steps'].items(), key=lambda item: item[1]['wall_s'], reverse=True)
+    for stage, step in ranked:
+        previous = baseline_steps.get(stage, {}).get('wall_s')
+        if is_slower(step['wall_s'], previous, tolerance):
+            slower.append(stage)
+        if stage not in slower and ranked.index((stage, step)) >= top:
+            continue
+        ratio = change(step['wall_s'], previous)
+        previous_text = f"{previous:.3f}" if previous is not None else '-'
+        ratio_text = f"{ratio:+.0%}" if ratio is not None else '-'
+        flag = '  SLOWER' if stage in slower else ''
+        print(f"{stage:<44} {step['calls']:>5} {step['rows_in']:>10} {step['wall_s']:>8.3f} "
+              f"{previous_text:>8} {ratio_text:>8}{flag}")
+    return slower
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ETL steps on generated data against a stored baseline")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1], help="scale factors of the shipped dataset")
+    parser.add_argument('--runs', type=int, default=1, help="pipeline runs per scale, the median is reported")
+    parser.add_argument('--chunksize', type=int, default=None, help="run the streaming pipeline with chunks of this many rows")
+    parser.add_argument('--seed', type=int, default=1516, help="random seed of the generated data")
+    parser.add_argument('--regenerate', action='store_true', help="generate the data again even if it exists")
+    parser.add_argument('--baseline', default=str(BASELINE_PATH), help="baseline file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run's timings as the baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="allowed slowdown per step, e.g. 0.25 for 25%%")
+    parser.add_argument('--verbose', action='store_true', help="show the pipeline output")
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = parse_args(args)
+    baseline = read_baseline(args.baseline)
+    results = {}
+    failed = []
+    for scale in args.scales:
+        name = scale_name(scale)
+        folder = WORK_DIR / f"scale_{name}"
+        manifest = ensure_data(folder, scale, args.seed, args.regenerate)
+        print(f"Running the pipeline on scale {name} {manifest['rows']} ({args.runs} run(s))...")
+        reports = [run_pipeline(folder, args.chunksize, args.verbose) for _ in range(args.runs)]
+        results[name] = summarize(reports)
+        results[name]['rows'] = manifest['rows']
+        results[name]['chunksize'] = args.chunksize
+        slower = print_comparison(name, results[name], baseline.get(name), args.tolerance)
+        failed.extend(f"{stage} (scale {name})" for stage in slower)
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        return 0
+    if failed:
+        print(f"\nSlower than the baseline by more than {args.tolerance:.0%}: {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# Synthetic source data for the ETL benchmark: patients.csv, slots.csv, appointments.csv, the insurance
+# API sample and the healthcare.db source database, at a scale factor of the shipped dataset (1 = 36,697
+# patients, 104,360 slots and 111,488 appointments). Generated with a fixed seed, so a scale always
+# produces the same files.
+#
+#   python benchmarks/generate_data.py --scale 10 benchmarks/data/scale_10
+import argparse
+import json
+import shutil
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Repository root, for the seed data and the source database builder
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from db_init.sql_database_create import create_sql_database_source, SEED_DIR
+
+# Rows of each source at scale factor 1 (the shipped dataset)
+BASE_ROWS = {
+    'patients': 36697,
+    'slots': 104360,
+    'appointments': 111488,
+    'doctors': 300,
+    'insurance_companies': 11
+}
+
+# Rows generated and written per chunk, bounds the memory of the large scales
+CHUNK_ROWS = 1_000_000
+
+# Distributions taken from the shipped dataset
+SEX_WEIGHTS = {'Female': 0.593, 'Male': 0.407}
+DOB_RANGE = ('1924-01-01', '2009-12-31')
+SLOT_DATE_RANGE = ('2015-01-01', '2024-12-31')
+SLOT_AVAILABLE_SHARE = 0.107
+STATUS_WEIGHTS = {'attended': 0.71, 'cancelled': 0.11, 'did not attend': 0.09, 'scheduled': 0.06, 'unknown': 0.03}
+INSURANCE_TYPES = {'Private': 5, 'Non-profit': 3, 'Public': 3}
+COVERAGE_AREAS = {'Nationwide': 4, 'Regional': 4, 'Local': 3}
+
+# Slots every 15 minutes from 08:00 to 17:45 on weekdays
+SLOT_TIMES = pd.date_range('08:00', '17:45', freq='15min').strftime('%H:%M:%S').to_numpy()
+
+AGE_GROUPS = ([0, 18, 35, 55, 75, 200], ['0-18', '19-35', '36-55', '56-75', '76+'])
+
+def choice(rng, weights, size):
+    values = np.array(list(weights))
+    p = np.array(list(weights.values()), dtype=float)
+    return values[rng.choice(len(values), size=size, p=p / p.sum())]
+
+# Skewed popularity (Zipf-like over the ranks): a few insurers, doctors and patients take most appointments
+def popularity(rng, size, exponent=1.1, shuffle=True):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    if shuffle:
+        rng.shuffle(weights)
+    return weights / weights.sum()
+
+def write_chunks(path, chunks):
+    path = Path(path)
+    if path.exists():
+        path.unlink()
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(path, mode='a', header=(i == 0), index=False)
+        rows += len(chunk)
+    return rows
+
+def chunk_ranges(total, chunk_rows=CHUNK_ROWS):
+    for start in range(0, total, chunk_rows):
+        yield start, min(start + chunk_rows, total)
+
+# Insurance companies of the API sample: the shipped ones first (patients reference them by name)
+def insurance_companies(rng, count):
+    with open(ROOT / 'data' / 'api_sample.json', encoding='utf-8') as f:
+        companies = json.load(f)[:count]
+    types = choice(rng, INSURANCE_TYPES, count)
+    areas = choice(rng, COVERAGE_AREAS, count)
+    founded = rng.integers(1950, 2021, count)
+    for i in range(len(companies), count):
+        companies.append({
+            'rownum': i + 1,
+            'insurance_company_name': f"Insurer {i + 1:05d}",
+            'insurance_company_type': str(types[i]),
+            'founded_year': int(founded[i]),
+            'coverage_area': str(areas[i])
+        })
+    return companies
+
+def patient_chunks(rng, count, insurance_names, first_names, last_names):
+    dob_start, dob_end = (np.datetime64(date) for date in DOB_RANGE)
+    insurance_p = popularity(rng, len(insurance_names), shuffle=False)
+    width = max(5, len(str(count)))
+    for start, end in chunk_ranges(count):
+        size = end - start
+        dob = dob_start + rng.integers(0, (dob_end - dob_start).astype(int), size).astype('timedelta64[D]')
+        yield pd.DataFrame({
+            'patient_id': pd.Series(np.arange(start + 1, end + 1)).astype(str).str.zfill(width),
+            'name': pd.Series(first_names[rng.integers(0, len(first_names), size)])
+                    + ' ' + last_names[rng.integers(0, len(last_names), size)],
+            'sex': choice(rng, SEX_WEIGHTS, size),
+            'dob': pd.to_datetime(dob).strftime('%Y-%m-%d'),
+            'insurance': insurance_names[rng.choice(len(insurance_names), size, p=insurance_p)]
+        })
+
+# Slot dates and time indexes (into SLOT_TIMES), sorted so slot ids increase with time as in the shipped file
+def slot_arrays(rng, count):
+    days = pd.bdate_range(*SLOT_DATE_RANGE).to_numpy()
+    day_index = rng.integers(0, len(days), count)
+    time_index = rng.integers(0, len(SLOT_TIMES), count)
+    order = np.lexsort((time_index, day_index))
+    return days[day_index[order]], time_index[order]
+
+def slot_chunks(rng, dates, time_index):
+    width = max(7, len(str(len(dates))))
+    for start, end in chunk_ranges(len(dates)):
+        yield pd.DataFrame({
+            'slot_id': pd.Series(np.arange(start + 1, end + 1)).astype(str).str.zfill(width),
+            'appointment_date': pd.DatetimeIndex(dates[start:end]).strftime('%Y-%m-%d'),
+            'appointment_time': SLOT_TIMES[time_index[start:end]],
+            'is_available': rng.random(end - start) < SLOT_AVAILABLE_SHARE
+        })
+
+def appointment_chunks(rng, count, slot_dates, slot_time_index, patient_sex, patient_dob):
+    patient_p = popularity(rng, len(patient_sex), exponent=0.6)
+    # Appointments follow the slots in time, so appointment ids increase with the date
+    slot_index = np.sort(rng.integers(0, len(slot_dates), count))
+    for start, end in chunk_ranges(count):
+        size = end - start
+        slot_rows = slot_index[start:end]
+        appointment_date = slot_dates[slot_rows]
+        time_index = slot_time_index[slot_rows]
+        scheduling_interval = np.minimum(rng.geometric(1 / 14, size) - 1, 365)
+        status = choice(rng, STATUS_WEIGHTS, size)
+        attended = status == 'attended'
+
+        # Attended appointments: check-in before the slot, a wait, then the visit
+        slot_time = pd.Series(appointment_date + ((8 * 60 + 15 * time_index) * 60).astype('timedelta64[s]'))
+        check_in = slot_time - pd.to_timedelta(rng.integers(0, 16, size), unit='min')
+        waiting = np.round(rng.exponential(10, size), 1)
+        duration = np.round(rng.gamma(4, 5, size), 1)
+        start_time = check_in + pd.to_timedelta(waiting, unit='min')
+        end_time = start_time + pd.to_timedelta(duration, unit='min')
+
+        patient = rng.choice(len(patient_sex), size, p=patient_p)
+        age = (appointment_date - patient_dob[patient]).astype('timedelta64[D]').astype(np.int64) * 4 // 1461
+        yield pd.DataFrame({
+            'appointment_id': np.arange(start + 1, end + 1),
+            'slot_id': slot_rows + 1,
+            'scheduling_date': pd.DatetimeIndex(appointment_date - scheduling_interval.astype('timedelta64[D]')).strftime('%Y-%m-%d'),
+            'appointment_date': pd.DatetimeIndex(appointment_date).strftime('%Y-%m-%d'),
+            'appointment_time': SLOT_TIMES[time_index],
+            'scheduling_interval': scheduling_interval,
+            'status': status,
+            'check_in_time': check_in.dt.strftime('%H:%M:%S').where(attended, ''),
+            'appointment_duration': np.where(attended, duration, np.nan),
+            'start_time': start_time.dt.strftime('%H:%M:%S').where(attended, ''),
+            'end_time': end_time.dt.strftime('%H:%M:%S').where(attended, ''),
+            'waiting_time': np.where(attended, waiting, np.nan),
+            'patient_id': patient + 1,
+            'sex': patient_sex[patient],
+            'age': age,
+            'age_group': pd.cut(age, bins=AGE_GROUPS[0], labels=AGE_GROUPS[1], include_lowest=True).astype(str)
+        })
+
+# Doctors drawn from the shipped ones: names, specialties, experience and fees are resampled
+def doctor_frame(rng, count, seed_doctors):
+    sample = lambda column: seed_doctors[column].to_numpy()[rng.integers(0, len(seed_doctors), count)]
+    first_names, last_names = sample('first_name'), sample('last_name')
+    doctor_id = np.arange(1, count + 1)
+    return pd.DataFrame({
+        'doctor_id': doctor_id,
+        'first_name': first_names,
+        'last_name': last_names,
+        'email': [f"{first[0].lower()}{last.lower()}{i}@example.org" for first, last, i in zip(first_names, last_names, doctor_id)],
+        'phone': [f"+1 555 {number // 10000:03d} {number % 10000:04d}" for number in rng.integers(0, 10 ** 7, count)],
+        'specialty_id': sample('specialty_id'),
+        'years_of_experience': sample('years_of_experience'),
+        'appointment_fee': sample('appointment_fee'),
+        'gender': sample('gender')
+    })
+
+def doctor_appointment_chunks(rng, appointments, doctors):
+    doctor_p = popularity(rng, doctors, exponent=0.5)
+    for start, end in chunk_ranges(appointments):
+        yield pd.DataFrame({
+            'appointment_id': np.arange(start + 1, end + 1),
+            'doctor_id': rng.choice(doctors, end - start, p=doctor_p) + 1
+        })
+
+def generate(folder, scale=1, seed=1516):
+    start_time = time.perf_counter()
+    folder = Path(folder)
+    data_dir = folder / 'data'
+    seed_dir = folder / 'seed'
+    data_dir.mkdir(parents=True, exist_ok=True)
+    seed_dir.mkdir(parents=True, exist_ok=True)
+    rows = {name: max(1, int(round(count * scale))) for name, count in BASE_ROWS.items()}
+    rng = np.random.default_rng(seed)
+    seed_doctors = pd.read_csv(SEED_DIR / 'doctor.csv')
+
+    companies = insurance_companies(rng, rows['insurance_companies'])
+    with open(data_dir / 'api_sample.json', 'w', encoding='utf-8') as f:
+        json.dump(companies, f, indent=1)
+    insurance_names = np.array([company['insurance_company_name'] for company in companies])
+
+    first_names = seed_doctors['first_name'].to_numpy()
+    last_names = seed_doctors['last_name'].to_numpy()
+    patients = []
+    def keep(chunks):
+        for chunk in chunks:
+            patients.append(chunk[['sex', 'dob']])
+            yield chunk
+    write_chunks(data_dir / 'patients.csv', keep(patient_chunks(rng, rows['patients'], insurance_names, first_names, last_names)))
+    patients = pd.concat(patients, ignore_index=True)
+
+    slot_dates, slot_time_index = slot_arrays(rng, rows['slots'])
+    write_chunks(data_dir / 'slots.csv', slot_chunks(rng, slot_dates, slot_time_index))
+
+    write_chunks(data_dir / 'appointments.csv', appointment_chunks(
+        rng, rows['appointments'], slot_dates, slot_time_index,
+        patients['sex'].to_numpy(), pd.to_datetime(patients['dob']).to_numpy()
+    ))
+
+    # Source database, built by the repo's builder from generated seed files
+    for table in ['specialty', 'coverage_type']:
+        shutil.copy(SEED_DIR / f"{table}.csv", seed_dir / f"{table}.csv")
+    doctor_frame(rng, rows['doctors'], seed_doctors).to_csv(seed_dir / 'doctor.csv', index=False)
+    write_chunks(seed_dir / 'doctor_appointment.csv', doctor_appointment_chunks(rng, rows['appointments'], rows['doctors']))
+    db_path = data_dir / 'healthcare.db'
+    if db_path.exists():
+        db_path.unlink()
+    create_sql_database_source(str(db_path), seed_dir=seed_dir)
+
+    elapsed = time.perf_counter() - start_time
+    manifest = {'scale': scale, 'seed': seed, 'rows': rows, 'generated_in_s': round(elapsed, 1)}
+    with open(folder / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Generated scale {scale} in '{folder}' in {elapsed:.1f}s: {rows}")
+    return manifest
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic ETL source data at a scale of the shipped dataset")
+    parser.add_argument('--scale', type=float, default=1, help="scale factor of the shipped dataset, e.g. 1, 10 or 100")
+    parser.add_argument('--seed', type=int, default=1516, help="random seed")
+    parser.add_argument('folder', help="folder to write data/ (the pipeline's sources) and seed/ into")
+    return parser.parse_args(args)
+
+if __name__ == "__main__":
+    args = parse_args()
+    generate(args.folder, args.scale, args.seed)
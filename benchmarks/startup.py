@@ -0,0 +1,107 @@
+# Startup benchmark: import time of the entry points, measured with python -X importtime in fresh
+# interpreters. Fails (exit code 1) when an entry point exceeds its budget.
+#
+#   python benchmarks/startup.py                 # warm start: bytecode already compiled
+#   python benchmarks/startup.py --cold          # cold start: every run compiles from source
+#   python benchmarks/startup.py --budget dashboard=1500
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Repository root, where the entry points are imported from
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import time budget per entry point in milliseconds (warm start)
+BUDGETS_MS = {
+    'main': 250,
+    'pipeline': 1200,
+    'dashboard': 1200
+}
+
+# Parse the -X importtime report (on stderr) into (module, depth, self time, cumulative time) rows in
+# report order; a module is reported after the modules it imports, which are one level deeper
+def parse_importtime(report):
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+# Cumulative import time of the entry point and the modules it imports directly (not the interpreter's own)
+def entry_point_times(rows, module):
+    index = max(i for i, row in enumerate(rows) if row[0] == module and row[1] == 0)
+    children = []
+    for name, depth, _, cumulative in reversed(rows[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((cumulative, name))
+    return rows[index][3], sorted(children, reverse=True)
+
+# Import the module in a fresh interpreter and return its import times; cold runs get an empty
+# bytecode cache, so every module (the repo's and the libraries') is compiled again
+def measure_import(module, cold=False):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory() as pycache:
+        if cold:
+            env['PYTHONPYCACHEPREFIX'] = pycache
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=ROOT, env=env, capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Measure the startup (import) time of the entry points")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per entry point, the median is reported")
+    parser.add_argument('--cold', action='store_true', help="compile every module from source in each run")
+    parser.add_argument('--top', type=int, default=5, help="slowest imported modules to list per entry point")
+    parser.add_argument(
+        '--budget',
+        action='append',
+        default=[],
+        metavar='MODULE=MS',
+        help="override the budget of an entry point, e.g. dashboard=1500"
+    )
+    parser.add_argument('modules', nargs='*', default=list(BUDGETS_MS), help="entry points to measure")
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = parse_args(args)
+    budgets = dict(BUDGETS_MS)
+    for budget in args.budget:
+        module, ms = budget.split('=')
+        budgets[module] = float(ms)
+
+    print(f"{'entry point':<12} {'median ms':>10} {'min ms':>8} {'budget ms':>10}  result")
+    failed = []
+    for module in args.modules:
+        runs = [entry_point_times(measure_import(module, cold=args.cold), module) for _ in range(args.runs)]
+        totals_ms = [total / 1000 for total, _ in runs]
+        median_ms = statistics.median(totals_ms)
+        budget_ms = budgets.get(module)
+        ok = budget_ms is None or median_ms <= budget_ms
+        if not ok:
+            failed.append(module)
+        budget = f"{budget_ms:.0f}" if budget_ms is not None else '-'
+        print(f"{module:<12} {median_ms:>10.0f} {min(totals_ms):>8.0f} {budget:>10}  {'ok' if ok else 'OVER BUDGET'}")
+
+        # Slowest direct imports of the last run, where to look when over budget
+        for cumulative, name in runs[-1][1][:args.top]:
+            print(f"    {name:<36} {cumulative / 1000:>8.0f} ms")
+
+    if failed:
+        print(f"Startup budget exceeded by: {', '.join(failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
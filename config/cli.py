@@ -0,0 +1,27 @@
+# Command line options of the ETL entry points (pipeline.py and main.py), standard library only so the
+# scheduler parses them without importing pandas and the ETL modules
+import argparse
+
+# Rows per chunk in streaming mode
+DEFAULT_CHUNKSIZE = 50000
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        description="Run the healthcare appointments ETL pipeline. After the first run the flat files are loaded "
+                    "incrementally and append-only: only rows added to them since the last run are read, rows "
+                    "edited in place (e.g. a changed appointment status or patient) are picked up by a full refresh."
+    )
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        help="ignore the stored high-water marks and reload every source from scratch, including rows changed in place"
+    )
+    parser.add_argument(
+        '--chunksize',
+        type=int,
+        nargs='?',
+        const=DEFAULT_CHUNKSIZE,
+        default=None,
+        help=f"stream the flat files in chunks of this many rows (default {DEFAULT_CHUNKSIZE}) to bound memory"
+    )
+    return parser.parse_args(args)
@@ -1,7 +1,10 @@
+import atexit
 import logging
 import os
+import queue
+import threading
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # Create logs directory if it doesn't exist
 logs_dir = Path('logs')
@@ -11,35 +14,122 @@ logs_dir.mkdir(exist_ok=True)
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
 
-def setup_logger(name):
-    # Create logger
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    
+# Lowest level written, e.g. LOG_LEVEL=DEBUG while investigating. Calls below it return before their
+# message is formatted, so debug logging in the hot paths costs nothing in production.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# With LOG_QUEUE=1 (the default) loggers only put records on a queue and one shared writer thread formats
+# and writes them; LOG_QUEUE=0 writes from the calling thread, e.g. to debug the logging itself
+LOG_QUEUE = os.getenv('LOG_QUEUE', '1') == '1'
+
+# Writes every record to the log file of its logger (logs/<logger name>.log), opening the files on first use
+class ModuleFileHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self._handlers = {}
+
+    def emit(self, record):
+        handler = self._handlers.get(record.name)
+        if handler is None:
+            # File handler - logs everything to file
+            handler = RotatingFileHandler(
+                logs_dir / f'{record.name}.log',
+                maxBytes=10*1024*1024,  # 10MB
+                backupCount=5
+            )
+            handler.setFormatter(self.formatter)
+            self._handlers[record.name] = handler
+        handler.emit(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        super().close()
+
+def create_handlers():
     # Create formatters
     formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
-    
-    # Create handlers
-    # File handler - logs everything to file
-    file_handler = RotatingFileHandler(
-        logs_dir / f'{name}.log',
-        maxBytes=10*1024*1024,  # 10MB
-        backupCount=5
-    )
-    file_handler.setLevel(logging.DEBUG)
+
+    file_handler = ModuleFileHandler()
     file_handler.setFormatter(formatter)
-    
+
     # Console handler - logs ERROR and above to console
     console_handler = logging.StreamHandler()
-    
+
     #we are using Print instead of logging to console, so only errors are shown
     #console_handler.setLevel(logging.INFO)
-    
+
     console_handler.setLevel(logging.ERROR)
     console_handler.setFormatter(formatter)
-    
+    return [file_handler, console_handler]
+
+# Handlers shared by every logger of the process, and the writer thread of the queue mode
+_lock = threading.Lock()
+_handlers = None
+_queue_handler = None
+_listener = None
+_listener_pid = None
+
+# Start (or, in a forked child such as a gunicorn worker, restart) the writer thread of this process
+def ensure_listener():
+    global _listener, _listener_pid
+    with _lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+        _listener = QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+# Write the queued records before the process exits
+def stop_listener():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+# A forked child starts with an empty queue of its own: records still queued in the parent at the fork
+# are written by the parent, and the parent's lock may have been held by a thread that does not exist here
+def reset_after_fork():
+    global _lock, _listener
+    _lock = threading.Lock()
+    _listener = None
+    if _queue_handler is not None:
+        _queue_handler.queue = queue.SimpleQueue()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+# Puts records on the shared queue. The message is merged with its arguments here, as late as possible:
+# only records that pass the level check get this far.
+class SharedQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        if _listener_pid != os.getpid():
+            ensure_listener()
+        super().enqueue(record)
+
+def shared_handlers():
+    global _handlers, _queue_handler
+    with _lock:
+        if _handlers is None:
+            _handlers = create_handlers()
+            if LOG_QUEUE:
+                _queue_handler = SharedQueueHandler(queue.SimpleQueue())
+                atexit.register(stop_listener)
+    if not LOG_QUEUE:
+        return _handlers
+    ensure_listener()
+    return [_queue_handler]
+
+def setup_logger(name):
+    # Create logger
+    logger = logging.getLogger(name)
+    logger.setLevel(LOG_LEVEL)
+
+    # Repeated calls for the same name return the logger as it is, instead of stacking handlers
+    if getattr(logger, '_configured', False):
+        return logger
+
     # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger 
\ No newline at end of file
+    for handler in shared_handlers():
+        logger.addHandler(handler)
+    logger._configured = True
+
+    return logger
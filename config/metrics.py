@@ -0,0 +1,143 @@
+# Import required libraries for the metrics endpoint (standard library only)
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Port of the metrics endpoint; unset (the default) serves no metrics
+METRICS_PORT = os.getenv('METRICS_PORT')
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+# Sample values keep their full precision (e.g. Unix timestamps), integral values are written without a fraction
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+# Gauges, counters and histograms of one process, rendered in the Prometheus text exposition format.
+# Collectors are called on every scrape to set gauges read from other objects (e.g. cache statistics).
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._values = {}
+        self._collectors = []
+
+    def describe(self, name, metric_type, help_text, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            self._metrics.setdefault(name, (metric_type, help_text, tuple(buckets)))
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = float(value)
+
+    # Drop every series of a metric, e.g. before setting the stages of a new run
+    def clear(self, name):
+        with self._lock:
+            for key in [key for key in self._values if key[0] == name]:
+                del self._values[key]
+
+    def inc_counter(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            buckets = self._metrics[name][2]
+            histogram = self._values.setdefault(key, {'buckets': [0] * len(buckets), 'count': 0, 'sum': 0.0})
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        for collector in list(self._collectors):
+            try:
+                collector(self)
+            except Exception as e:
+                logger.error("Metrics collector %s failed: %s", collector.__name__, e)
+
+        lines = []
+        with self._lock:
+            for name, (metric_type, help_text, buckets) in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for (series_name, labels), value in sorted(self._values.items(), key=lambda item: item[0]):
+                    if series_name != name:
+                        continue
+                    if metric_type != 'histogram':
+                        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                        continue
+                    for bound, count in zip(buckets, value['buckets']):
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {format_value(value['sum'])}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+        return '\n'.join(lines) + '\n'
+
+# Metrics of this process
+REGISTRY = MetricsRegistry()
+
+# Time every call of the function into a latency histogram, also calls that raise
+def observe_latency(name, registry=REGISTRY, **labels):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe(name, time.perf_counter() - start_time, **labels)
+        return wrapper
+    return decorator
+
+def metrics_handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        # Scrapes are not worth a log line each
+        def log_message(self, format, *args):
+            pass
+    return MetricsHandler
+
+# Serve GET /metrics from a daemon thread. Returns the server, or None when no port is configured or
+# the port is taken (e.g. by another worker process of the same app), in which case nothing is served.
+def start_metrics_server(port=METRICS_PORT, registry=REGISTRY, host='0.0.0.0'):
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, int(port)), metrics_handler(registry))
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on port %s: %s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
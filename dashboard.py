@@ -1,46 +1,50 @@
 import dash
 from dash import dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
-import plotly.express as px
 import sqlite3
-import pandas as pd
 from datetime import datetime
-import functools
 import os
+import importlib.util
 import logging
 import pytz
+from olap.query import CubeQuery, Range, normalize_filters
+from olap.cache import VersionedCache, LRUCache, filter_key, warehouse_version
+from config.metrics import REGISTRY, observe_latency, start_metrics_server
+# pandas, plotly and the in-memory backend are imported where they are first used, so the workers start
+# (and answer the first page load) without paying for them
 
 # Database path from environment variable
 DB_PATH = os.getenv('DB_PATH', 'warehouse/warehouse.db')
 
+# Where queries no rollup covers are answered: 'memory' runs them in the filter engine of each worker over
+# the shared snapshot (the default, about 30x faster aggregates in benchmarks/dashboard_benchmark.py),
+# 'sql' aggregates the fact table in the warehouse (the default without pyarrow, and the smaller footprint)
+QUERY_BACKEND = os.getenv('QUERY_BACKEND', 'memory' if importlib.util.find_spec('pyarrow') else 'sql')
+
+# Memory for the chart aggregates of recent filter states, in MB
+RESULT_CACHE_MB = int(os.getenv('RESULT_CACHE_MB', '64'))
+
 # Initialize Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP], suppress_callback_exceptions=True)
 app.title = "Healthcare appointments dashboard"
+# WSGI entry point, e.g. gunicorn --workers 4 dashboard:server
+server = app.server
+
+# Appointment cube published by the loader, mapped by every worker process without copying it.
+# Only the memory backend uses it, so it is created on first use.
+CUBE_STORE = None
+
+def get_cube_store():
+    global CUBE_STORE
+    if CUBE_STORE is None:
+        from olap.shared_store import SharedCubeStore
+        CUBE_STORE = SharedCubeStore(DB_PATH)
+    return CUBE_STORE
 
-# Cache data retrieval to improve performance
-@functools.lru_cache(maxsize=1)
-def get_data():
+def load_data():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        query = """
-            SELECT fa.*, dd.year, dd.month, dd.weekday,
-                   das.status_title, dds.specialty_title,
-                   dic.insurance_company_name, dct.coverage_title as coverage_type,
-                   dp.gender,
-                   ddoc.years_of_experience, ddoc.appointment_fee,
-                   ddoc.gender as doctor_gender
-            FROM fact_appointment fa
-            JOIN dim_date dd ON fa.appointment_date_id = dd.date_id
-            JOIN dim_appointment_status das ON fa.appointment_status_id = das.status_id
-            JOIN dim_doctor ddoc ON fa.doctor_id = ddoc.doctor_id
-            JOIN dim_doctor_specialty dds ON ddoc.specialty_id = dds.specialty_id
-            JOIN dim_patient dp ON fa.patient_id = dp.patient_id
-            JOIN dim_insurance_company dic ON dp.insurance_company_id = dic.insurance_company_id
-            JOIN dim_coverage_type dct ON dp.coverage_type_id = dct.coverage_type_id
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
+        # Memory-mapped snapshot written by the last load, or the star schema join without one
+        return get_cube_store().attach()
     except Exception as e:
         print(f"Error connecting to database: {e}")
         print(f"Database path: {DB_PATH}")
@@ -48,9 +52,8 @@ def get_data():
         print(f"Directory contents: {os.listdir('.')}")
         raise
 
-# Cache filter options to improve performance
-@functools.lru_cache(maxsize=1)
-def get_filter_options():
+def load_filter_options():
+    import pandas as pd
     conn = sqlite3.connect(DB_PATH)
     years = pd.read_sql("SELECT DISTINCT year FROM dim_date ORDER BY year", conn)["year"]
     months = pd.read_sql("SELECT DISTINCT month FROM dim_date ORDER BY month", conn)["month"]
@@ -77,6 +80,46 @@ def get_filter_options():
         "age_range": (age_range["min_age"], age_range["max_age"])
     }
 
+# Cache data and filter options per warehouse version: after a load the next refresh tick starts a
+# background reload and keeps serving the previous data until it is done. With the memory backend the cube
+# is cached with its filter engine, built on first use once per version and shared by every callback.
+# The cube is reattached when the loader publishes a new snapshot, without restarting the worker.
+DATA_CACHE = VersionedCache("appointment cube", lambda: build_filter_engine(), lambda: get_cube_store().version())
+FILTER_OPTIONS_CACHE = VersionedCache("filter options", load_filter_options, lambda: warehouse_version(DB_PATH))
+
+# Chart aggregates per filter state and warehouse version, shared by the callbacks: the refresh tick and
+# the second callback run after a chart click are answered without querying again
+RESULT_CACHE = LRUCache(RESULT_CACHE_MB * 1024 ** 2)
+
+# Runtime metrics of the worker on http://<host>:$METRICS_PORT/metrics when METRICS_PORT is set. Each
+# worker process keeps its own; with several gunicorn workers only the first to bind the port serves them.
+REGISTRY.describe('dashboard_callback_duration_seconds', 'histogram', "Latency of the chart callbacks")
+REGISTRY.describe('dashboard_cache_hits_total', 'counter', "Chart aggregates answered from the result cache")
+REGISTRY.describe('dashboard_cache_misses_total', 'counter', "Chart aggregates computed and added to the result cache")
+REGISTRY.describe('dashboard_cache_hit_ratio', 'gauge', "Share of chart aggregate lookups answered from the result cache")
+REGISTRY.describe('dashboard_cache_bytes', 'gauge', "Memory held by the result cache")
+
+def collect_cache_metrics(registry):
+    stats = RESULT_CACHE.stats()
+    lookups = stats['hits'] + stats['misses']
+    registry.set_gauge('dashboard_cache_hits_total', stats['hits'], cache='result')
+    registry.set_gauge('dashboard_cache_misses_total', stats['misses'], cache='result')
+    registry.set_gauge('dashboard_cache_hit_ratio', stats['hits'] / lookups if lookups else 0.0, cache='result')
+    registry.set_gauge('dashboard_cache_bytes', stats['bytes'], cache='result')
+
+REGISTRY.add_collector(collect_cache_metrics)
+start_metrics_server()
+
+def build_filter_engine():
+    from olap.filters import FilterEngine
+    return FilterEngine(load_data())
+
+def get_filter_engine():
+    return DATA_CACHE.get()
+
+def get_filter_options():
+    return FILTER_OPTIONS_CACHE.get()
+
 def build_filters(options):
     return dbc.Row([
         dbc.Col([
@@ -187,46 +230,66 @@ def build_filters(options):
         ], width=2)
     ], className="mb-4")
 
-def filter_data(df, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type):
-    if year != "All":
-        df = df[df["year"].astype(str) == year]
-    if month != "All":
-        df = df[df["month"].astype(str) == month]
-    if weekday != "All":
-        df = df[df["weekday"] == weekday]
-    if status != "All":
-        df = df[df["status_title"] == status]
-    if specialty != "All":
-        df = df[df["specialty_title"] == specialty]
-    if insurance != "All":
-        df = df[df["insurance_company_name"] == insurance]
-    if gender != "All":
-        df = df[df["gender"] == gender]
-    if doctor_gender != "All":  # Add doctor gender filtering
-        df = df[df["doctor_gender"] == doctor_gender]
-    if coverage_type != "All":  # Add coverage type filtering
-        # Handle multiple selected coverage types
-        if isinstance(coverage_type, list):
-            if "All" not in coverage_type:
-                df = df[df["coverage_type"].isin(coverage_type)]
-        else:
-            df = df[df["coverage_type"] == coverage_type]
-    if age_range:
-        df = df[(df["patient_age"] >= age_range[0]) & (df["patient_age"] <= age_range[1])]        
-    return df
+# Filters of the selected UI values, answered by the rollups or the filter engine (olap/filters.py)
+def chart_filters(year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type, years=None):
+    # The full age range selects every appointment
+    full_age_range = [int(age) for age in get_filter_options()["age_range"]]
+    filters = {
+        "year": int(year) if year != "All" else None,
+        "month": int(month) if month != "All" else None,
+        "weekday": weekday,
+        "status_title": status,
+        "specialty_title": specialty,
+        "insurance_company_name": insurance,
+        "gender": gender,
+        "doctor_gender": doctor_gender,
+        "coverage_type": coverage_type,
+        "patient_age": Range(*age_range) if age_range and list(age_range) != full_age_range else None
+    }
+    # Drill-down year range, within the selected year if there is one
+    if years is not None:
+        filters["year"] = [y for y in years if filters["year"] is None or y == filters["year"]]
+    return filters
+
+# Aggregates compute(query) of a group of charts for one filter state, answered by the rollup tables where
+# they cover the filters and by QUERY_BACKEND otherwise; from the result cache when the same state was
+# answered for the current warehouse version
+def cached_aggregates(name, compute, *filter_values, years=None):
+    filters = chart_filters(*filter_values, years=years)
+    version = warehouse_version(DB_PATH)
+    key = (name, version, filter_key(normalize_filters(filters)))
+    result = RESULT_CACHE.get(key)
+    if result is None:
+        with CubeQuery(DB_PATH, filters, get_filter_engine if QUERY_BACKEND == 'memory' else None) as query:
+            result = compute(query)
+            # While the cube reloads the filter engine still holds the previous version's data
+            current = not query.used_engine or DATA_CACHE.version == get_cube_store().version()
+        if current:
+            RESULT_CACHE.put(key, result)
+    return result
+
+# Aggregates behind the summary statistics and the charts of the main grid
+def chart_aggregates(query):
+    return {
+        "totals": query.aggregate([], ['appointment_count', 'doctor_count', 'patient_count']).iloc[0],
+        "gender_counts": query.aggregate(['gender']),
+        "status_counts": query.aggregate(['status_title']),
+        "insurance_by_gender": query.aggregate(['insurance_company_name', 'gender']),
+        "gender_by_specialty": query.aggregate(['specialty_title', 'gender']),
+        "specialty_revenue": query.aggregate(['specialty_title'], ['fee_sum', 'appointment_count'])
+    }
+
+# Monthly appointments by year behind the drill-down chart
+def drilldown_aggregates(query):
+    return query.aggregate(['year', 'month']).rename(columns={'appointment_count': 'count'})
 
 def create_layout():
-    df = get_data()
     options = get_filter_options()
     
     # Calculate default year range (last 4 years)
     max_year = max(options["years"])
     min_year = max_year - 3  # Last 4 years
     
-    # Calculate summary statistics
-    total_appointments = len(df)
-    total_doctors = df['doctor_id'].nunique()
-    
     return html.Div([
         dcc.Store(id="auto-refresh-enabled", data=True),
         dcc.Interval(id="interval-refresh", interval=54000, n_intervals=0, disabled=False),  # Set to 15 min (54000 ms)
@@ -306,14 +369,22 @@ def create_layout():
      Input("doctor-gender-filter", "value"),
      Input("coverage-type-filter", "value")]  # Add coverage type filter input
 )
+@observe_latency('dashboard_callback_duration_seconds', callback='update_charts')
 def update_charts(_, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type):
-    df = get_data()
-    df = filter_data(df, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type)
-
+    import plotly.express as px
+    aggregates = cached_aggregates("charts", chart_aggregates, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type)
     # Calculate summary statistics
-    total_appointments = len(df)
-    total_doctors = df['doctor_id'].nunique()
-    total_patients = df['patient_id'].nunique()
+    totals = aggregates["totals"]
+    # Aggregates behind the charts
+    gender_counts = aggregates["gender_counts"]
+    status_counts = aggregates["status_counts"]
+    insurance_by_gender = aggregates["insurance_by_gender"]
+    gender_by_specialty = aggregates["gender_by_specialty"]
+    specialty_revenue = aggregates["specialty_revenue"]
+
+    total_appointments = int(totals['appointment_count'])
+    total_doctors = int(totals['doctor_count'])
+    total_patients = int(totals['patient_count'])
 
     # Original charts with loaders
     charts = dbc.Row([
@@ -347,7 +418,7 @@ def update_charts(_, year, month, weekday, status, specialty, insurance, gender,
                 color="#17a2b8",
                 children=dcc.Graph(
                     id="gender-pie-chart",
-                    figure=px.pie(df, names="gender", title="Appointments by Patient gender", hole=0.5)
+                    figure=px.pie(gender_counts, names="gender", values="appointment_count", title="Appointments by Patient gender", hole=0.5)
                     .update_traces(textinfo='label+percent+value')
                     .update_layout(
                         legend=dict(
@@ -368,7 +439,7 @@ def update_charts(_, year, month, weekday, status, specialty, insurance, gender,
                 color="#17a2b8",
                 children=dcc.Graph(
                     id="status-pie-chart",
-                    figure=px.pie(df, names="status_title", title="Appointments by Status", hole=0.5)
+                    figure=px.pie(status_counts, names="status_title", values="appointment_count", title="Appointments by Status", hole=0.5)
                     .update_traces(textinfo='label+percent+value')
                 )
             ),
@@ -378,10 +449,10 @@ def update_charts(_, year, month, weekday, status, specialty, insurance, gender,
     
     # Gender distribution charts
     # Insurance chart with gender distribution
-    insurance_by_gender = df.groupby(['insurance_company_name', 'gender']).size().reset_index(name='count')
+    insurance_by_gender = insurance_by_gender.rename(columns={'appointment_count': 'count'})
     
     # Calculate totals for each insurance company
-    insurance_totals = df.groupby('insurance_company_name').size().reset_index(name='total')
+    insurance_totals = insurance_by_gender.groupby('insurance_company_name', as_index=False)['count'].sum().rename(columns={'count': 'total'})
     
     insurance_gender_fig = px.bar(
         insurance_by_gender, 
@@ -443,16 +514,16 @@ def update_charts(_, year, month, weekday, status, specialty, insurance, gender,
                 color="#17a2b8",
                 children=dcc.Graph(
                     id="profitable-specialties-chart",
-                    figure=create_profitable_specialties_chart(df)
+                    figure=create_profitable_specialties_chart(specialty_revenue)
                 )
             ),
         ], width=6)
     ])
     
     # Specialty chart with gender distribution
-    gender_by_specialty = df.groupby(['specialty_title', 'gender']).size().reset_index(name='count')
+    gender_by_specialty = gender_by_specialty.rename(columns={'appointment_count': 'count'})
     # Calculate totals for each insurance company
-    specialty_totals = df.groupby('specialty_title').size().reset_index(name='total')
+    specialty_totals = gender_by_specialty.groupby('specialty_title', as_index=False)['count'].sum().rename(columns={'count': 'total'})
 
     specialty_gender_fig = px.bar(
         gender_by_specialty, 
@@ -515,12 +586,10 @@ def update_charts(_, year, month, weekday, status, specialty, insurance, gender,
             specialty_gender_chart], updated_time
 
 # Function to create the top 5 profitable specialties chart
-def create_profitable_specialties_chart(df):
-    # Calculate revenue by specialty (appointment count * appointment fee)
-    specialty_revenue = df.groupby('specialty_title').agg(
-        total_revenue=('appointment_fee', 'sum'),
-        appointment_count=('appointment_id', 'count')
-    ).reset_index()
+def create_profitable_specialties_chart(specialty_revenue):
+    import plotly.express as px
+    # Revenue by specialty (sum of the appointment fees)
+    specialty_revenue = specialty_revenue.rename(columns={'fee_sum': 'total_revenue'})
     
     # Sort by revenue and get top 7
     top_7_specialties = specialty_revenue.sort_values('total_revenue', ascending=False).head(7)
@@ -568,17 +637,13 @@ def create_profitable_specialties_chart(df):
      Input("doctor-gender-filter", "value"),
      Input("coverage-type-filter", "value")]  # Add coverage type filter input
 )
+@observe_latency('dashboard_callback_duration_seconds', callback='update_drilldown_chart')
 def update_drilldown_chart(drilldown_year_range, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type):
-    df = get_data()
-    
-    # Apply all filters to the data
-    df = filter_data(df, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type)
-    
-    # Filter by selected year range
-    drilldown_df = df[(df['year'] >= drilldown_year_range[0]) & (df['year'] <= drilldown_year_range[1])]
-    
+    import plotly.express as px
+    # Apply all filters and the selected year range
+    years = list(range(drilldown_year_range[0], drilldown_year_range[1] + 1))
     # Group by year and month (using month numbers for calculations)
-    drilldown_df = drilldown_df.groupby(['year', 'month']).size().reset_index(name='count')
+    drilldown_df = cached_aggregates("drilldown", drilldown_aggregates, year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type, years=years)
     
     # Create a mapping for month names (for display only)
     month_names = {
@@ -726,7 +791,9 @@ def update_filters_from_chart_click(gender_click, status_click, insurance_click,
     
     return year, month, weekday, status, specialty, insurance, gender, age_range, doctor_gender, coverage_type
 
-app.layout = create_layout()
+# Layout as a function: Dash builds it on every page load, so importing the app does not read the warehouse
+# and a reload shows the filter options of the latest load
+app.layout = create_layout
 
 if __name__ == "__main__":
     app.run(debug=True) 
\ No newline at end of file
@@ -1,8 +1,12 @@
+import os
+import importlib.util
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import sqlite3
-import numpy as np
+from olap.query import CubeQuery
+from olap.cache import warehouse_version
+
+# pandas, plotly and the in-memory backend (numpy, pyarrow) are imported where they are first used,
+# so the first page is served without paying for them
 
 # Set page configuration
 st.set_page_config(
@@ -58,34 +62,29 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Database connection
-@st.cache_data(ttl=3600)
-def get_data():
-    conn = sqlite3.connect('warehouse/warehouse.db')
-    query = """
-        SELECT fa.*, dd.year, dd.month, dd.weekday,
-               das.status_title, dds.specialty_title,
-               dic.insurance_company_name, dct.coverage_title as coverage_type,
-               dp.gender, fa.patient_age,
-               ddoc.years_of_experience, ddoc.appointment_fee,
-               ddoc.gender as doctor_gender
-        FROM fact_appointment fa
-        JOIN dim_date dd ON fa.appointment_date_id = dd.date_id
-        JOIN dim_appointment_status das ON fa.appointment_status_id = das.status_id
-        JOIN dim_doctor ddoc ON fa.doctor_id = ddoc.doctor_id
-        JOIN dim_doctor_specialty dds ON ddoc.specialty_id = dds.specialty_id
-        JOIN dim_patient dp ON fa.patient_id = dp.patient_id
-        JOIN dim_insurance_company dic ON dp.insurance_company_id = dic.insurance_company_id
-        JOIN dim_coverage_type dct ON dp.coverage_type_id = dct.coverage_type_id
-    """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+# Path of the warehouse database
+DB_PATH = 'warehouse/warehouse.db'
+
+# Where queries no rollup covers are answered: 'memory' loads the appointment cube into a filter engine
+# shared by all sessions (the default), 'sql' aggregates the fact table in the warehouse (without pyarrow)
+QUERY_BACKEND = os.getenv('QUERY_BACKEND', 'memory' if importlib.util.find_spec('pyarrow') else 'sql')
+
+# Appointment cube published by the loader, memory-mapped instead of copied into each session's cache.
+# Only the memory backend uses it, so it is created on first use.
+CUBE_STORE = None
+
+def get_cube_store():
+    global CUBE_STORE
+    if CUBE_STORE is None:
+        from olap.shared_store import SharedCubeStore
+        CUBE_STORE = SharedCubeStore(DB_PATH)
+    return CUBE_STORE
 
 # Get filter options
-@st.cache_data(ttl=3600)
-def get_filter_options():
-    conn = sqlite3.connect('warehouse/warehouse.db')
+@st.cache_data(max_entries=2)
+def get_filter_options(version):
+    import pandas as pd
+    conn = sqlite3.connect(DB_PATH)
     years = pd.read_sql("SELECT DISTINCT year FROM dim_date ORDER BY year", conn)["year"]
     specialties = pd.read_sql("SELECT DISTINCT specialty_title FROM dim_doctor_specialty", conn)["specialty_title"]
     statuses = pd.read_sql("SELECT DISTINCT status_title FROM dim_appointment_status", conn)["status_title"]
@@ -98,31 +97,21 @@ def get_filter_options():
         "coverage_types": coverage_types
     }
 
-# Simple filter function
-def apply_filters(df, year, specialty, status, gender, coverage_type):
-    # Make a copy to avoid modifying the original dataframe
-    df_filtered = df.copy()
-    
-    if year != "All":
-        df_filtered = df_filtered[df_filtered["year"].astype(str) == year]
-    if specialty != "All":
-        df_filtered = df_filtered[df_filtered["specialty_title"] == specialty]
-    if status != "All":
-        df_filtered = df_filtered[df_filtered["status_title"] == status]
-    if gender != "All":
-        df_filtered = df_filtered[df_filtered["gender"] == gender]
-    if coverage_type != "All":
-        df_filtered = df_filtered[df_filtered["coverage_type"] == coverage_type]
-    
-    return df_filtered
+# Filter engine of the cube (olap/filters.py), built once per version of the warehouse and its snapshot
+# (so a new load is picked up on the next rerun and unchanged data is never reloaded) and shared by all sessions
+@st.cache_resource(max_entries=2)
+def get_filter_engine(version):
+    from olap.filters import FilterEngine
+    return FilterEngine(get_cube_store().attach())
 
 # Function to create summary metrics
-def create_summary_metrics(df):
+def create_summary_metrics(query):
     # Calculate metrics
-    total_appointments = len(df)
-    total_doctors = df['doctor_id'].nunique()
-    total_patients = df['patient_id'].nunique()
-    total_revenue = df['appointment_fee'].sum()
+    totals = query.aggregate([], ['appointment_count', 'doctor_count', 'patient_count', 'fee_sum']).iloc[0]
+    total_appointments = int(totals['appointment_count'])
+    total_doctors = int(totals['doctor_count'])
+    total_patients = int(totals['patient_count'])
+    total_revenue = totals['fee_sum']
     
     col1, col2, col3, col4 = st.columns(4)
     
@@ -159,9 +148,10 @@ def create_summary_metrics(df):
         """.format(total_revenue), unsafe_allow_html=True)
 
 # Function to create time series chart (Roll-up operation)
-def create_time_series_chart(df):
+def create_time_series_chart(query):
+    import plotly.express as px
     # Group by year and month, count appointments
-    monthly_counts = df.groupby(['year', 'month']).size().reset_index(name='count')
+    monthly_counts = query.aggregate(['year', 'month']).rename(columns={'appointment_count': 'count'})
     
     # Create month names for better readability
     month_names = {
@@ -211,9 +201,10 @@ def create_time_series_chart(df):
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Function to create dimension analysis chart (Slice operation)
-def create_dimension_analysis_chart(df):
+def create_dimension_analysis_chart(query):
+    import plotly.express as px
     # Group by specialty and count appointments
-    specialty_counts = df.groupby('specialty_title', as_index=False).size()
+    specialty_counts = query.aggregate(['specialty_title'])
     specialty_counts.columns = ['specialty_title', 'count']
     
     # Sort by count in descending order
@@ -245,9 +236,10 @@ def create_dimension_analysis_chart(df):
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Function to create patient gender pie chart
-def create_patient_gender_pie_chart(df):
+def create_patient_gender_pie_chart(query):
+    import plotly.express as px
     # Group by patient gender and count appointments
-    gender_counts = df.groupby('gender', as_index=False).size()
+    gender_counts = query.aggregate(['gender'])
     gender_counts.columns = ['gender', 'count']
     
     # Create pie chart
@@ -275,9 +267,10 @@ def create_patient_gender_pie_chart(df):
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Function to create coverage type pie chart
-def create_coverage_type_pie_chart(df):
+def create_coverage_type_pie_chart(query):
+    import plotly.express as px
     # Group by coverage type and count appointments
-    coverage_counts = df.groupby('coverage_type', as_index=False).size()
+    coverage_counts = query.aggregate(['coverage_type'])
     coverage_counts.columns = ['coverage_type', 'count']
     
     # Create pie chart
@@ -305,9 +298,10 @@ def create_coverage_type_pie_chart(df):
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Function to create slice and dice chart
-def create_slice_dice_chart(df):
+def create_slice_dice_chart(query):
+    import plotly.express as px
     # Group by specialty and status, count appointments
-    specialty_status_counts = df.groupby(['specialty_title', 'status_title'], as_index=False).size()
+    specialty_status_counts = query.aggregate(['specialty_title', 'status_title'])
     specialty_status_counts.columns = ['specialty_title', 'status_title', 'count']
     
     # Create stacked bar chart
@@ -342,9 +336,10 @@ def create_slice_dice_chart(df):
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Function to create pie chart for appointment status
-def create_status_pie_chart(df):
+def create_status_pie_chart(query):
+    import plotly.express as px
     # Group by status and count appointments
-    status_counts = df.groupby('status_title', as_index=False).size()
+    status_counts = query.aggregate(['status_title'])
     status_counts.columns = ['status_title', 'count']
     
     # Sort by count in descending order
@@ -376,9 +371,10 @@ def create_status_pie_chart(df):
     st.markdown("</div>", unsafe_allow_html=True)
 
 # Function to create pie chart for insurance company
-def create_insurance_pie_chart(df):
+def create_insurance_pie_chart(query):
+    import plotly.express as px
     # Group by insurance company and count appointments
-    insurance_counts = df.groupby('insurance_company_name', as_index=False).size()
+    insurance_counts = query.aggregate(['insurance_company_name'])
     insurance_counts.columns = ['insurance_company_name', 'count']
     
     # Sort by count in descending order
@@ -427,8 +423,8 @@ def main():
     
     # Load data and filter options
     try:
-        df = get_data()
-        options = get_filter_options()
+        version = warehouse_version(DB_PATH)
+        options = get_filter_options(version)
         
         # Year filter
         year = st.sidebar.selectbox(
@@ -465,28 +461,36 @@ def main():
             index=0
         )
         
-        # Apply filters
-        filtered_df = apply_filters(df, year, specialty, status, gender, coverage_type)
-        
-        # Create summary metrics
-        create_summary_metrics(filtered_df)
-        
-        # Create charts
-        create_time_series_chart(filtered_df)
-        create_dimension_analysis_chart(filtered_df)
-        
-        # Create two pie charts instead of the problematic drill-down chart
-        col1, col2 = st.columns(2)
-        with col1:
-            create_patient_gender_pie_chart(filtered_df)
-        with col2:
-            create_coverage_type_pie_chart(filtered_df)
+        # Apply filters: charts are answered from the rollup tables, and what they cannot answer (distinct
+        # doctor and patient counts) by an aggregate query on the fact table or the in-memory filter engine
+        filters = {
+            "year": year,
+            "specialty_title": specialty,
+            "status_title": status,
+            "gender": gender,
+            "coverage_type": coverage_type
+        }
+        get_engine = (lambda: get_filter_engine(get_cube_store().version())) if QUERY_BACKEND == 'memory' else None
+        with CubeQuery(DB_PATH, filters, get_engine) as query:
+            # Create summary metrics
+            create_summary_metrics(query)
             
-        create_slice_dice_chart(filtered_df)
-        
-        # Create pie charts
-        create_status_pie_chart(filtered_df)
-        create_insurance_pie_chart(filtered_df)
+            # Create charts
+            create_time_series_chart(query)
+            create_dimension_analysis_chart(query)
+            
+            # Create two pie charts instead of the problematic drill-down chart
+            col1, col2 = st.columns(2)
+            with col1:
+                create_patient_gender_pie_chart(query)
+            with col2:
+                create_coverage_type_pie_chart(query)
+                
+            create_slice_dice_chart(query)
+            
+            # Create pie charts
+            create_status_pie_chart(query)
+            create_insurance_pie_chart(query)
         
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
@@ -3,24 +3,15 @@ import sqlite3
 from pathlib import Path
 import os
 
-def create_data_warehouse():
-    # Create warehouse directory if it doesn't exist
-    Path('warehouse').mkdir(exist_ok=True)
-
-    # Remove existing warehouse database if it exists
-    if os.path.exists("warehouse/warehouse.db"):
-        os.remove("warehouse/warehouse.db")
-
-    # Create new SQLite database connection
-    conn = sqlite3.connect("warehouse/warehouse.db")
-    # Create cursor for executing SQL commands
-    cursor = conn.cursor()
-
-    # Create fact table for appointments with foreign key constraints
-    cursor.execute("""CREATE TABLE fact_appointment (
+# Table definitions of the warehouse, in creation order
+WAREHOUSE_TABLES = {
+    # Fact table for appointments with foreign key constraints
+    'fact_appointment': """CREATE TABLE fact_appointment (
             appointment_id INTEGER PRIMARY KEY,
             patient_id INTEGER,
             doctor_id INTEGER,
+            patient_key INTEGER,
+            doctor_key INTEGER,
             slot_id INTEGER,
             appointment_status_id INTEGER,
             appointment_date_id INTEGER,
@@ -29,54 +20,65 @@ def create_data_warehouse():
             waiting_duration_min REAL,
             appointment_duration_min REAL,
             patient_age INTEGER,        
-            FOREIGN KEY (patient_id) REFERENCES dim_patient(patient_id),
-            FOREIGN KEY (doctor_id) REFERENCES dim_doctor(doctor_id),
+            FOREIGN KEY (patient_key) REFERENCES dim_patient(patient_key),
+            FOREIGN KEY (doctor_key) REFERENCES dim_doctor(doctor_key),
             FOREIGN KEY (slot_id) REFERENCES dim_slot(slot_id),
             FOREIGN KEY (appointment_status_id) REFERENCES dim_appointment_status(status_id),
             FOREIGN KEY (appointment_date_id) REFERENCES dim_date(date_id),
             FOREIGN KEY (appointment_time_id) REFERENCES dim_time(time_id)        
-        );""")
+        );""",
 
-    # Create dimension table for patient information
-    cursor.execute("""CREATE TABLE dim_patient (
-            patient_id INTEGER PRIMARY KEY,
+    # Dimension table for patient information, one row per version of a patient (slowly changing, type 2):
+    # patient_key identifies the version, the current one has is_current = 1 and no valid_to
+    'dim_patient': """CREATE TABLE dim_patient (
+            patient_key INTEGER PRIMARY KEY,
+            patient_id INTEGER NOT NULL,
             first_name TEXT,
             last_name TEXT,
             date_of_birth TEXT,
             gender TEXT,
             insurance_company_id INTEGER,
             coverage_type_id INTEGER,
+            row_hash INTEGER,
+            valid_from TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            valid_to TEXT,
+            is_current INTEGER NOT NULL DEFAULT 1,
             FOREIGN KEY (insurance_company_id) REFERENCES dim_insurance_company(insurance_company_id),
             FOREIGN KEY (coverage_type_id) REFERENCES dim_coverage_type(coverage_type_id)
-        );""")
+        );""",
 
-    # Create dimension table for doctor information
-    cursor.execute("""CREATE TABLE dim_doctor (
-            doctor_id INTEGER PRIMARY KEY,
+    # Dimension table for doctor information, versioned like dim_patient
+    'dim_doctor': """CREATE TABLE dim_doctor (
+            doctor_key INTEGER PRIMARY KEY,
+            doctor_id INTEGER NOT NULL,
             first_name TEXT,
             last_name TEXT,
             gender TEXT,
             years_of_experience INTEGER,
             appointment_fee REAL,
             specialty_id INTEGER,
+            row_hash INTEGER,
+            valid_from TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            valid_to TEXT,
+            is_current INTEGER NOT NULL DEFAULT 1,
             FOREIGN KEY (specialty_id) REFERENCES dim_doctor_specialty(specialty_id)
-        );""")
+        );""",
 
-    # Create dimension table for doctor specialties
-    cursor.execute("""CREATE TABLE dim_doctor_specialty (
+    # Dimension table for doctor specialties
+    'dim_doctor_specialty': """CREATE TABLE dim_doctor_specialty (
             specialty_id INTEGER PRIMARY KEY,
             specialty_title TEXT
-        );""")
+        );""",
 
-    # Create dimension table for appointment slots
-    cursor.execute("""CREATE TABLE dim_slot (
+    # Dimension table for appointment slots
+    'dim_slot': """CREATE TABLE dim_slot (
             slot_id INTEGER PRIMARY KEY,
             appointment_date TEXT,
             appointment_time TEXT
-        );""")
+        );""",
 
-    # Create dimension table for dates
-    cursor.execute("""CREATE TABLE dim_date (
+    # Dimension table for dates
+    'dim_date': """CREATE TABLE dim_date (
             date_id INTEGER PRIMARY KEY,
             full_date TEXT,
             day INTEGER,
@@ -84,37 +86,110 @@ def create_data_warehouse():
             year INTEGER,
             weekday TEXT,
             quarter INTEGER
-        );""")
+        );""",
 
-    # Create dimension table for times
-    cursor.execute("""CREATE TABLE dim_time (
+    # Dimension table for times
+    'dim_time': """CREATE TABLE dim_time (
             time_id INTEGER PRIMARY KEY,
             full_time TEXT,
             hour INTEGER,
             minute INTEGER,
             am_pm TEXT
-        );""")
+        );""",
 
-    # Create dimension table for coverage types
-    cursor.execute("""CREATE TABLE dim_coverage_type (
+    # Dimension table for coverage types
+    'dim_coverage_type': """CREATE TABLE dim_coverage_type (
             coverage_type_id INTEGER PRIMARY KEY,
             coverage_title TEXT
-        );""")
+        );""",
 
-    # Create dimension table for appointment statuses
-    cursor.execute("""CREATE TABLE dim_appointment_status (
+    # Dimension table for appointment statuses
+    'dim_appointment_status': """CREATE TABLE dim_appointment_status (
             status_id INTEGER PRIMARY KEY,
             status_title TEXT
-        );""")
+        );""",
 
-    # Create dimension table for insurance companies
-    cursor.execute("""CREATE TABLE dim_insurance_company (
-            insurance_company_id TEXT PRIMARY KEY,
+    # Dimension table for insurance companies
+    'dim_insurance_company': """CREATE TABLE dim_insurance_company (
+            insurance_company_id INTEGER PRIMARY KEY,
             insurance_company_name TEXT,
             insurance_company_type TEXT,
             founded_year INTEGER,
             coverage_area TEXT
-        );""")
+        );""",
+
+    # Table holding the high-water marks of the incremental loads
+    'etl_watermark': """CREATE TABLE etl_watermark (
+            source TEXT PRIMARY KEY,
+            value INTEGER,
+            updated_at TEXT
+        );""",
+
+    # One row per committed load; the latest run_id identifies the warehouse version
+    'etl_run': """CREATE TABLE etl_run (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mode TEXT,
+            started_at TEXT,
+            finished_at TEXT,
+            rows_loaded INTEGER
+        );""",
+
+    # Content hash of every loaded dimension row, to write only the rows that changed since the last load
+    'etl_row_hash': """CREATE TABLE etl_row_hash (
+            table_name TEXT NOT NULL,
+            row_key INTEGER NOT NULL,
+            row_hash INTEGER NOT NULL,
+            PRIMARY KEY (table_name, row_key)
+        ) WITHOUT ROWID;""",
+
+    # Rollup tables of the appointment cube, rebuilt with every load (see olap/cube.py)
+    'agg_catalog': """CREATE TABLE agg_catalog (
+            table_name TEXT PRIMARY KEY,
+            dimensions TEXT,
+            measures TEXT,
+            row_count INTEGER,
+            built_at TEXT
+        );"""
+}
+
+# Indexes on the fact table's foreign keys used by the dashboard joins and filters, and on the current
+# versions of the slowly changing dimensions
+WAREHOUSE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_fact_appointment_date ON fact_appointment (appointment_date_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fact_appointment_doctor ON fact_appointment (doctor_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fact_appointment_patient ON fact_appointment (patient_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fact_appointment_status ON fact_appointment (appointment_status_id)",
+    # Dimension versions of the fact rows: the version joins and the resolution of rows without one
+    "CREATE INDEX IF NOT EXISTS idx_fact_appointment_patient_key ON fact_appointment (patient_key)",
+    "CREATE INDEX IF NOT EXISTS idx_fact_appointment_doctor_key ON fact_appointment (doctor_key)",
+    # At most one current version per patient and doctor; also the lookup of the merge
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_patient_current ON dim_patient (patient_id) WHERE is_current = 1",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_dim_doctor_current ON dim_doctor (doctor_id) WHERE is_current = 1",
+    # All versions of a patient or doctor in order, to find the version valid on an appointment's date
+    "CREATE INDEX IF NOT EXISTS idx_dim_patient_versions ON dim_patient (patient_id, valid_from)",
+    "CREATE INDEX IF NOT EXISTS idx_dim_doctor_versions ON dim_doctor (doctor_id, valid_from)"
+]
+
+def create_data_warehouse():
+    # Create warehouse directory if it doesn't exist
+    Path('warehouse').mkdir(exist_ok=True)
+
+    # Remove existing warehouse database if it exists
+    if os.path.exists("warehouse/warehouse.db"):
+        os.remove("warehouse/warehouse.db")
+
+    # Create new SQLite database connection
+    conn = sqlite3.connect("warehouse/warehouse.db")
+    # Create cursor for executing SQL commands
+    cursor = conn.cursor()
+
+    # Create the fact and dimension tables
+    for ddl in WAREHOUSE_TABLES.values():
+        cursor.execute(ddl)
+
+    # Create indexes on the fact table
+    for index_sql in WAREHOUSE_INDEXES:
+        cursor.execute(index_sql)
 
     # Commit all changes to the database
     conn.commit()
@@ -122,3 +197,47 @@ def create_data_warehouse():
     conn.close()
     print("Warehouse SUCCESSFULLY created and saved in 'warehouse/warehouse.db'.")
 
+# Column names of a table definition, read from a scratch in-memory database
+def declared_columns(ddl):
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.execute(ddl)
+        table_name = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+        return [column[1] for column in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+    finally:
+        conn.close()
+
+# Make sure every warehouse table exists with its declared keys and columns, and rebuild the ones that
+# lost their keys or predate a column. Runs inside the caller's transaction, the caller commits.
+def ensure_warehouse_schema(connection):
+    rebuilt_tables = []
+    for table_name, ddl in WAREHOUSE_TABLES.items():
+        columns = connection.execute(f"PRAGMA table_info({table_name})").fetchall()
+        if not columns:
+            connection.execute(ddl)
+            continue
+
+        # Tables written by DataFrame.to_sql(if_exists='replace') have no primary key, tables of older
+        # warehouses miss columns added since (e.g. the versioning columns of dim_patient and dim_doctor)
+        if any(column[5] for column in columns) and set(declared_columns(ddl)) <= {column[1] for column in columns}:
+            continue
+
+        # Rebuild with the declared definition and copy the rows over
+        existing_columns = [column[1] for column in columns]
+        connection.execute(f"DROP TABLE IF EXISTS {table_name}__new")
+        connection.execute(ddl.replace(f"CREATE TABLE {table_name} (", f"CREATE TABLE {table_name}__new (", 1))
+        new_columns = [column[1] for column in connection.execute(f"PRAGMA table_info({table_name}__new)").fetchall()]
+        common_columns = ', '.join(column for column in existing_columns if column in new_columns)
+        connection.execute(
+            f"INSERT OR REPLACE INTO {table_name}__new ({common_columns}) SELECT {common_columns} FROM {table_name}"
+        )
+        connection.execute(f"DROP TABLE {table_name}")
+        connection.execute(f"ALTER TABLE {table_name}__new RENAME TO {table_name}")
+        rebuilt_tables.append(table_name)
+
+    for index_sql in WAREHOUSE_INDEXES:
+        connection.execute(index_sql)
+
+    if rebuilt_tables:
+        print(f"Rebuilt warehouse tables with their keys and columns: {', '.join(rebuilt_tables)}")
+    return rebuilt_tables
@@ -51,11 +51,12 @@ case "$1" in
         log "Current directory contents:"
         ls -la
         log "Python path: $PYTHONPATH"
-        # Wait for the warehouse database to be created
-        log "Waiting for warehouse.db to be created by scheduler..."
+        # Wait for the first load to be committed by the scheduler. Loads are atomic, so once
+        # an etl_run row exists the warehouse is complete and later loads never expose partial data.
+        log "Waiting for the first ETL load to be committed by scheduler..."
         
-        while ! sqlite3 /app/warehouse/warehouse.db "SELECT COUNT(*) FROM fact_appointment;" | grep -v '^0$' >/dev/null 2>&1; do
-            log "fact_appointment not ready or empty. Retrying in 3 seconds..."
+        until [ -n "$(sqlite3 /app/warehouse/warehouse.db "SELECT run_id FROM etl_run LIMIT 1;" 2>/dev/null)" ]; do
+            log "No committed ETL load yet. Retrying in 3 seconds..."
             sleep 3
         done
         log "Database found. Launching dashboard..."
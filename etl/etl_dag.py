@@ -0,0 +1,139 @@
+# Import required libraries for running transform steps as a dependency graph
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from etl.etl_instrumentation import instrument
+from config.metrics import REGISTRY
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+REGISTRY.describe('etl_transform_cache_total', 'counter', "Transform steps whose outputs were reused (hit) or computed (miss)")
+
+# A transform step: the function, the named values it reads and the named values it produces.
+# Only steps marked cacheable keep their outputs in run_dag's cache; mark steps whose inputs rarely change
+# (reference data), caching steps over the new rows of every run only holds memory.
+class Node:
+    def __init__(self, name, func, inputs, outputs, kwargs=None, cacheable=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.kwargs = kwargs or {}
+        self.cacheable = cacheable
+
+    def __repr__(self):
+        return f"Node({self.name}: {self.inputs} -> {self.outputs})"
+
+# Content hash of a source value, used to tell whether a step's inputs changed since the last run
+def fingerprint(value):
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr(list(zip(value.columns, value.dtypes.astype(str)))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    else:
+        digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+def combine_fingerprints(*parts):
+    return hashlib.blake2b('|'.join(parts).encode(), digest_size=16).hexdigest()
+
+def memory_usage(values):
+    return sum(int(v.memory_usage(deep=True).sum()) for v in values if isinstance(v, pd.DataFrame))
+
+def run_node(node, args):
+    # Steps modify their frames in place, give them shallow copies so upstream outputs stay intact
+    args = [arg.copy(deep=False) if isinstance(arg, pd.DataFrame) else arg for arg in args]
+    start_time = time.perf_counter()
+    result = node.func(*args, **node.kwargs)
+    wall_time = time.perf_counter() - start_time
+    outputs = result if len(node.outputs) > 1 else (result,)
+    return outputs, wall_time
+
+# Run the steps as soon as their inputs are available, independent branches in parallel.
+# With a cache (dict kept between runs), cacheable steps whose inputs did not change reuse their previous
+# outputs. Only the inputs of cacheable steps are fingerprinted.
+@instrument
+def run_dag(nodes, inputs, max_workers=4, cache=None):
+    producers = {}
+    for node in nodes:
+        for output in node.outputs:
+            if output in producers or output in inputs:
+                raise ValueError(f"'{output}' is produced by more than one step")
+            producers[output] = node.name
+    for node in nodes:
+        for name in node.inputs:
+            if name not in producers and name not in inputs:
+                raise ValueError(f"Step '{node.name}' reads '{name}' which no step or source provides")
+
+    values = dict(inputs)
+    # Outputs of cacheable steps are fingerprinted from the step name and its input fingerprints,
+    # other values are hashed the first time a cacheable step reads them
+    fingerprints = {}
+    stats = []
+
+    def input_fingerprint(node):
+        if cache is None or not node.cacheable:
+            return None
+        for name in node.inputs:
+            if name not in fingerprints:
+                fingerprints[name] = fingerprint(values[name])
+        return combine_fingerprints(node.name, *(fingerprints[name] for name in node.inputs))
+
+    def store(node, input_fingerprint, outputs, wall_time, cached):
+        for output_name, value in zip(node.outputs, outputs):
+            values[output_name] = value
+            if input_fingerprint is not None:
+                fingerprints[output_name] = combine_fingerprints(input_fingerprint, output_name)
+        node_stats = {
+            'node': node.name,
+            'wall_time_sec': round(wall_time, 4),
+            'output_memory_bytes': memory_usage(outputs),
+            'cached': cached
+        }
+        stats.append(node_stats)
+        REGISTRY.inc_counter('etl_transform_cache_total', result='hit' if cached else 'miss')
+        logger.debug("Transform step finished: %s", node_stats)
+        if input_fingerprint is not None:
+            cache[node.name] = (input_fingerprint, outputs)
+
+    remaining = list(nodes)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='transform') as executor:
+        while remaining or running:
+            ready = [node for node in remaining if all(name in values for name in node.inputs)]
+            reused = False
+            for node in ready:
+                remaining.remove(node)
+                node_fingerprint = input_fingerprint(node)
+                previous = cache.get(node.name) if node_fingerprint is not None else None
+                if previous is not None and previous[0] == node_fingerprint:
+                    store(node, node_fingerprint, previous[1], 0.0, cached=True)
+                    reused = True
+                else:
+                    args = [values[name] for name in node.inputs]
+                    running[executor.submit(run_node, node, args)] = (node, node_fingerprint)
+
+            # Reused outputs may have unblocked more steps
+            if reused:
+                continue
+            if not running:
+                raise ValueError(f"Transform steps depend on each other in a cycle: {remaining}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node, node_fingerprint = running.pop(future)
+                outputs, wall_time = future.result()
+                store(node, node_fingerprint, outputs, wall_time, cached=False)
+
+    return values, stats
+
+def print_dag_stats(stats):
+    print(f"  {'Step':<32}{'Wall (s)':>10}{'Memory (MB)':>14}  Cached")
+    for node_stats in stats:
+        print(
+            f"  {node_stats['node']:<32}{node_stats['wall_time_sec']:>10.3f}"
+            f"{node_stats['output_memory_bytes'] / 1024 ** 2:>14.2f}  {'yes' if node_stats['cached'] else 'no'}"
+        )
@@ -1,9 +1,13 @@
 import pandas as pd
 import os
-import requests
+import io
 import sqlite3
 import json
-from db_init.sql_database_create import create_sql_database_source
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from etl.etl_schema import read_csv_kwargs, apply_schema
+from etl.etl_instrumentation import instrument
+from config.cli import DEFAULT_CHUNKSIZE
 from config.logging_config import setup_logger
 
 # Set up logger for this module
@@ -11,43 +15,134 @@ logger = setup_logger(__name__)
 
 # Extract data from data sources
 
-# extract data from flat files (CSV)
-def extract_from_flat_file(folder='data'):    
-    logger.info("Starting extraction from flat files")
-    
-    # Dictionary mapping file types to their corresponding CSV filenames
-    flat_files = {
-        'appointments': 'appointments.csv',
-        'patients': 'patients.csv',
-        'slots': 'slots.csv'
-    }
+# Seconds each source may take in the concurrent extract stage before the run is aborted
+SOURCE_TIMEOUTS = {
+    'flat_files': 600,
+    'database': 600,
+    'api': 60
+}
+
+# Insurance API endpoint; an empty INSURANCE_API_URL skips the request and reads the local JSON file
+# (e.g. for benchmarks on generated data)
+INSURANCE_API_URL = os.getenv('INSURANCE_API_URL', "https://my.api.mockaroo.com/insurance_companies.json?key=1c428350")
+
+# Connect and read timeouts of the insurance API request, after which the local JSON file is used
+API_TIMEOUT = (5, 30)
+
+# Dictionary mapping file types to their corresponding CSV filenames
+FLAT_FILES = {
+    'appointments': 'appointments.csv',
+    'patients': 'patients.csv',
+    'slots': 'slots.csv'
+}
+
+
+# File-like view of a CSV file: the header line followed by the bytes [offset, end)
+class CsvFileSlice(io.RawIOBase):
+    def __init__(self, path, header, offset, end):
+        self._file = open(path, 'rb')
+        self._file.seek(offset)
+        self._header = header
+        self._remaining = end - offset
+
+    def readable(self):
+        return True
 
-    # Initialize empty dictionary to store dataframes
+    def readinto(self, buffer):
+        if self._header:
+            data = self._header[:len(buffer)]
+            self._header = self._header[len(data):]
+        else:
+            data = self._file.read(min(len(buffer), self._remaining))
+            self._remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+# Byte range of a CSV file not read yet: returns (header, start offset, end offset)
+def csv_byte_range(path, offset=0):
+    with open(path, 'rb') as csv_file:
+        header = csv_file.readline()
+        file_size = os.fstat(csv_file.fileno()).st_size
+
+        # Start over when the file shrank or the offset is not at a line boundary (file was rewritten)
+        if offset < len(header) or offset > file_size:
+            offset = len(header)
+        else:
+            csv_file.seek(offset - 1)
+            if csv_file.read(1) != b'\n':
+                logger.warning("Offset %s is not at a line boundary in %s, re-reading the whole file", offset, path)
+                offset = len(header)
+
+        # Only consume complete lines so a row being appended right now is picked up next run
+        end_offset = file_size
+        while end_offset > offset:
+            block_start = max(offset, end_offset - 65536)
+            csv_file.seek(block_start)
+            block = csv_file.read(end_offset - block_start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                end_offset = block_start + newline + 1
+                break
+            end_offset = block_start
+
+    return header, offset, end_offset
+
+# Read a CSV file starting at a byte offset (the end of the previous read), keeping the header
+def read_csv_from_offset(path, offset=0, **read_csv_kwargs):
+    header, offset, end_offset = csv_byte_range(path, offset)
+    with io.BufferedReader(CsvFileSlice(path, header, offset, end_offset)) as csv_slice:
+        df = pd.read_csv(csv_slice, encoding='utf-8', **read_csv_kwargs)
+    return df, end_offset
+
+# extract rows added to the flat files since the last run, using the high-water marks from the warehouse.
+# Append-only: rows edited in place before the stored offset are not seen, only a full refresh reloads them.
+@instrument
+def extract_new_from_flat_file(watermarks, folder='data'):
+    logger.info("Starting incremental extraction from flat files")
+    new_watermarks = dict(watermarks)
     dataframes = {}
-    
-    # Iterate through each file type and filename
-    for key, filename in flat_files.items():
-        # Construct full file path by joining folder and filename
+
+    for key, filename in FLAT_FILES.items():
         path = os.path.join(folder, filename)
-        logger.debug(f"Attempting to read file: {path}")
-        # Check if file exists at the specified path
+        logger.debug("Attempting to read file: %s", path)
         if not os.path.exists(path):
-            logger.error(f"Missing required file: {path}")
+            logger.error("Missing required file: %s", path)
             raise FileNotFoundError(f"Missing required file: {path}")
-        # Read CSV file into pandas DataFrame with UTF-8 encoding
-        df = pd.read_csv(path, encoding='utf-8')
-        logger.debug(f"Successfully read {filename} with {len(df)} rows")
-        # Store DataFrame in dictionary with file type as key
+        # Read only the bytes appended after the stored file offset
+        offset = watermarks.get(f'{key}_offset', 0)
+        df, end_offset = read_csv_from_offset(path, offset, **read_csv_kwargs(key))
+        logger.debug("Read %s new rows from %s (bytes %s-%s)", len(df), filename, offset, end_offset)
+        new_watermarks[f'{key}_offset'] = end_offset
+        dataframes[key] = df
+
+    # Drop rows at or below the id high-water marks in case a rewritten file was re-read from the start
+    for key, id_column in [('appointments', 'appointment_id'), ('slots', 'slot_id')]:
+        df = dataframes[key]
+        max_id = watermarks.get(f'{key}_max_id')
+        if max_id is not None:
+            df = df[df[id_column] > max_id]
+        if not df.empty:
+            new_watermarks[f'{key}_max_id'] = max(max_id or 0, int(df[id_column].max()))
         dataframes[key] = df
 
-    logger.info("Flat files successfully extracted")
-    print("Flat files successfully extracted.")    
-    # Return tuple of three DataFrames in specific order
-    return dataframes['appointments'], dataframes['patients'], dataframes['slots']
+    logger.info(
+        "Flat files incrementally extracted: %s appointments, %s patients, %s slots",
+        len(dataframes['appointments']), len(dataframes['patients']), len(dataframes['slots'])
+    )
+    print(
+        f"Extracted {len(dataframes['appointments'])} new appointments, "
+        f"{len(dataframes['patients'])} new patients and {len(dataframes['slots'])} new slots from flat files."
+    )
+    return dataframes['appointments'], dataframes['patients'], dataframes['slots'], new_watermarks
 #############################################################################################
 
 # Extract data from SQLite database
-def extract_from_db(folder='data'):
+@instrument
+def extract_from_db(folder='data', min_appointment_id=None):
     logger.info("Starting extraction from SQLite database")
     # Define database filename
     file_name ='healthcare.db'
@@ -56,12 +151,14 @@ def extract_from_db(folder='data'):
         
     # Check if database exists, if not create it
     if not os.path.exists(db_path):
-        logger.warning(f"Database not found at: {db_path}")
+        logger.warning("Database not found at: %s", db_path)
         print(f"Database not found at: {db_path}")
         print("Running database creation script...")
-        create_sql_database_source()        
+        # Imported here: only the first run builds the source database
+        from db_init.sql_database_create import create_sql_database_source
+        create_sql_database_source(db_path)        
     
-    logger.debug(f"Connecting to database at: {db_path}")
+    logger.debug("Connecting to database at: %s", db_path)
     # Establish connection to SQLite database
     conn = sqlite3.connect(db_path)
 
@@ -73,11 +170,23 @@ def extract_from_db(folder='data'):
     logger.debug("Extracting data from coverage_type table")
     coverage_type_df = pd.read_sql_query("SELECT * FROM coverage_type", conn)
     logger.debug("Extracting data from doctor_appointment table")
-    doctor_appointment_df = pd.read_sql_query("SELECT * FROM doctor_appointment", conn)
+    # In incremental mode only the assignments of new appointments are needed
+    if min_appointment_id is None:
+        doctor_appointment_df = pd.read_sql_query("SELECT * FROM doctor_appointment", conn)
+    else:
+        doctor_appointment_df = pd.read_sql_query(
+            "SELECT * FROM doctor_appointment WHERE appointment_id > ?", conn, params=(min_appointment_id,)
+        )
 
     # Close database connection
     conn.close()
 
+    # SQLite returns 64-bit integers and Python strings, narrow them to the schema types
+    doctor_df = apply_schema(doctor_df, 'doctor')
+    specialty_df = apply_schema(specialty_df, 'specialty')
+    coverage_type_df = apply_schema(coverage_type_df, 'coverage_type')
+    doctor_appointment_df = apply_schema(doctor_appointment_df, 'doctor_appointment')
+
     logger.info("Successfully extracted 4 tables from DB")
     print("Extracted 4 tables from DB")
 
@@ -93,22 +202,27 @@ def extract_from_db(folder='data'):
 #############################################################################################
 
 # extract data from API source
+@instrument
 def extract_from_api():
     logger.info("Starting extraction from API")
     print("Fetching data from API...")
     
     # Define API endpoint URL with API key
-    api_url = "https://my.api.mockaroo.com/insurance_companies.json?key=1c428350"
+    api_url = INSURANCE_API_URL
     # Define path to fallback JSON file
     fallback_path='data/api_sample.json'
     
     try:
-        logger.debug(f"Making API request to: {api_url}")
+        if not api_url:
+            raise Exception("INSURANCE_API_URL is empty")
+        # Imported here so only the API extraction pays for loading requests
+        import requests
+        logger.debug("Making API request to: %s", api_url)
         # Make HTTP GET request to API
-        response = requests.get(api_url)
+        response = requests.get(api_url, timeout=API_TIMEOUT)
         # Check if request was successful
         if response.status_code != 200:
-            logger.error(f"API request failed with status code: {response.status_code}")
+            logger.error("API request failed with status code: %s", response.status_code)
             raise Exception(f"Bad response: {response.status_code}")
             
         # Parse JSON response into Python object
@@ -117,23 +231,23 @@ def extract_from_api():
         if not data:
             logger.error("API response was empty")
             raise Exception("API response was empty.")
-        logger.info(f"Successfully extracted {len(data)} insurance companies from API")
+        logger.info("Successfully extracted %s insurance companies from API", len(data))
         print(f"Extracted {len(data)} insurance companies from API")        
 
     except Exception as e:
-        logger.error(f"API loading failed: {str(e)}")
+        logger.error("API loading failed: %s", e)
         print(f"Error: API loading failed: {e}")
-        logger.info(f"Falling back to local file: {fallback_path}")
+        logger.info("Falling back to local file: %s", fallback_path)
         print("\nFalling back to local file:", fallback_path)
         print("Extracting data from JSON file...")
         # Check if fallback file exists
         if not os.path.exists(fallback_path):
-            logger.error(f"Fallback file not found at: {fallback_path}")
+            logger.error("Fallback file not found at: %s", fallback_path)
             raise FileNotFoundError(f"Fallback file not found at: {fallback_path}")
         # Read fallback JSON file
         with open(fallback_path, 'r', encoding='utf-8') as json_data:
             data = json.load(json_data)        
-        logger.info(f"Successfully loaded {len(data)} fallback records from JSON file")
+        logger.info("Successfully loaded %s fallback records from JSON file", len(data))
         print(f"Loaded {len(data)} fallback records from JSON file.")        
 
     # Convert JSON data to pandas DataFrame
@@ -151,8 +265,86 @@ def extract_from_api():
     df = df[cols_to_load].copy()
     # Rename 'rownum' column to 'insurance_company_id'
     df.rename(columns={'rownum': 'insurance_company_id'}, inplace=True)
+    # Apply the column types of the schema
+    df = apply_schema(df, 'insurance_company')
     
     logger.info("API data extraction completed successfully")
     return df
+#############################################################################################
+
+# Stream the rows added to a flat file since the last run in chunks with the column types of the schema
+# (append-only like extract_new_from_flat_file).
+# The new file offset and id high-water mark are written into new_watermarks as the file is read.
+@instrument(label='key')
+def iter_new_flat_file_chunks(key, watermarks, new_watermarks, folder='data', chunksize=DEFAULT_CHUNKSIZE):
+    path = os.path.join(folder, FLAT_FILES[key])
+    if not os.path.exists(path):
+        logger.error("Missing required file: %s", path)
+        raise FileNotFoundError(f"Missing required file: {path}")
+
+    header, offset, end_offset = csv_byte_range(path, watermarks.get(f'{key}_offset', 0))
+    new_watermarks[f'{key}_offset'] = end_offset
+    logger.info("Streaming %s bytes %s-%s in chunks of %s rows", path, offset, end_offset, chunksize)
+
+    id_column = {'appointments': 'appointment_id', 'slots': 'slot_id'}.get(key)
+    max_id = watermarks.get(f'{key}_max_id')
+
+    with io.BufferedReader(CsvFileSlice(path, header, offset, end_offset)) as csv_slice:
+        reader = pd.read_csv(csv_slice, encoding='utf-8', chunksize=chunksize, **read_csv_kwargs(key))
+        for chunk_number, chunk in enumerate(reader, start=1):
+            # Drop rows at or below the id high-water mark in case a rewritten file is re-read
+            if id_column is not None:
+                if max_id is not None:
+                    chunk = chunk[chunk[id_column] > max_id]
+                if not chunk.empty:
+                    new_watermarks[f'{key}_max_id'] = max(
+                        new_watermarks.get(f'{key}_max_id') or 0, int(chunk[id_column].max())
+                    )
+            logger.debug("Read chunk %s of %s with %s rows", chunk_number, FLAT_FILES[key], len(chunk))
+            if not chunk.empty:
+                yield chunk
+#############################################################################################
+
+# Extract all sources concurrently; the stage takes as long as the slowest source
+@instrument
+def extract_all_sources(watermarks=None, folder='data', timeouts=None):
+    logger.info("Starting concurrent extraction from all sources")
+    watermarks = watermarks or {}
+    timeouts = {**SOURCE_TIMEOUTS, **(timeouts or {})}
+
+    executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='extract')
+    start_time = time.perf_counter()
+    futures = {
+        executor.submit(extract_new_from_flat_file, watermarks, folder): 'flat_files',
+        executor.submit(extract_from_db, folder, watermarks.get('appointments_max_id')): 'database',
+        executor.submit(extract_from_api): 'api'
+    }
+
+    results = {}
+    pending = set(futures)
+    try:
+        while pending:
+            # Wake up when a source finishes or when the earliest deadline passes
+            next_deadline = min(timeouts[futures[future]] for future in pending)
+            remaining = next_deadline - (time.perf_counter() - start_time)
+            done, pending = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                source = futures[future]
+                # Re-raises the source's own error
+                results[source] = future.result()
+                elapsed = time.perf_counter() - start_time
+                logger.info("Source '%s' extracted in %.2fs", source, elapsed)
+                print(f"  Source '{source}' extracted in {elapsed:.2f}s")
 
+            elapsed = time.perf_counter() - start_time
+            timed_out = [futures[future] for future in pending if elapsed >= timeouts[futures[future]]]
+            if timed_out:
+                logger.error("Extraction timed out for: %s", ', '.join(timed_out))
+                raise TimeoutError(f"Extraction timed out for: {', '.join(timed_out)}")
+    finally:
+        # Do not wait for a hanging source, its result is discarded
+        executor.shutdown(wait=False, cancel_futures=True)
 
+    logger.info("All sources extracted in %.2fs", time.perf_counter() - start_time)
+    return results
@@ -0,0 +1,334 @@
+# Import required libraries for timing and measuring the ETL steps
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from config.metrics import REGISTRY
+from config.logging_config import setup_logger
+
+# resource is Unix only; without it the stages carry no RSS figures
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Where the run reports are written: the latest run as one JSON document, and a rolling history of runs
+REPORT_DIR = Path('logs')
+REPORT_FILE = 'etl_run_report.json'
+HISTORY_FILE = 'etl_run_history.jsonl'
+
+# Number of runs kept in the history file
+HISTORY_RUNS = 50
+
+# Tracing allocations with tracemalloc slows pandas code down noticeably, so it is only enabled on request
+TRACE_MEMORY = os.environ.get('ETL_TRACE_MEMORY', '0') == '1'
+
+# Report of the run in progress; stages measured outside a run are not recorded and cost one check
+_active_report = None
+
+# Stages being measured by the current thread, innermost last
+_stack = threading.local()
+
+# Rows of a frame, or of the frames in tuples, lists and dicts up to two levels deep (the arguments of a
+# call and a dict of frames among them); other values count 0
+def count_rows(value, depth=2):
+    if hasattr(value, 'shape') and hasattr(value, 'columns'):
+        return int(value.shape[0])
+    if depth == 0:
+        return 0
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(count_rows(item, depth - 1) for item in value)
+    return 0
+
+# Highest resident set size of the process so far, in MB (ru_maxrss is in KiB on Linux)
+def peak_rss_mb():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Timing and memory of one call of a stage. Wall time and the calling thread's CPU time are measured,
+# since transform steps run in parallel threads. With tracemalloc on, the traced peak of a nested stage
+# is reset around it and folded back into its parent, so every stage reports its own peak.
+class StageMeasurement:
+    def __init__(self, report, stage, label=None):
+        self.report = report
+        self.record = {'stage': stage, 'label': label, 'thread': threading.current_thread().name}
+
+    def __enter__(self):
+        stack = _stack.__dict__.setdefault('stages', [])
+        parent = stack[-1] if stack else None
+        self.record['parent'] = parent.record['stage'] if parent else None
+        self.record['depth'] = len(stack)
+        stack.append(self)
+
+        self.traced_peak = 0
+        if self.report.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, peak)
+            tracemalloc.reset_peak()
+            self.traced_start = current
+        self.rss_start = peak_rss_mb()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = self.record
+        record['start_s'] = round(self.wall_start - self.report.wall_start, 4)
+        record['wall_s'] = round(time.perf_counter() - self.wall_start, 4)
+        record['cpu_s'] = round(time.thread_time() - self.cpu_start, 4)
+        rss_end = peak_rss_mb()
+        if rss_end is not None:
+            record['peak_rss_mb'] = round(rss_end, 1)
+            record['rss_growth_mb'] = round(rss_end - self.rss_start, 1)
+        if self.report.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.traced_peak = max(self.traced_peak, peak)
+            record['alloc_mb'] = round((current - self.traced_start) / 2**20, 2)
+            record['alloc_peak_mb'] = round((self.traced_peak - self.traced_start) / 2**20, 2)
+        if exc_type is not None:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+
+        stack = _stack.stages
+        stack.pop()
+        if stack and self.report.trace_memory and tracemalloc.is_tracing():
+            stack[-1].traced_peak = max(stack[-1].traced_peak, self.traced_peak)
+        self.report.add(record)
+        return False
+
+# Stage records of one pipeline run, written as a JSON report when the run ends
+class RunReport:
+    def __init__(self, name, trace_memory=TRACE_MEMORY):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.started_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.stages.append(record)
+
+    # Totals per stage over all of its calls
+    def summary(self):
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['stage'], {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows_in': 0, 'rows_out': 0})
+            total['calls'] += 1
+            for name in ['wall_s', 'cpu_s', 'rows_in', 'rows_out']:
+                total[name] += record.get(name, 0)
+        for total in totals.values():
+            total['wall_s'] = round(total['wall_s'], 4)
+            total['cpu_s'] = round(total['cpu_s'], 4)
+        return totals
+
+    def to_dict(self, status):
+        return {
+            'name': self.name,
+            'status': status,
+            'started_at': self.started_at,
+            'wall_s': round(time.perf_counter() - self.wall_start, 4),
+            'cpu_s': round(time.process_time() - self.cpu_start, 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1) if resource is not None else None,
+            'trace_memory': self.trace_memory,
+            'summary': self.summary(),
+            'stages': sorted(self.stages, key=lambda record: record['start_s'])
+        }
+
+# Write the report of the run and add it to the history, keeping the last HISTORY_RUNS runs.
+# Both files are written under a temporary name and renamed, so readers never see a partial file.
+def write_report(report, report_dir=REPORT_DIR, history_runs=HISTORY_RUNS):
+    report_dir = Path(report_dir)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    report_path = report_dir / REPORT_FILE
+    history_path = report_dir / HISTORY_FILE
+
+    tmp_path = report_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(report, indent=2))
+    os.replace(tmp_path, report_path)
+
+    history = history_path.read_text().splitlines() if history_path.exists() else []
+    history = history[-(history_runs - 1):] if history_runs > 1 else []
+    history.append(json.dumps(report))
+    tmp_path = history_path.with_suffix('.tmp')
+    tmp_path.write_text('\n'.join(history) + '\n')
+    os.replace(tmp_path, history_path)
+    logger.info("Wrote run report '%s' (%s stages), history holds %s runs", report_path, len(report['stages']), len(history))
+    return report_path
+
+# The report of the run before the latest one, to compare stage timings with
+def previous_report(report_dir=REPORT_DIR):
+    history_path = Path(report_dir) / HISTORY_FILE
+    if not history_path.exists():
+        return None
+    history = history_path.read_text().splitlines()
+    return json.loads(history[-2]) if len(history) >= 2 else None
+
+# Load steps whose calls are labelled with the table they write, for the rows loaded per table
+LOAD_STAGES = {
+    'etl_loading.sync_table',
+    'etl_loading.merge_versions',
+    'etl_loading.upsert_data_into_table'
+}
+
+# Set the metrics of the process (config/metrics.py) from the report of the run that just ended
+def publish_run_metrics(report, registry=REGISTRY):
+    registry.describe('etl_runs_total', 'counter', "ETL runs by outcome")
+    registry.describe('etl_run_duration_seconds', 'gauge', "Wall time of the last ETL run")
+    registry.describe('etl_last_success_timestamp_seconds', 'gauge', "Unix time the last successful ETL run ended")
+    registry.describe('etl_stage_duration_seconds', 'gauge', "Wall time per stage of the last ETL run, summed over its calls")
+    registry.describe('etl_rows_loaded', 'gauge', "Rows passed to the load steps per table in the last ETL run")
+
+    registry.inc_counter('etl_runs_total', status=report['status'])
+    registry.set_gauge('etl_run_duration_seconds', report['wall_s'])
+    if report['status'] == 'succeeded':
+        registry.set_gauge('etl_last_success_timestamp_seconds', time.time())
+
+    registry.clear('etl_stage_duration_seconds')
+    for stage, total in report['summary'].items():
+        registry.set_gauge('etl_stage_duration_seconds', total['wall_s'], stage=stage)
+
+    rows_loaded = {}
+    for record in report['stages']:
+        if record['stage'] in LOAD_STAGES and record.get('label'):
+            rows_loaded[record['label']] = rows_loaded.get(record['label'], 0) + record.get('rows_in', 0)
+    registry.clear('etl_rows_loaded')
+    for table_name, rows in rows_loaded.items():
+        registry.set_gauge('etl_rows_loaded', rows, table=table_name)
+
+# Slowest stages of the run next to their time in the previous run
+def print_report(report, previous=None, top=10):
+    previous_summary = previous['summary'] if previous else {}
+    print(f"\nRun '{report['name']}' {report['status']} in {report['wall_s']:.2f}s "
+          f"(CPU {report['cpu_s']:.2f}s, peak RSS {report['peak_rss_mb']} MB)")
+    print(f"{'stage':<44} {'calls':>5} {'wall s':>8} {'cpu s':>8} {'rows out':>10} {'prev s':>8}")
+    slowest = sorted(report['summary'].items(), key=lambda item: item[1]['wall_s'], reverse=True)[:top]
+    for stage, total in slowest:
+        previous_wall = previous_summary.get(stage, {}).get('wall_s')
+        previous_text = f"{previous_wall:.3f}" if previous_wall is not None else '-'
+        print(f"{stage:<44} {total['calls']:>5} {total['wall_s']:>8.3f} {total['cpu_s']:>8.3f} "
+              f"{total['rows_out']:>10} {previous_text:>8}")
+
+# Measure the calls of an ETL function while a run report is active: wall and CPU time, rows of the
+# frames passed in and returned, and memory. label names an argument whose value tells the calls apart
+# (e.g. the table a load step writes). Generator functions are measured over the time spent producing
+# their items, not the time the caller spends on them.
+def instrument(func=None, *, label=None):
+    if func is None:
+        return functools.partial(instrument, label=label)
+
+    # Functions of a script run directly are named after the script, as when it is imported
+    module = func.__module__ if func.__module__ != '__main__' else Path(inspect.getfile(func)).stem
+    stage = f"{module.rsplit('.', 1)[-1]}.{func.__qualname__}"
+    signature = inspect.signature(func) if label else None
+
+    def label_of(args, kwargs):
+        if signature is None:
+            return None
+        value = signature.bind_partial(*args, **kwargs).arguments.get(label)
+        return None if value is None else str(value)
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            report = _active_report
+            if report is None:
+                yield from func(*args, **kwargs)
+                return
+            record = {
+                'stage': stage,
+                'label': label_of(args, kwargs),
+                'thread': threading.current_thread().name,
+                'parent': None,
+                'depth': 0,
+                'start_s': round(time.perf_counter() - report.wall_start, 4),
+                'wall_s': 0.0,
+                'cpu_s': 0.0,
+                'rows_in': count_rows(args) + count_rows(kwargs),
+                'rows_out': 0
+            }
+            items = func(*args, **kwargs)
+            try:
+                while True:
+                    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        return
+                    finally:
+                        record['wall_s'] += time.perf_counter() - wall_start
+                        record['cpu_s'] += time.thread_time() - cpu_start
+                    record['rows_out'] += count_rows(item)
+                    yield item
+            finally:
+                record['wall_s'] = round(record['wall_s'], 4)
+                record['cpu_s'] = round(record['cpu_s'], 4)
+                if resource is not None:
+                    record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+                report.add(record)
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        report = _active_report
+        if report is None:
+            return func(*args, **kwargs)
+        with StageMeasurement(report, stage, label_of(args, kwargs)) as measure:
+            measure.record['rows_in'] = count_rows(args) + count_rows(kwargs)
+            measure.record['rows_out'] = 0
+            result = func(*args, **kwargs)
+            measure.record['rows_out'] = count_rows(result)
+        return result
+    return wrapper
+
+# Record the stages of the ETL functions called inside the block and write the run report when it
+# ends, also when the run fails. Runs do not nest: a run started inside another one is not reported.
+@contextmanager
+def run_report(name, report_dir=REPORT_DIR, trace_memory=TRACE_MEMORY):
+    global _active_report
+    if _active_report is not None:
+        yield _active_report
+        return
+
+    report = RunReport(name, trace_memory=trace_memory)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active_report = report
+    status = 'failed'
+    try:
+        yield report
+        status = 'succeeded'
+    finally:
+        _active_report = None
+        if started_tracing:
+            tracemalloc.stop()
+        result = report.to_dict(status)
+        publish_run_metrics(result)
+        try:
+            report_path = write_report(result, report_dir)
+            print_report(result, previous_report(report_dir))
+            print(f"Run report written to '{report_path}'.")
+        except OSError as e:
+            logger.error("Writing the run report failed: %s", e)
+
+# Decorate a pipeline entry point so every call of it is a reported run
+def reported_run(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with run_report(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
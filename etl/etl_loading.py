@@ -1,88 +1,537 @@
 # Import required libraries for database operations
 import sqlite3
+import numpy as np
 import pandas as pd
 import os
-from db_init.warehouse_create import create_data_warehouse
+import time
+from contextlib import contextmanager
+from db_init.warehouse_create import create_data_warehouse, ensure_warehouse_schema
+from etl.etl_snapshot import export_snapshot
+from olap.cube import build_rollups
+from etl.etl_instrumentation import instrument
 from config.logging_config import setup_logger
 
 # Set up logger for this module
 logger = setup_logger(__name__)
 
+# Define path to warehouse database
+WAREHOUSE_PATH = 'warehouse/warehouse.db'
+
+# Key column of every warehouse table, used to upsert rows in incremental mode
+TABLE_KEYS = {
+    'dim_doctor_specialty': 'specialty_id',
+    'dim_insurance_company': 'insurance_company_id',
+    'dim_coverage_type': 'coverage_type_id',
+    'dim_date': 'date_id',
+    'dim_time': 'time_id',
+    'dim_patient': 'patient_id',
+    'dim_doctor': 'doctor_id',
+    'dim_slot': 'slot_id',
+    'dim_appointment_status': 'status_id',
+    'fact_appointment': 'appointment_id'
+}
+
+# Dimension tables whose source is re-read in full on every run, so their frame is the complete table
+# in incremental loads as well (the others only hold the rows added since the last run)
+FULL_SOURCE_TABLES = {'dim_doctor_specialty', 'dim_insurance_company', 'dim_coverage_type', 'dim_doctor'}
+
+# Slowly changing dimensions (type 2) with their natural and surrogate key: a changed row is added as a
+# new version instead of overwriting the previous one, and fact rows keep the version they were loaded with
+SCD2_TABLES = {
+    'dim_patient': ('patient_id', 'patient_key'),
+    'dim_doctor': ('doctor_id', 'doctor_key')
+}
+
+# Rows converted and sent to executemany per batch, bounds the memory of the Python row tuples
+BULK_LOAD_BATCH_SIZE = 50000
+
+# Settings used while loading: no fsync per commit and a 256 MB page cache (negative = KiB)
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -262144
+}
+
+# HIGH-WATER MARKS
+@instrument
+def read_watermarks(db_path=WAREHOUSE_PATH):
+    # Without a warehouse there is nothing to continue from
+    if not os.path.exists(db_path):
+        logger.info("No warehouse at '%s', no high-water marks available", db_path)
+        return {}
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT source, value FROM etl_watermark").fetchall()
+    except sqlite3.OperationalError:
+        # Warehouse was loaded before incremental mode existed
+        rows = []
+    finally:
+        conn.close()
+
+    watermarks = dict(rows)
+    logger.debug("Read high-water marks: %s", watermarks)
+    return watermarks
+
+@instrument
+def save_watermarks(watermarks, connection, replace=False):
+    # A full refresh starts the marks from scratch
+    if replace:
+        connection.execute("DELETE FROM etl_watermark")
+    connection.executemany(
+        "INSERT OR REPLACE INTO etl_watermark (source, value, updated_at) VALUES (?, ?, datetime('now'))",
+        list(watermarks.items())
+    )
+    logger.info("Saved high-water marks: %s", watermarks)
+
+# Stamp the load with a run id; readers use the latest run id as the warehouse version
+def record_etl_run(connection, mode, started_at, rows_loaded):
+    cursor = connection.execute(
+        "INSERT INTO etl_run (mode, started_at, finished_at, rows_loaded) VALUES (?, ?, datetime('now'), ?)",
+        (mode, started_at, rows_loaded)
+    )
+    return cursor.lastrowid
+
+@instrument(label='table_name')
+def read_warehouse_table(table_name, db_path=WAREHOUSE_PATH):
+    if not os.path.exists(db_path):
+        return pd.DataFrame()
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
+    except Exception as e:
+        logger.warning("Could not read table '%s': %s", table_name, e)
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
 # LOAD TO WAREHOUSE
-def load_data_into_table(df, table_name, connection):
+# Convert a DataFrame into rows of plain Python values that sqlite3 can bind
+def dataframe_to_rows(df):
+    columns = []
+    for column_name in df.columns:
+        column = df[column_name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            # Keep dates as 'YYYY-MM-DD' text unless they carry a time of day
+            has_time = (column.dropna() != column.dropna().dt.normalize()).any()
+            column = column.dt.strftime('%Y-%m-%d %H:%M:%S' if has_time else '%Y-%m-%d')
+        columns.append(column.astype(object).where(column.notna(), None))
+    return list(zip(*columns))
+
+def insert_sql(df, table_name, key=None):
+    column_list = ', '.join(df.columns)
+    placeholders = ', '.join('?' for _ in df.columns)
+    sql = f"INSERT INTO {table_name} ({column_list}) VALUES ({placeholders})"
+    if key is not None:
+        # Update the existing row when the key is already present
+        updates = [f"{column} = excluded.{column}" for column in df.columns if column != key]
+        # Fact rows keep the dimension versions they were resolved to, unless they now point at another
+        # patient or doctor: then the version is cleared and resolved again (see resolve_fact_versions)
+        if table_name == 'fact_appointment':
+            updates += [
+                f"{surrogate_key} = CASE WHEN {natural_key} IS excluded.{natural_key} THEN {surrogate_key} END"
+                for natural_key, surrogate_key in SCD2_TABLES.values() if natural_key in df.columns
+            ]
+        sql += f" ON CONFLICT ({key}) DO " + (f"UPDATE SET {', '.join(updates)}" if updates else "NOTHING")
+    return sql
+
+# Stream the DataFrame into the table in batches, returns the loading rate in rows/sec
+@instrument(label='table_name')
+def bulk_insert(df, table_name, connection, key=None):
+    sql = insert_sql(df, table_name, key)
+    start_time = time.perf_counter()
+    for start in range(0, len(df), BULK_LOAD_BATCH_SIZE):
+        connection.executemany(sql, dataframe_to_rows(df.iloc[start:start + BULK_LOAD_BATCH_SIZE]))
+    elapsed = time.perf_counter() - start_time
+    return len(df) / elapsed if elapsed > 0 else float(len(df))
+
+# CHANGE DETECTION
+# Content hash of every row (all columns, including the key) as signed 64-bit integers SQLite can store.
+# Dates are hashed at one resolution, so the hash only changes with the values.
+def row_hashes(df):
+    df = df.copy(deep=False)
+    for column_name in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column_name]):
+            df[column_name] = df[column_name].astype('datetime64[ns]')
+    return pd.util.hash_pandas_object(df, index=False).to_numpy().view(np.int64)
+
+# Temporary table holding the keys and content hashes of the batch being synced
+def create_hash_staging_table(connection):
+    connection.execute("DROP TABLE IF EXISTS temp.staging_row_hash")
+    connection.execute("CREATE TEMP TABLE staging_row_hash (row_key INTEGER PRIMARY KEY, row_hash INTEGER NOT NULL)")
+
+# Temporary table collecting every key loaded into a table during this load, possibly over several
+# parts (chunks); rows whose key is not in it are deleted by delete_missing_rows. Created empty on first use.
+def loaded_keys_table(table_name, connection):
+    staged_table = f"loaded_keys_{table_name}"
+    connection.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staged_table} (row_key INTEGER PRIMARY KEY)")
+    return staged_table
+
+def stage_loaded_keys(table_name, keys, connection):
+    staged_table = loaded_keys_table(table_name, connection)
+    connection.executemany(
+        f"INSERT OR IGNORE INTO {staged_table} (row_key) VALUES (?)", [(int(key),) for key in keys]
+    )
+
+# Number of distinct keys staged for a table, and the staged keys dropped without deleting anything
+def count_loaded_keys(table_name, connection):
+    return connection.execute(f"SELECT COUNT(*) FROM {loaded_keys_table(table_name, connection)}").fetchone()[0]
+
+def drop_loaded_keys(table_name, connection):
+    connection.execute(f"DROP TABLE IF EXISTS temp.loaded_keys_{table_name}")
+
+# Write only what changed in a dimension table, batch by batch: the batch's keys and content hashes are
+# staged and joined with the stored hashes, so only the changed keys come back to Python. Rows with a new
+# key are inserted, rows whose hash differs from the stored one (or have none, loaded before change
+# detection) are updated, and when df is the complete table (complete=True) rows whose key is gone are deleted.
+# Returns the change summary of the table.
+@instrument(label='table_name')
+def sync_table(df, table_name, connection, complete=True):
+    key = TABLE_KEYS[table_name]
+    create_hash_staging_table(connection)
+    changed_sql = (
+        f"SELECT s.row_key, t.{key} IS NULL FROM staging_row_hash s "
+        f"LEFT JOIN etl_row_hash h ON h.table_name = ? AND h.row_key = s.row_key "
+        f"LEFT JOIN {table_name} t ON t.{key} = s.row_key "
+        f"WHERE t.{key} IS NULL OR h.row_hash IS NOT s.row_hash"
+    )
+    save_hashes_sql = (
+        "INSERT OR REPLACE INTO etl_row_hash (table_name, row_key, row_hash) "
+        "SELECT ?, s.row_key, s.row_hash FROM staging_row_hash s "
+        "LEFT JOIN etl_row_hash h ON h.table_name = ? AND h.row_key = s.row_key "
+        "WHERE h.row_hash IS NOT s.row_hash"
+    )
+
+    summary = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    for start in range(0, len(df), BULK_LOAD_BATCH_SIZE):
+        batch = df.iloc[start:start + BULK_LOAD_BATCH_SIZE]
+        keys = batch[key].to_numpy()
+        connection.execute("DELETE FROM staging_row_hash")
+        # A key repeated in the batch keeps its last row, as the upsert does
+        connection.executemany(
+            "INSERT OR REPLACE INTO staging_row_hash (row_key, row_hash) VALUES (?, ?)",
+            zip(keys.tolist(), row_hashes(batch).tolist())
+        )
+        changed = connection.execute(changed_sql, (table_name,)).fetchall()
+        if changed:
+            bulk_insert(batch[np.isin(keys, [row_key for row_key, _ in changed])], table_name, connection, key)
+            connection.execute(save_hashes_sql, (table_name, table_name))
+        if complete:
+            stage_loaded_keys(table_name, keys, connection)
+        inserted = sum(1 for _, is_new in changed if is_new)
+        summary['inserted'] += inserted
+        summary['updated'] += len(changed) - inserted
+        summary['unchanged'] += len(np.unique(keys)) - len(changed)
+    connection.execute("DROP TABLE temp.staging_row_hash")
+
+    if complete:
+        summary['deleted'] = delete_missing_rows(table_name, connection)
+
+    logger.info("Synced table '%s': %s", table_name, summary)
+    print(f"Synced '{table_name}': {summary['inserted']} inserted, {summary['updated']} updated, "
+          f"{summary['deleted']} deleted, {summary['unchanged']} unchanged.")
+    return summary
+
+# SLOWLY CHANGING DIMENSIONS
+# Empty temporary table with the columns of the frame and the row hash, typed like the dimension table
+def create_staging_table(df, table_name, connection):
+    natural_key = SCD2_TABLES[table_name][0]
+    staging_table = f"staging_{table_name}"
+    connection.execute(f"DROP TABLE IF EXISTS temp.{staging_table}")
+    connection.execute(
+        f"CREATE TEMP TABLE {staging_table} AS SELECT {', '.join(df.columns)}, row_hash FROM {table_name} WHERE 0"
+    )
+    connection.execute(f"CREATE UNIQUE INDEX temp.{staging_table}_key ON {staging_table} ({natural_key})")
+    return staging_table
+
+# Merge a frame into a versioned dimension, batch by batch through a staging table. Each batch takes one
+# UPDATE ... FROM that closes the current versions whose content hash changed and one INSERT ... SELECT that
+# adds a current version for the new and changed keys, so no row is compared in Python. When df is the
+# complete table, the current versions of keys gone from it are closed too (their history is kept).
+@instrument(label='table_name')
+def merge_versions(df, table_name, connection, loaded_at, complete=True):
+    natural_key = SCD2_TABLES[table_name][0]
+    # A key repeated in the source keeps its last row, the staging table holds one row per key
+    df = df.drop_duplicates(natural_key, keep='last')
+    staging_table = create_staging_table(df, table_name, connection)
+    columns = ', '.join(df.columns)
+    staged_columns = ', '.join(f"s.{column}" for column in df.columns)
+    close_sql = (
+        f"UPDATE {table_name} SET valid_to = ?, is_current = 0 FROM {staging_table} s "
+        f"WHERE {table_name}.{natural_key} = s.{natural_key} AND {table_name}.is_current = 1 "
+        f"AND {table_name}.row_hash IS NOT s.row_hash"
+    )
+    add_sql = (
+        f"INSERT INTO {table_name} ({columns}, row_hash, valid_from, valid_to, is_current) "
+        f"SELECT {staged_columns}, s.row_hash, ?, NULL, 1 FROM {staging_table} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} d WHERE d.{natural_key} = s.{natural_key} AND d.is_current = 1)"
+    )
+
+    summary = {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    for start in range(0, len(df), BULK_LOAD_BATCH_SIZE):
+        batch = df.iloc[start:start + BULK_LOAD_BATCH_SIZE]
+        connection.execute(f"DELETE FROM {staging_table}")
+        bulk_insert(batch.assign(row_hash=row_hashes(batch)), staging_table, connection)
+        closed = connection.execute(close_sql, (loaded_at,)).rowcount
+        added = connection.execute(add_sql, (loaded_at,)).rowcount
+        summary['updated'] += closed
+        summary['inserted'] += added - closed
+        summary['unchanged'] += len(batch) - added
+        if complete:
+            stage_loaded_keys(table_name, batch[natural_key], connection)
+    connection.execute(f"DROP TABLE temp.{staging_table}")
+
+    if complete:
+        summary['deleted'] = delete_missing_rows(table_name, connection, loaded_at)
+
+    logger.info("Merged versions of table '%s': %s", table_name, summary)
+    print(f"Merged '{table_name}': {summary['inserted']} new, {summary['updated']} new versions, "
+          f"{summary['deleted']} closed, {summary['unchanged']} unchanged.")
+    return summary
+
+# Close the current versions whose natural key was not loaded (see stage_loaded_keys), in one UPDATE
+@instrument(label='table_name')
+def expire_missing_versions(table_name, connection, loaded_at):
+    natural_key = SCD2_TABLES[table_name][0]
+    return connection.execute(
+        f"UPDATE {table_name} SET valid_to = ?, is_current = 0 WHERE is_current = 1 AND NOT EXISTS "
+        f"(SELECT 1 FROM {loaded_keys_table(table_name, connection)} k WHERE k.row_key = {table_name}.{natural_key})",
+        (loaded_at,)
+    ).rowcount
+
+# Point the fact rows without a version (new rows, or rows whose patient or doctor changed) at the version
+# of their doctor and patient that was valid on the appointment date: the latest version that started on
+# or before that day, or the first version for appointments older than the dimension's history. Rows that
+# already have one keep it, so an appointment stays with the fee and insurance it was loaded with.
+@instrument
+def resolve_fact_versions(connection):
+    appointment_date = "printf('%04d-%02d-%02d', appointment_date_id / 10000, appointment_date_id / 100 % 100, appointment_date_id % 100)"
+    for table_name, (natural_key, surrogate_key) in SCD2_TABLES.items():
+        valid_then = "date(d.valid_from) <= f.appointment_date"
+        resolved = connection.execute(
+            f"UPDATE fact_appointment SET {surrogate_key} = v.{surrogate_key} FROM ("
+            f"SELECT f.appointment_id, d.{surrogate_key}, ROW_NUMBER() OVER (PARTITION BY f.appointment_id "
+            f"ORDER BY {valid_then} DESC, CASE WHEN {valid_then} THEN d.valid_from END DESC, d.valid_from) AS rank "
+            f"FROM (SELECT appointment_id, {natural_key}, {appointment_date} AS appointment_date FROM fact_appointment "
+            f"WHERE {surrogate_key} IS NULL) f JOIN {table_name} d ON d.{natural_key} = f.{natural_key}"
+            f") v WHERE v.rank = 1 AND fact_appointment.appointment_id = v.appointment_id"
+        ).rowcount
+        logger.debug("Resolved %s fact rows to their version of '%s'", resolved, table_name)
+
+# Write a dimension frame: versioned dimensions are merged, the others synced by row hash. An empty
+# frame (a branch skipped for lack of rows, possibly without columns) writes nothing, but as a complete
+# table it still deletes every row.
+def sync_dimension(df, table_name, connection, loaded_at, complete=True):
+    if df.empty:
+        deleted = delete_missing_rows(table_name, connection, loaded_at) if complete else 0
+        return {'inserted': 0, 'updated': 0, 'deleted': deleted, 'unchanged': 0}
+    if table_name in SCD2_TABLES:
+        return merge_versions(df, table_name, connection, loaded_at, complete=complete)
+    return sync_table(df, table_name, connection, complete=complete)
+
+# Delete the rows whose key was not loaded (see stage_loaded_keys) with their stored hashes, in SQL;
+# versioned dimensions close the current version instead. Drops the staged keys.
+@instrument(label='table_name')
+def delete_missing_rows(table_name, connection, loaded_at=None):
+    # A table none of whose parts had rows has an empty staged table
+    staged_table = loaded_keys_table(table_name, connection)
+    if table_name in SCD2_TABLES:
+        deleted = expire_missing_versions(table_name, connection, loaded_at)
+    else:
+        key = TABLE_KEYS[table_name]
+        deleted = connection.execute(
+            f"DELETE FROM {table_name} WHERE NOT EXISTS "
+            f"(SELECT 1 FROM {staged_table} k WHERE k.row_key = {table_name}.{key})"
+        ).rowcount
+        connection.execute(
+            f"DELETE FROM etl_row_hash WHERE table_name = ? AND NOT EXISTS "
+            f"(SELECT 1 FROM {staged_table} k WHERE k.row_key = etl_row_hash.row_key)",
+            (table_name,)
+        )
+    drop_loaded_keys(table_name, connection)
+    return deleted
+
+# Add a table's change summary to those of the load; tables synced in several parts add up
+def add_change_summary(changes, table_name, summary):
+    total = changes.setdefault(table_name, dict.fromkeys(summary, 0))
+    for name, count in summary.items():
+        total[name] += count
+
+def print_change_summary(changes):
+    print(f"\n{'table':<24} {'inserted':>9} {'updated':>9} {'deleted':>9} {'unchanged':>10}")
+    for table_name, summary in changes.items():
+        print(f"{table_name:<24} {summary['inserted']:>9} {summary['updated']:>9} "
+              f"{summary['deleted']:>9} {summary['unchanged']:>10}")
+
+# Apply the bulk load settings for the duration of the load and restore the previous ones
+# (PRAGMA synchronous cannot be changed inside a transaction, so this wraps BEGIN/COMMIT)
+@contextmanager
+def bulk_load_pragmas(connection):
+    previous = {name: connection.execute(f"PRAGMA {name}").fetchone()[0] for name in BULK_LOAD_PRAGMAS}
+    for name, value in BULK_LOAD_PRAGMAS.items():
+        connection.execute(f"PRAGMA {name}={value}")
+    logger.debug("Applied bulk load settings %s, previous settings %s", BULK_LOAD_PRAGMAS, previous)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            connection.execute(f"PRAGMA {name}={value}")
+
+@instrument(label='table_name')
+def upsert_data_into_table(df, table_name, connection):
+    if df.empty:
+        logger.info("No new rows for table '%s'", table_name)
+        print(f"No new rows for '{table_name}'.")
+        return
+    key = TABLE_KEYS[table_name]
     try:
-        logger.debug(f"Starting to load {len(df)} rows into table '{table_name}'")
-        # Load DataFrame into SQLite table, replacing if exists
-        df.to_sql(table_name, connection, if_exists='replace', index=False)
-        logger.info(f"Successfully loaded {len(df)} rows into table '{table_name}'")
-        print(f"Loaded '{table_name}' successfully.")
+        logger.debug("Starting to upsert %s rows into table '%s' on '%s'", len(df), table_name, key)
+        rows_per_sec = bulk_insert(df, table_name, connection, key)
+        logger.info("Successfully upserted %s rows into table '%s' (%.0f rows/sec)", len(df), table_name, rows_per_sec)
+        print(f"Upserted {len(df)} rows into '{table_name}' successfully ({rows_per_sec:,.0f} rows/sec).")
     except Exception as e:
-        logger.error(f"Error loading table '{table_name}': {str(e)}")
-        print(f"Error loading '{table_name}': {e}")
+        logger.error("Error upserting table '%s': %s", table_name, e)
+        print(f"Error upserting '{table_name}': {e}")
+        raise
 
-def load_data(
-        specialty_df,
-        insurance_company_df,
-        coverage_type_df,
-        date_df,
-        time_df,
-        patients_df,
-        doctors_df,    
-        slots_df,
-        appointment_status_df,
-        appointment_df
-    ):
-    logger.info("Starting data loading process")
-    
-    # Define path to warehouse database
-    db_path = 'warehouse/warehouse.db'
+# Open the warehouse and run the caller's writes in one transaction with the bulk load settings.
+# A failure rolls everything back, so readers only ever see complete loads.
+@contextmanager
+def warehouse_transaction(db_path=WAREHOUSE_PATH):
     # Check if warehouse exists, if not create it
     if not os.path.exists(db_path):
-        logger.warning(f"Warehouse not found at '{db_path}'. Creating...")
+        logger.warning("Warehouse not found at '%s'. Creating...", db_path)
         print(f"Warehouse not found at '{db_path}'. Creating...")
         create_data_warehouse()
     
-    # Establish connection to warehouse database
-    logger.debug(f"Connecting to warehouse at {db_path}")
-    conn = sqlite3.connect(db_path)
-    logger.info(f"Connected to the warehouse {db_path}")
+    # Establish connection to warehouse database; transactions are managed explicitly below
+    logger.debug("Connecting to warehouse at %s", db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    logger.info("Connected to the warehouse %s", db_path)
     print(f"Connected to the warehouse { db_path }")
 
-    # Load dimension tables in specific order
-    logger.info("Starting to load dimension tables")
-    print("\nInserting specialty into warehouse...")
-    load_data_into_table(specialty_df, 'dim_doctor_specialty', conn)
+    # In WAL mode the dashboards keep reading the last committed load while this one is written
+    conn.execute("PRAGMA journal_mode=WAL")
+    try:
+        with bulk_load_pragmas(conn):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Recreate missing tables and keys (older loads replaced them with untyped copies)
+                ensure_warehouse_schema(conn)
+                yield conn
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                logger.error("Data loading failed, warehouse rolled back to the previous load: %s", e)
+                print("Data loading failed, warehouse rolled back to the previous load.")
+                raise
 
-    print("\nInserting insurance companies into warehouse...")
-    load_data_into_table(insurance_company_df, 'dim_insurance_company', conn)
+        # Fold the committed pages back into the database file without waiting for readers
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    finally:
+        # Close database connection
+        logger.debug("Closing database connection")
+        conn.close()
 
-    print("\nInserting coverage types into warehouse...")
-    load_data_into_table(coverage_type_df, 'dim_coverage_type', conn)
+# Whether a load wrote anything: fact rows or a dimension row inserted, updated or deleted
+def load_changed(changes, rows_loaded):
+    return rows_loaded > 0 or any(
+        summary['inserted'] or summary['updated'] or summary['deleted'] for summary in changes.values()
+    )
 
-    print("\nInserting dates into warehouse...")
-    load_data_into_table(date_df, 'dim_date', conn)
+# Resolve the new fact rows' versions, save the high-water marks, rebuild the rollups and stamp the load,
+# as the last writes of the load transaction. An incremental load that changed nothing (changed=False)
+# only saves the marks: the rollups, the run id and so the snapshot stay those of the previous load.
+# Returns the new run id, or None when the load was not stamped.
+@instrument
+def finish_load(connection, incremental, started_at, rows_loaded, watermarks=None, changed=True):
+    # Record how far the sources were read so the next run continues from there
+    if watermarks is not None:
+        save_watermarks(watermarks, connection, replace=not incremental)
+    if incremental and not changed:
+        logger.info("No table changed, keeping the rollups and warehouse version of the previous load")
+        print("No table changed, rollups and snapshot of the previous load are kept.")
+        return None
+    resolve_fact_versions(connection)
+    # Aggregate the loaded fact table for the dashboards
+    build_rollups(connection)
+    return record_etl_run(connection, 'incremental' if incremental else 'full', started_at, rows_loaded)
 
-    print("\nInserting times into warehouse...")
-    load_data_into_table(time_df, 'dim_time', conn)
+# Materialize the committed load as a columnar snapshot for the dashboards. The load is already
+# committed, so a failure here only leaves the readers on the slower join. Loads that were not
+# stamped with a run id (nothing changed) keep the previous snapshot.
+@instrument
+def write_snapshot(run_id, db_path=WAREHOUSE_PATH):
+    if run_id is None:
+        return
+    try:
+        export_snapshot(db_path, run_id)
+    except Exception as e:
+        logger.error("Writing the snapshot of run %s failed: %s", run_id, e)
+        print(f"Error writing the columnar snapshot: {e}")
+
+@instrument
+def load_data(
+        specialty_df,
+        insurance_company_df,
+        coverage_type_df,
+        date_df,
+        time_df,
+        patients_df,
+        doctors_df,    
+        slots_df,
+        appointment_status_df,
+        appointment_df,
+        incremental=False,
+        watermarks=None
+    ):
+    logger.info("Starting data loading process (%s)", 'incremental' if incremental else 'full refresh')
+    started_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
 
-    print("\nInserting patients into warehouse...")
-    load_data_into_table(patients_df, 'dim_patient', conn)
+    # Dimensions are synced by row hash (doctors and patients merged as versions), so only changed rows
+    # are written; fact rows are upserted, so existing rows keep their dimension versions
+    # Dimension tables in loading order, the fact table is loaded last
+    tables = [
+        ("specialty", specialty_df, 'dim_doctor_specialty'),
+        ("insurance companies", insurance_company_df, 'dim_insurance_company'),
+        ("coverage types", coverage_type_df, 'dim_coverage_type'),
+        ("dates", date_df, 'dim_date'),
+        ("times", time_df, 'dim_time'),
+        ("patients", patients_df, 'dim_patient'),
+        ("doctors", doctors_df, 'dim_doctor'),
+        ("slots", slots_df, 'dim_slot'),
+        ("appointment statuses", appointment_status_df, 'dim_appointment_status')
+    ]
 
-    print("\nInserting doctors into warehouse...")
-    load_data_into_table(doctors_df, 'dim_doctor', conn)
+    # All tables are written in a single transaction, so a failure leaves the previous load untouched
+    changes = {}
+    with warehouse_transaction() as conn:
+        logger.info("Starting to load dimension and fact tables")
+        for description, df, table_name in tables:
+            print(f"\nSyncing {description} into warehouse...")
+            # Frames of incremental runs only hold new rows, rows missing from them are not deleted
+            complete = not incremental or table_name in FULL_SOURCE_TABLES
+            if df.empty and not complete:
+                print(f"No new rows for '{table_name}'.")
+                continue
+            changes[table_name] = sync_dimension(df, table_name, conn, started_at, complete=complete)
 
-    print("\nInserting slots into warehouse...")
-    load_data_into_table(slots_df, 'dim_slot', conn)
+        print("\nInserting appointments FACT data into warehouse...")
+        upsert_data_into_table(appointment_df, 'fact_appointment', conn)
+        # A full refresh deletes the appointments gone from the source
+        if not incremental:
+            # Without appointments the frame may have no columns, then every fact row is deleted
+            if 'appointment_id' in appointment_df:
+                stage_loaded_keys('fact_appointment', appointment_df['appointment_id'], conn)
+            deleted = delete_missing_rows('fact_appointment', conn)
+            logger.info("Deleted %s appointments gone from the source", deleted)
 
-    print("\nInserting appointment statuses into warehouse...")
-    load_data_into_table(appointment_status_df, 'dim_appointment_status', conn)
+        run_id = finish_load(
+            conn, incremental, started_at, len(appointment_df), watermarks,
+            changed=load_changed(changes, len(appointment_df))
+        )
 
-    # Load fact table last
-    logger.info("Starting to load fact table")
-    print("\nInserting appointments FACT data into warehouse...")
-    load_data_into_table(appointment_df, 'fact_appointment', conn)
+    print_change_summary(changes)
 
-    # Close database connection
-    logger.debug("Closing database connection")
-    conn.close()
-    logger.info("Data loading process completed successfully")
+    write_snapshot(run_id)
+    logger.info("Data loading process completed successfully (run %s)", run_id)
+    return run_id
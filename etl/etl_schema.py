@@ -0,0 +1,138 @@
+# Import required libraries for typing the extracted data
+import sys
+import pandas as pd
+from etl.etl_instrumentation import instrument
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Types of every source column: small integers for ids and ages, categoricals for low-cardinality
+# text and datetimes parsed at read time. Columns typed None are not used by the warehouse and
+# are skipped when reading the flat files.
+SOURCE_SCHEMAS = {
+    # Flat files
+    'appointments': {
+        'appointment_id': 'int32',
+        'slot_id': 'int32',
+        'scheduling_date': None,
+        'appointment_date': 'datetime64[ns]',
+        'appointment_time': 'category',
+        'scheduling_interval': 'int16',
+        'status': 'category',
+        'check_in_time': None,
+        'appointment_duration': 'float64',
+        'start_time': None,
+        'end_time': None,
+        'waiting_time': 'float64',
+        'patient_id': 'int32',
+        'sex': None,
+        'age': 'int16',
+        'age_group': None
+    },
+    'patients': {
+        'patient_id': 'int32',
+        'name': 'object',
+        'sex': 'category',
+        'dob': 'datetime64[ns]',
+        'insurance': 'category'
+    },
+    'slots': {
+        'slot_id': 'int32',
+        'appointment_date': 'datetime64[ns]',
+        'appointment_time': 'category',
+        'is_available': None
+    },
+
+    # Source database tables
+    'doctor': {
+        'doctor_id': 'int32',
+        'first_name': 'object',
+        'last_name': 'object',
+        'email': 'object',
+        'phone': 'object',
+        'specialty_id': 'int32',
+        'years_of_experience': 'int16',
+        'appointment_fee': 'float64',
+        'gender': 'category'
+    },
+    'specialty': {
+        'specialty_id': 'int32',
+        'title': 'object'
+    },
+    'coverage_type': {
+        'coverage_type_id': 'int32',
+        'title': 'object'
+    },
+    'doctor_appointment': {
+        'appointment_id': 'int32',
+        'doctor_id': 'int32'
+    },
+
+    # Insurance API (after 'rownum' is renamed)
+    'insurance_company': {
+        'insurance_company_id': 'int32',
+        'insurance_company_name': 'category',
+        'insurance_company_type': 'category',
+        'founded_year': 'int16',
+        'coverage_area': 'category'
+    }
+}
+
+# Format of the date columns in the sources
+DATE_FORMAT = '%Y-%m-%d'
+
+def is_date_type(dtype):
+    return dtype is not None and dtype.startswith('datetime64')
+
+# pd.read_csv arguments that read only the used columns of a flat file with their final types
+def read_csv_kwargs(source):
+    schema = SOURCE_SCHEMAS[source]
+    return {
+        'usecols': [column for column, dtype in schema.items() if dtype is not None],
+        'dtype': {column: dtype for column, dtype in schema.items() if dtype is not None and not is_date_type(dtype)},
+        'parse_dates': [column for column, dtype in schema.items() if is_date_type(dtype)],
+        'date_format': DATE_FORMAT
+    }
+
+# Cast a frame read without types (database and API sources) to its schema
+@instrument(label='source')
+def apply_schema(df, source):
+    schema = SOURCE_SCHEMAS[source]
+    for column, dtype in schema.items():
+        if column not in df.columns or dtype is None:
+            continue
+        if is_date_type(dtype):
+            df[column] = pd.to_datetime(df[column], format=DATE_FORMAT, errors='coerce')
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+# Estimated memory of the frame with pandas' default inference: 64-bit numbers and Python strings
+# for text and dates. Computed from the typed frame, not measured on a frame read without the schema.
+def inferred_memory_usage(df):
+    total = int(df.index.memory_usage())
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            total += int(values.astype(object).memory_usage(index=False, deep=True))
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            # Dates stay strings until transformed, one pointer plus one str object per row
+            total += len(values) * (8 + sys.getsizeof('2000-01-01'))
+        elif pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            total += len(values) * 8
+        else:
+            total += int(values.memory_usage(index=False, deep=True))
+    return total
+
+# Print the measured memory of each extracted frame with the schema types, next to the estimate of
+# inferred_memory_usage for pandas' default types
+def report_memory(frames):
+    logger.info("Memory of extracted frames (estimated with inferred types -> measured with schema types)")
+    print(f"  {'Frame':<22}{'Rows':>10}{'Inferred est. (MB)':>20}{'Typed (MB)':>14}{'Est. saved':>12}")
+    for name, df in frames.items():
+        inferred = inferred_memory_usage(df)
+        typed = int(df.memory_usage(deep=True).sum())
+        saved = 1 - typed / inferred if inferred else 0
+        print(f"  {name:<22}{len(df):>10}{inferred / 1024 ** 2:>20.2f}{typed / 1024 ** 2:>14.2f}{saved:>12.0%}")
+        logger.info("Frame '%s': %s rows, est. %s bytes inferred -> %s bytes typed", name, len(df), inferred, typed)
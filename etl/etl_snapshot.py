@@ -0,0 +1,88 @@
+# Import required libraries for the columnar snapshot of the warehouse
+import os
+import sqlite3
+import time
+import pandas as pd
+from olap.cube import CUBE_QUERY
+from etl.etl_instrumentation import instrument
+from config.logging_config import setup_logger
+
+# pyarrow is optional: without it no snapshot is written and readers run the join on the warehouse
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# File name of the snapshot, written next to the warehouse database
+SNAPSHOT_FILE = 'appointments_cube.arrow'
+
+# Dimension attributes stored dictionary-encoded (categorical once read back into pandas), with sorted
+# dictionaries: the filter engine uses the indices as its codes (olap/filters.py)
+DICTIONARY_COLUMNS = [
+    'weekday',
+    'status_title',
+    'specialty_title',
+    'insurance_company_name',
+    'coverage_type',
+    'gender',
+    'doctor_gender'
+]
+
+# Store the dimension attributes as categoricals with sorted categories, which become the dictionaries
+def encode_dictionary_columns(df):
+    for column in DICTIONARY_COLUMNS:
+        values = df[column].astype('category')
+        df[column] = values.cat.reorder_categories(values.cat.categories.sort_values())
+    return df
+
+def snapshot_path(db_path):
+    return os.path.join(os.path.dirname(db_path), SNAPSHOT_FILE)
+
+def latest_run_id(connection):
+    try:
+        row = connection.execute("SELECT MAX(run_id) FROM etl_run").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+# Run the cube query on the warehouse
+@instrument
+def read_cube_from_warehouse(connection):
+    return pd.read_sql_query(CUBE_QUERY, connection)
+
+# Write the cube of the committed load as an uncompressed Arrow IPC (Feather v2) file, which readers
+# can memory-map. The file is written under a temporary name and renamed, so readers never see a partial file.
+@instrument
+def export_snapshot(db_path, run_id):
+    if pa is None:
+        logger.warning("pyarrow is not installed, skipping the columnar snapshot")
+        return None
+
+    start_time = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        df = read_cube_from_warehouse(conn)
+    finally:
+        conn.close()
+
+    table = pa.Table.from_pandas(encode_dictionary_columns(df), preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'run_id': str(run_id).encode(),
+        b'created_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()).encode()
+    })
+
+    path = snapshot_path(db_path)
+    temp_path = f"{path}.tmp"
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+    elapsed = time.perf_counter() - start_time
+    logger.info("Wrote snapshot of run %s with %s rows to '%s' in %.2fs", run_id, len(df), path, elapsed)
+    print(f"Wrote columnar snapshot '{path}' ({len(df)} rows, {os.path.getsize(path) / 1024 ** 2:.1f} MB).")
+    return path
@@ -1,12 +1,40 @@
 # Import required libraries for data manipulation
 import pandas as pd
 import numpy as np
+from etl.etl_instrumentation import instrument
 from config.logging_config import setup_logger
 
 # Set up logger for this module
 logger = setup_logger(__name__)
 
+# Probability weights of the coverage types, in coverage_type_id order
+COVERAGE_WEIGHTS = [0.3, 0.6, 0.07, 0.02, 0.01]
+# Seed of the coverage type assignment: changing it reassigns every patient
+COVERAGE_SEED = 1516
+
+# Uniform values in [0, 1) that depend only on the ids and the seed: the splitmix64 mix of each id,
+# vectorized with wrapping uint64 arithmetic
+def hashed_uniform(ids, seed):
+    x = np.asarray(ids).astype(np.uint64) + np.uint64((seed * 0x9E3779B97F4A7C15) % 2 ** 64)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    # The top 53 bits as a double
+    return (x >> np.uint64(11)).astype(np.float64) / float(2 ** 53)
+
+# Coverage type of each patient drawn with the weights from a hash of patient_id, so a patient keeps
+# the same coverage type on every run, in any chunk and whatever the order of the rows
+def assign_coverage_types(patient_ids, coverage_type_ids, weights=COVERAGE_WEIGHTS, seed=COVERAGE_SEED):
+    coverage_type_ids = np.sort(np.asarray(coverage_type_ids))
+    if len(coverage_type_ids) != len(weights):
+        raise ValueError(f"Got {len(coverage_type_ids)} coverage types for {len(weights)} weights")
+    cumulative = np.cumsum(weights, dtype=np.float64)
+    cumulative /= cumulative[-1]
+    positions = np.searchsorted(cumulative, hashed_uniform(patient_ids, seed), side='right')
+    return coverage_type_ids[np.minimum(positions, len(coverage_type_ids) - 1)]
+
 # DATA TRANSFORMATIONS
+@instrument
 def create_dim_date(appointments_df):
     logger.info("Starting date dimension creation")
     # Convert appointment_date column to datetime format
@@ -16,7 +44,7 @@ def create_dim_date(appointments_df):
     # Get maximum date from appointments
     max_date = appointments_df['appointment_date'].max()
 
-    logger.debug(f"Date range: {min_date} to {max_date}")
+    logger.debug("Date range: %s to %s", min_date, max_date)
     # Create date range between min and max dates
     date_range = pd.date_range(start=min_date, end=max_date)
     # Create date dimension DataFrame with various date attributes
@@ -31,12 +59,15 @@ def create_dim_date(appointments_df):
     })
 
     # Add date_id to appointments DataFrame
-    appointments_df['appointment_date_id'] = appointments_df['appointment_date'].dt.strftime('%Y%m%d').astype(int)
+    # (computed from the date parts, formatting every date as text is much slower)
+    appointment_dates = appointments_df['appointment_date'].dt
+    appointments_df['appointment_date_id'] = appointment_dates.year * 10000 + appointment_dates.month * 100 + appointment_dates.day
     logger.info("Date dimension generated successfully")
     print("  DATE dimension generated successfully.")
     return appointments_df, dim_date
 
 
+@instrument
 def create_dim_time(appointments_df):
     logger.info("Starting time dimension creation")
     # Create time range from 8 AM to 6 PM with 15-minute intervals
@@ -56,26 +87,41 @@ def create_dim_time(appointments_df):
     print("  TIME dimension generated successfully.")
     return appointments_df, dim_time
 
-def create_dim_appointment_status(appointments_df):
+@instrument
+def create_dim_appointment_status(appointments_df, existing_status_df=None):
     logger.info("Starting appointment status dimension creation")
     # Get unique status values from appointments
-    unique_statuses = appointments_df['status'].dropna().unique()
-    logger.debug(f"Found {len(unique_statuses)} unique appointment statuses")
-    # Create status dimension DataFrame
-    dim_status = pd.DataFrame({
-        'status_id': range(1, len(unique_statuses) + 1),
-        'status_title': unique_statuses
-    })
+    unique_statuses = list(appointments_df['status'].dropna().unique())
+    logger.debug("Found %s unique appointment statuses", len(unique_statuses))
+    if existing_status_df is not None and not existing_status_df.empty:
+        # Keep the ids already in the warehouse and number unseen statuses after them
+        known_status_df = existing_status_df[['status_id', 'status_title']]
+        new_statuses = [s for s in unique_statuses if s not in set(known_status_df['status_title'])]
+        next_id = int(known_status_df['status_id'].max()) + 1
+        dim_status = pd.concat([
+            known_status_df,
+            pd.DataFrame({
+                'status_id': range(next_id, next_id + len(new_statuses)),
+                'status_title': new_statuses
+            })
+        ], ignore_index=True)
+    else:
+        # Create status dimension DataFrame
+        dim_status = pd.DataFrame({
+            'status_id': range(1, len(unique_statuses) + 1),
+            'status_title': unique_statuses
+        })
 
     # Create lookup dictionary for status mapping
     status_lookup = dict(zip(dim_status['status_title'], dim_status['status_id']))
-    # Add status_id to appointments DataFrame
-    appointments_df['appointment_status_id'] = appointments_df['status'].map(status_lookup)
+    # Add status_id to appointments DataFrame (a categorical status would map to categorical ids)
+    appointments_df['appointment_status_id'] = appointments_df['status'].astype(object).map(status_lookup)
 
     logger.info("Appointment status dimension generated successfully")
     print("  APPOINTMENT STATUS dimension generated successfully.")
     return appointments_df, dim_status
 
+@instrument
 def map_doctor_to_appointments(appointments_df, doctor_appointment_df):
     logger.info("Starting doctor to appointments mapping")
     # Check for duplicate appointment_ids in doctor_appointment
@@ -93,13 +139,14 @@ def map_doctor_to_appointments(appointments_df, doctor_appointment_df):
     # Check for appointments without assigned doctors
     if merged_df['doctor_id'].isnull().any():
         missing = merged_df[merged_df['doctor_id'].isnull()]
-        logger.error(f"Found {len(missing)} appointments without assigned doctors")
+        logger.error("Found %s appointments without assigned doctors", len(missing))
         raise ValueError(f"Some appointments have no matching doctor_id:\n{missing[['appointment_id']].head()}")
 
     logger.info("Appointment records and doctors merged successfully")
     print("  Appoinment records and doctors merged successfully.")
     return merged_df
 
+@instrument
 def map_insurance_to_patients(patients_df, insurance_company_df):
     logger.info("Starting insurance to patients mapping")
     # Merge patients with insurance companies based on name
@@ -117,19 +164,14 @@ def map_insurance_to_patients(patients_df, insurance_company_df):
     return merged_df
 
 
+@instrument
 def transform_patient(patients_df, coverage_type_df):
     logger.info("Starting patient transformation")
-    # 1. Extract IDs and assign probabilities in correct order
-    coverage_type_ids = coverage_type_df['coverage_type_id'].tolist()
-    # Define probability weights for coverage types
-    weights = [0.3, 0.6, 0.07, 0.02, 0.01]
-
-    logger.debug(f"Assigning coverage types to {len(patients_df)} patients")
-    # Randomly assign coverage types based on weights
-    patients_df['coverage_type_id'] = np.random.choice(
-        coverage_type_ids,
-        size=len(patients_df),
-        p=weights
+    # 1. Assign coverage types with the weights, deterministically per patient
+    logger.debug("Assigning coverage types to %s patients", len(patients_df))
+    patients_df['coverage_type_id'] = assign_coverage_types(
+        patients_df['patient_id'].to_numpy(),
+        coverage_type_df['coverage_type_id'].to_numpy()
     )
 
     # 2. Split name into first and last names
@@ -147,6 +189,7 @@ def transform_patient(patients_df, coverage_type_df):
     print("  Patient columns transformed successfully.")
     return patients_df
 
+@instrument
 def format_appointment(appointments_df):    
     logger.info("Starting appointment formatting")
     # Select and rename columns for fact table
@@ -172,6 +215,7 @@ def format_appointment(appointments_df):
     logger.info("Appointment formatting completed successfully")
     return clean_appointment_df
 
+@instrument
 def format_specialty(specialty_df):    
     logger.info("Starting specialty formatting")
     # Rename title column for consistency
@@ -179,6 +223,7 @@ def format_specialty(specialty_df):
     logger.info("Specialty formatting completed successfully")
     return specialty_df
 
+@instrument
 def format_coverage_type(coverage_type_df):    
     logger.info("Starting coverage type formatting")
     # Rename title column for consistency
@@ -186,6 +231,7 @@ def format_coverage_type(coverage_type_df):
     logger.info("Coverage type formatting completed successfully")
     return coverage_type_df
 
+@instrument
 def format_slots(slots_df):    
     logger.info("Starting slots formatting")
     # Remove is_available column if it exists
@@ -193,6 +239,7 @@ def format_slots(slots_df):
     logger.info("Slots formatting completed successfully")
     return result_df
 
+@instrument
 def format_doctors(doctors_df):    
     logger.info("Starting doctors formatting")
     # Remove contact information columns
@@ -1,26 +1,29 @@
 import schedule
 import time
 from config.logging_config import setup_logger
+from config.metrics import start_metrics_server
 
 # Set up logger for this module
 logger = setup_logger(__name__)
 
-# Import pipeline script
-from pipeline import etl_pipeline
-
-def run_pipeline_with_message():
-    etl_pipeline()
+def run_pipeline_with_message(full_refresh=False, chunksize=None):
+    # Import pipeline script on first run, so the scheduler starts without loading pandas and the ETL modules
+    from pipeline import etl_pipeline
+    etl_pipeline(full_refresh=full_refresh, chunksize=chunksize)
     print("Scheduler is running. ETL will run daily at 00:00. Press Ctrl+C to stop.")
     logger.info("Scheduler is running. ETL will run daily at 00:00.")
 
 
-def run_scheduled_pipeline():   
+def run_scheduled_pipeline(full_refresh=False, chunksize=None):   
     logger.info("Starting scheduled pipeline")
+    # ETL run metrics on http://<host>:$METRICS_PORT/metrics when METRICS_PORT is set
+    start_metrics_server()
     #Run the pipeline for the first time without waiting schedule. Next run will be as scheduled.
-    run_pipeline_with_message()     
+    #Only this first run honours --full-refresh, scheduled runs are incremental.
+    run_pipeline_with_message(full_refresh, chunksize)     
     
     #Schedule the pipeline run for at the end of the day
-    schedule.every().day.at("00:00").do(run_pipeline_with_message)
+    schedule.every().day.at("00:00").do(run_pipeline_with_message, chunksize=chunksize)
     #schedule.every(5).minutes.do(run_pipeline_with_message) #this is for testing the scheduler
     
     while True:        
@@ -30,4 +33,6 @@ def run_scheduled_pipeline():
         
 # Make sure the pipeline only runs when this script is executed directly not imported from other file
 if __name__ == "__main__":    
-    run_scheduled_pipeline()
\ No newline at end of file
+    from config.cli import parse_args
+    args = parse_args()
+    run_scheduled_pipeline(full_refresh=args.full_refresh, chunksize=args.chunksize)
\ No newline at end of file
@@ -0,0 +1 @@
+# Package initializer for olap module
@@ -0,0 +1,153 @@
+# Import required libraries for caching warehouse data between dashboard requests
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Version stamp of the warehouse: the run id of the latest committed load and the database file's
+# modification time (which also catches loads made before etl_run existed). None without a warehouse.
+def warehouse_version(db_path):
+    if not os.path.exists(db_path):
+        return None
+    conn = sqlite3.connect(db_path)
+    try:
+        run_id = conn.execute("SELECT MAX(run_id) FROM etl_run").fetchone()[0]
+    except sqlite3.OperationalError:
+        run_id = None
+    finally:
+        conn.close()
+    return run_id, os.stat(db_path).st_mtime_ns
+
+# Value loaded from the warehouse and kept until the warehouse version changes.
+# The first load blocks; after that a new version is loaded in a background thread while callers
+# keep getting the previous value, so a refresh tick never waits for a reload.
+class VersionedCache:
+    def __init__(self, name, loader, version_func):
+        self.name = name
+        self._loader = loader
+        self._version_func = version_func
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+        self._loaded = False
+        self._reloading = None
+
+    @property
+    def version(self):
+        return self._version
+
+    def get(self):
+        version = self._version_func()
+        with self._lock:
+            if not self._loaded:
+                self._load(version)
+            elif version != self._version and self._reloading is None:
+                logger.info("Warehouse version changed from %s to %s, reloading '%s' in the background", self._version, version, self.name)
+                self._reloading = threading.Thread(
+                    target=self._reload, args=(version,), name=f"reload-{self.name}", daemon=True
+                )
+                self._reloading.start()
+            return self._value
+
+    def _load(self, version):
+        self._value = self._loader()
+        self._version = version
+        self._loaded = True
+        logger.debug("Loaded '%s' for warehouse version %s", self.name, version)
+
+    def _reload(self, version):
+        try:
+            value = self._loader()
+        except Exception as e:
+            # Keep serving the previous value, the next call retries
+            logger.error("Reloading '%s' for warehouse version %s failed: %s", self.name, version, e)
+            value = None
+        with self._lock:
+            if value is not None:
+                self._value = value
+                self._version = version
+                logger.info("Reloaded '%s' for warehouse version %s", self.name, version)
+            self._reloading = None
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+            self._version = None
+            self._loaded = False
+
+# Hashable key of normalized filters (see olap.query.normalize_filters), the same for any order of filters
+def filter_key(filters):
+    return tuple(sorted(
+        (dimension, tuple(value) if isinstance(value, list) else value) for dimension, value in filters.items()
+    ))
+
+# Approximate memory of a cached result: frames and series with their contents, containers recursively
+# (pandas objects are recognized by memory_usage, so this module does not import pandas)
+def result_size(value):
+    if hasattr(value, 'memory_usage'):
+        size = value.memory_usage(index=True, deep=True)
+        # A frame reports the memory of each column, a series a single number
+        return int(size.sum() if hasattr(size, 'sum') else size)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(result_size(key) + result_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(result_size(item) for item in value)
+    return sys.getsizeof(value)
+
+# Least recently used cache bounded by the memory of its values rather than their number.
+# Thread-safe, the Dash callbacks of one worker share it.
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = result_size(value)
+        # A value larger than the whole cache would only evict everything else
+        if size > self.max_bytes:
+            logger.debug("Not caching result of %s bytes, larger than the cache (%s bytes)", size, self.max_bytes)
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
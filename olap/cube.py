@@ -0,0 +1,99 @@
+# Import required libraries for the appointment cube and its rollup tables
+import json
+import time
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Star schema join behind the appointment cube: the fact table with every dimension it references.
+# Doctors and patients are joined on the surrogate key of the version the appointment was loaded with.
+CUBE_FROM = """
+    FROM fact_appointment fa
+    JOIN dim_date dd ON fa.appointment_date_id = dd.date_id
+    JOIN dim_appointment_status das ON fa.appointment_status_id = das.status_id
+    JOIN dim_doctor ddoc ON fa.doctor_key = ddoc.doctor_key
+    JOIN dim_doctor_specialty dds ON ddoc.specialty_id = dds.specialty_id
+    JOIN dim_patient dp ON fa.patient_key = dp.patient_key
+    JOIN dim_insurance_company dic ON dp.insurance_company_id = dic.insurance_company_id
+    JOIN dim_coverage_type dct ON dp.coverage_type_id = dct.coverage_type_id
+"""
+
+# Denormalized appointment cube: one row per appointment with its dimension attributes
+CUBE_QUERY = """
+    SELECT fa.*, dd.year, dd.month, dd.weekday,
+           das.status_title, dds.specialty_title,
+           dic.insurance_company_name, dct.coverage_title as coverage_type,
+           dp.gender,
+           ddoc.years_of_experience, ddoc.appointment_fee,
+           ddoc.gender as doctor_gender
+""" + CUBE_FROM
+
+# Dimensions of the cube and their column in the star schema join
+DIMENSIONS = {
+    'year': 'dd.year',
+    'month': 'dd.month',
+    'weekday': 'dd.weekday',
+    'status_title': 'das.status_title',
+    'specialty_title': 'dds.specialty_title',
+    'insurance_company_name': 'dic.insurance_company_name',
+    'coverage_type': 'dct.coverage_title',
+    'gender': 'dp.gender',
+    'doctor_gender': 'ddoc.gender',
+    'patient_age': 'fa.patient_age'
+}
+
+# Additive measures: their aggregate over the join and over an already aggregated rollup
+MEASURES = {
+    'appointment_count': ('COUNT(*)', 'SUM(appointment_count)'),
+    'fee_sum': ('SUM(ddoc.appointment_fee)', 'SUM(fee_sum)'),
+    'waiting_sum': ('SUM(fa.waiting_duration_min)', 'SUM(waiting_sum)')
+}
+
+# Distinct counts are not additive, so no rollup can answer them: they are only computed on the join
+DISTINCT_MEASURES = {
+    'doctor_count': 'COUNT(DISTINCT fa.doctor_id)',
+    'patient_count': 'COUNT(DISTINCT fa.patient_id)'
+}
+
+# Rollup tables built after every load. agg_base is the finest grain over the dimensions the dashboards
+# group and filter by; the other rollups are aggregated from it for the common chart combinations.
+BASE_ROLLUP = 'agg_base'
+ROLLUPS = {
+    BASE_ROLLUP: ['year', 'month', 'status_title', 'specialty_title', 'insurance_company_name', 'gender', 'coverage_type'],
+    'agg_year_month_status': ['year', 'month', 'status_title'],
+    'agg_year_specialty_gender_status': ['year', 'specialty_title', 'gender', 'status_title'],
+    'agg_year_insurance_gender_status': ['year', 'insurance_company_name', 'gender', 'status_title'],
+    'agg_year_coverage_gender_status': ['year', 'coverage_type', 'gender', 'status_title']
+}
+
+def rollup_sql(table_name, dimensions):
+    columns = ', '.join(dimensions)
+    if table_name == BASE_ROLLUP:
+        select = ', '.join(f"{DIMENSIONS[dimension]} AS {dimension}" for dimension in dimensions)
+        measures = ', '.join(f"{fact_sql} AS {measure}" for measure, (fact_sql, _) in MEASURES.items())
+        group_by = ', '.join(DIMENSIONS[dimension] for dimension in dimensions)
+        return f"CREATE TABLE {table_name} AS SELECT {select}, {measures} {CUBE_FROM} GROUP BY {group_by}"
+    measures = ', '.join(f"{rollup_expr} AS {measure}" for measure, (_, rollup_expr) in MEASURES.items())
+    return f"CREATE TABLE {table_name} AS SELECT {columns}, {measures} FROM {BASE_ROLLUP} GROUP BY {columns}"
+
+# Rebuild the rollup tables and their catalog from the loaded fact table.
+# Runs inside the load transaction, so the rollups always match the fact table readers see.
+def build_rollups(connection):
+    start_time = time.perf_counter()
+    connection.execute("DELETE FROM agg_catalog")
+    # The base rollup is built first, the others are aggregated from it
+    for table_name, dimensions in ROLLUPS.items():
+        connection.execute(f"DROP TABLE IF EXISTS {table_name}")
+        connection.execute(rollup_sql(table_name, dimensions))
+        row_count = connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        connection.execute(
+            "INSERT INTO agg_catalog (table_name, dimensions, measures, row_count, built_at) "
+            "VALUES (?, ?, ?, ?, datetime('now'))",
+            (table_name, json.dumps(dimensions), json.dumps(list(MEASURES)), row_count)
+        )
+        logger.debug("Built rollup '%s' over %s with %s rows", table_name, dimensions, row_count)
+
+    elapsed = time.perf_counter() - start_time
+    logger.info("Built %s rollup tables in %.2fs", len(ROLLUPS), elapsed)
+    print(f"Built {len(ROLLUPS)} rollup tables in {elapsed:.2f}s.")
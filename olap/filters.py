@@ -0,0 +1,140 @@
+# Import required libraries for filtering and aggregating the appointment cube in memory
+import numpy as np
+import pandas as pd
+from olap.query import Range, FRAME_MEASURES
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Cube columns the dashboards filter and group by
+FILTER_DIMENSIONS = [
+    'year',
+    'month',
+    'weekday',
+    'status_title',
+    'specialty_title',
+    'insurance_company_name',
+    'gender',
+    'doctor_gender',
+    'coverage_type',
+    'patient_age'
+]
+
+# Values of a cube column as a numpy array. Columns of an Arrow table (see olap/shared_store.py) are
+# returned as views of its buffers when they have one chunk and no nulls, so nothing is copied.
+def column_values(column):
+    if isinstance(column, pd.Series):
+        return column.to_numpy()
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy(zero_copy_only=False)
+    return column.to_numpy()
+
+# Integer codes (-1 for missing) and sorted categories of a dimension column. A dictionary-encoded Arrow
+# column already is codes and categories: its indices are used as they are when the dictionary is sorted
+# and unique (as the snapshot writes it), and remapped to the sorted categories otherwise.
+def column_codes(column):
+    if not isinstance(column, pd.Series) and column.num_chunks == 1 and column.null_count == 0 \
+            and hasattr(column.type, 'index_type'):
+        chunk = column.chunk(0)
+        codes = chunk.indices.to_numpy(zero_copy_only=False)
+        dictionary = pd.Index(chunk.dictionary.to_pylist())
+        if dictionary.is_monotonic_increasing and dictionary.is_unique:
+            return codes, dictionary
+        remap, categories = pd.factorize(dictionary, sort=True)
+        return remap.astype(np.int32)[codes], pd.Index(categories)
+    codes, categories = pd.factorize(column_values(column), sort=True)
+    return codes.astype(np.int32), pd.Index(categories)
+
+# Filters and aggregates the appointment cube without copying it. Built once per data version:
+# every filter dimension is encoded as integer codes with one packed bitmap per value, so a filter
+# state is answered by OR-ing the bitmaps of the selected values and AND-ing the dimensions.
+# The cube is a DataFrame or a memory-mapped Arrow table shared by processes (olap/shared_store.py);
+# the codes of its dictionary-encoded columns are read from the mapping, but the codes of the other
+# dimensions and all bitmaps (about rows / 8 bytes per dimension value) are built by each process.
+class FilterEngine:
+    def __init__(self, df, dimensions=FILTER_DIMENSIONS):
+        # Only the measure columns are read from the cube after the dimensions are encoded
+        self._df = df
+        self.size = len(df)
+        self._codes = {}
+        self._categories = {}
+        self._bitmaps = {}
+        for dimension in dimensions:
+            codes, categories = column_codes(df[dimension])
+            self._codes[dimension] = codes
+            self._categories[dimension] = categories
+            self._bitmaps[dimension] = [np.packbits(codes == code) for code in range(len(categories))]
+        logger.debug("Built filter engine over %s rows and %s dimensions", self.size, len(dimensions))
+
+    def _dimension_bitmap(self, dimension, value):
+        categories = self._categories[dimension]
+        if isinstance(value, Range):
+            selected = np.flatnonzero((categories >= value.low) & (categories <= value.high))
+        else:
+            selected = categories.get_indexer(value)
+            selected = selected[selected >= 0]
+        bitmap = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for code in selected:
+            np.bitwise_or(bitmap, self._bitmaps[dimension][code], out=bitmap)
+        return bitmap
+
+    # Row positions matching the normalized filters (see olap.query.normalize_filters), None for all rows
+    def rows(self, filters):
+        if not filters:
+            return None
+        bitmap = None
+        for dimension, value in filters.items():
+            dimension_bitmap = self._dimension_bitmap(dimension, value)
+            bitmap = dimension_bitmap if bitmap is None else np.bitwise_and(bitmap, dimension_bitmap, out=bitmap)
+        return np.flatnonzero(np.unpackbits(bitmap, count=self.size))
+
+    def _column(self, column, rows):
+        values = column_values(self._df[column])
+        return values if rows is None else values[rows]
+
+    # Measures (see olap.query.FRAME_MEASURES) by group_by over the filtered rows, computed with
+    # bincount on the dimension codes instead of a pandas groupby on a filtered copy
+    def aggregate(self, filters, group_by, measures):
+        rows = self.rows(filters)
+        row_count = self.size if rows is None else len(rows)
+        group_codes = [self._codes[dimension] if rows is None else self._codes[dimension][rows] for dimension in group_by]
+        shape = [len(self._categories[dimension]) for dimension in group_by]
+
+        # Rows with a missing value in a grouped dimension are not counted, as in a groupby
+        valid = np.ones(row_count, dtype=bool)
+        for codes in group_codes:
+            valid &= codes >= 0
+        if group_by:
+            keys = np.ravel_multi_index([codes[valid] for codes in group_codes], shape)
+        else:
+            keys = np.zeros(int(valid.sum()), dtype=np.intp)
+        group_count = int(np.prod(shape)) if group_by else 1
+
+        results = {}
+        for measure in measures:
+            column, func = FRAME_MEASURES[measure]
+            values = self._column(column, rows)[valid]
+            if func == 'count':
+                results[measure] = np.bincount(keys[~pd.isna(values)], minlength=group_count)
+            elif func == 'sum':
+                values = values.astype(np.float64)
+                present = ~np.isnan(values)
+                results[measure] = np.bincount(keys[present], weights=values[present], minlength=group_count)
+            elif func == 'nunique':
+                codes, uniques = pd.factorize(values)
+                pairs = np.unique(keys[codes >= 0] * (len(uniques) + 1) + codes[codes >= 0])
+                results[measure] = np.bincount(pairs // (len(uniques) + 1), minlength=group_count)
+
+        if not group_by:
+            return pd.DataFrame({measure: [values[0]] for measure, values in results.items()})
+
+        # Keep the groups that have rows, like groupby(observed=True)
+        present = np.flatnonzero(np.bincount(keys, minlength=group_count))
+        group_index = np.unravel_index(present, shape)
+        df = pd.DataFrame({
+            dimension: self._categories[dimension].take(codes) for dimension, codes in zip(group_by, group_index)
+        })
+        for measure, values in results.items():
+            df[measure] = values[present]
+        return df
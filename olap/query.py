@@ -0,0 +1,162 @@
+# Import required libraries for answering chart queries with aggregates computed in the warehouse
+import json
+import sqlite3
+from collections import namedtuple
+from olap.cube import CUBE_FROM, DIMENSIONS, MEASURES, DISTINCT_MEASURES
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Inclusive range filter on a numeric dimension, e.g. Range(18, 65) on patient_age
+Range = namedtuple('Range', ['low', 'high'])
+
+# Measures computed on the appointment cube in memory: output column -> (cube column, aggregation).
+# Like the fact join, the cube answers the distinct counts no rollup has.
+FRAME_MEASURES = {
+    'appointment_count': ('appointment_id', 'count'),
+    'fee_sum': ('appointment_fee', 'sum'),
+    'waiting_sum': ('waiting_duration_min', 'sum'),
+    'doctor_count': ('doctor_id', 'nunique'),
+    'patient_count': ('patient_id', 'nunique')
+}
+
+# numpy scalars (e.g. from a Series of filter options) as plain Python values sqlite3 can bind
+def plain_value(value):
+    return value.item() if hasattr(value, 'item') else value
+
+# Drop filters that select everything ("All", None) and turn single values into lists
+def normalize_filters(filters):
+    normalized = {}
+    for dimension, value in filters.items():
+        if value is None or isinstance(value, str) and value == "All":
+            continue
+        if isinstance(value, Range):
+            normalized[dimension] = Range(plain_value(value.low), plain_value(value.high))
+        elif isinstance(value, (list, tuple, set)):
+            if "All" in value:
+                continue
+            normalized[dimension] = sorted(plain_value(v) for v in value)
+        else:
+            normalized[dimension] = [plain_value(value)]
+    return normalized
+
+# Rollup tables of the latest load: table name -> (dimensions, row count)
+def read_catalog(connection):
+    try:
+        rows = connection.execute("SELECT table_name, dimensions, row_count FROM agg_catalog").fetchall()
+    except sqlite3.OperationalError:
+        # Warehouse loaded before the rollups existed
+        return {}
+    return {table_name: (json.loads(dimensions), row_count) for table_name, dimensions, row_count in rows}
+
+# Smallest rollup that has every grouped and filtered dimension, None when no rollup covers the query
+def choose_rollup(catalog, dimensions):
+    candidates = [
+        (row_count, table_name) for table_name, (rollup_dimensions, row_count) in catalog.items()
+        if set(dimensions) <= set(rollup_dimensions)
+    ]
+    return min(candidates)[1] if candidates else None
+
+# Parameterized WHERE of the filters; columns maps dimensions to their SQL expression (the column itself by default)
+def where_clause(filters, columns=None):
+    conditions, params = [], []
+    for dimension, value in filters.items():
+        column = columns[dimension] if columns else dimension
+        if isinstance(value, Range):
+            conditions.append(f"{column} BETWEEN ? AND ?")
+            params += [value.low, value.high]
+        else:
+            conditions.append(f"{column} IN ({', '.join('?' for _ in value)})")
+            params += list(value)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+# Parameterized query of the measures by group_by on a rollup table
+def rollup_query(table_name, group_by, measures, filters):
+    select = [*group_by, *(f"{MEASURES[measure][1]} AS {measure}" for measure in measures)]
+    where, params = where_clause(filters)
+    sql = f"SELECT {', '.join(select)} FROM {table_name}{where}"
+    if group_by:
+        sql += f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}"
+    return sql, params
+
+# Parameterized query of the measures by group_by on the star schema join, for what no rollup covers
+def fact_query(group_by, measures, filters):
+    select = [f"{DIMENSIONS[dimension]} AS {dimension}" for dimension in group_by]
+    select += [
+        f"{MEASURES[measure][0] if measure in MEASURES else DISTINCT_MEASURES[measure]} AS {measure}"
+        for measure in measures
+    ]
+    where, params = where_clause(filters, DIMENSIONS)
+    sql = f"SELECT {', '.join(select)} {CUBE_FROM}{where}"
+    if group_by:
+        group_columns = ', '.join(DIMENSIONS[dimension] for dimension in group_by)
+        sql += f" GROUP BY {group_columns} ORDER BY {group_columns}"
+    return sql, params
+
+# Answers the chart queries of one filter state with aggregated rows only. Queries are served from the
+# smallest covering rollup; the ones no rollup covers (other filters, distinct counts) run as GROUP BY on the
+# star schema join. With get_engine, those are computed in memory instead by the FilterEngine (olap/filters.py)
+# of the appointment cube that get_engine() returns, which is only called when needed.
+# All warehouse reads see the same warehouse version.
+class CubeQuery:
+    def __init__(self, db_path, filters, get_engine=None):
+        self.db_path = db_path
+        self.filters = normalize_filters(filters)
+        self._get_engine = get_engine
+        self._engine = None
+        self._connection = None
+        self._catalog = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path, isolation_level=None)
+            # One read transaction, so every query sees the same committed load
+            self._connection.execute("BEGIN")
+            self._catalog = read_catalog(self._connection)
+        return self._connection
+
+    # True once a request was answered in memory, whose data can lag behind the rollups during a reload
+    @property
+    def used_engine(self):
+        return self._engine is not None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self._get_engine()
+        return self._engine
+
+    def aggregate(self, group_by, measures=('appointment_count',)):
+        group_by, measures = list(group_by), list(measures)
+        connection = self.connection()
+        table_name = None
+        if all(measure in MEASURES for measure in measures):
+            table_name = choose_rollup(self._catalog, [*group_by, *self.filters])
+
+        if table_name is not None:
+            sql, params = rollup_query(table_name, group_by, measures, self.filters)
+            logger.debug("Answering %s %s from rollup '%s'", group_by, measures, table_name)
+        elif self._get_engine is not None:
+            logger.debug("No rollup covers %s with filters %s, using the filter engine", group_by, list(self.filters))
+            return self.engine.aggregate(self.filters, group_by, measures)
+        else:
+            sql, params = fact_query(group_by, measures, self.filters)
+            logger.debug("No rollup covers %s with filters %s, aggregating the fact table", group_by, list(self.filters))
+
+        # Imported on first use: the dashboards start without pandas
+        import pandas as pd
+        df = pd.read_sql_query(sql, connection, params=params)
+        # Sums over no rows are NULL
+        return df.fillna({measure: 0 for measure in measures})
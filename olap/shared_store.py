@@ -0,0 +1,63 @@
+# Import required libraries for sharing the appointment cube between dashboard worker processes
+import os
+import sqlite3
+from etl.etl_snapshot import pa, snapshot_path, latest_run_id, read_cube_from_warehouse, encode_dictionary_columns
+from olap.cache import warehouse_version
+from config.logging_config import setup_logger
+
+# Set up logger for this module
+logger = setup_logger(__name__)
+
+# Identity of the published snapshot file: a new load replaces it with os.replace, which gives it a new inode
+def snapshot_version(db_path):
+    try:
+        stat = os.stat(snapshot_path(db_path))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+# The appointment cube published once by the loader as a memory-mapped Arrow file (etl/etl_snapshot.py)
+# and attached zero-copy by every worker: the table's buffers point into the mapping, so all worker
+# processes share the same pages of the OS page cache instead of each holding a copy of the cube.
+# Only the columns are shared: each worker builds its own filter engine codes and bitmaps over them.
+# A new load is swapped in atomically by the loader's rename; attach() then maps the new file, while
+# tables of the previous version stay valid (the replaced file lives on until it is no longer mapped).
+class SharedCubeStore:
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    # Version to reload on: the warehouse load and the snapshot, which is published just after the load commits
+    def version(self):
+        return warehouse_version(self.db_path), snapshot_version(self.db_path)
+
+    def attach(self):
+        if pa is None:
+            raise ImportError("pyarrow is required for the shared cube store")
+        path = snapshot_path(self.db_path)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            run_id = latest_run_id(conn)
+            table = self._map(path)
+            if table is not None:
+                snapshot_run_id = (table.schema.metadata or {}).get(b'run_id', b'').decode()
+                if run_id is None or snapshot_run_id == str(run_id):
+                    logger.info("Attached shared snapshot '%s' of run %s (%s rows)", path, snapshot_run_id, table.num_rows)
+                    return table
+                logger.info("Snapshot '%s' is from run %s, latest run is %s; not using it", path, snapshot_run_id, run_id)
+            # Until the snapshot of the latest load is published this process holds its own copy
+            logger.warning("No current snapshot to share, reading the appointment cube from the warehouse")
+            df = read_cube_from_warehouse(conn)
+        finally:
+            conn.close()
+        return pa.Table.from_pandas(encode_dictionary_columns(df), preserve_index=False)
+
+    def _map(self, path):
+        try:
+            with pa.memory_map(path, 'r') as source:
+                # Reading an uncompressed IPC file from a memory map references the mapping, nothing is copied
+                return pa.ipc.open_file(source).read_all()
+        except FileNotFoundError:
+            return None
+        except (OSError, pa.ArrowInvalid) as e:
+            logger.warning("Could not map snapshot '%s': %s", path, e)
+            return None
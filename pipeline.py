@@ -1,61 +1,248 @@
+import time
 from datetime import datetime
 import pytz
+import pandas as pd
 #Import ETL scripts
-from etl.etl_extraction import extract_from_flat_file, extract_from_db, extract_from_api
-from etl.etl_transformation import *
-from etl.etl_loading import load_data
+from etl.etl_extraction import (
+    extract_all_sources, extract_from_db, extract_from_api, iter_new_flat_file_chunks
+)
+from etl.etl_transformation import (
+    create_dim_date, create_dim_time, create_dim_appointment_status, map_doctor_to_appointments,
+    map_insurance_to_patients, transform_patient, format_appointment, format_specialty,
+    format_coverage_type, format_slots, format_doctors
+)
+from etl.etl_loading import (
+    load_data, read_watermarks, read_warehouse_table, warehouse_transaction, upsert_data_into_table,
+    sync_dimension, stage_loaded_keys, count_loaded_keys, drop_loaded_keys, delete_missing_rows,
+    add_change_summary, print_change_summary, finish_load, load_changed, write_snapshot, TABLE_KEYS
+)
+from etl.etl_dag import Node, run_dag, print_dag_stats
+from etl.etl_schema import report_memory
+from etl.etl_instrumentation import instrument, reported_run
+from config.cli import parse_args
 from config.logging_config import setup_logger
 
 # Set up logger for this module
 logger = setup_logger(__name__)
 
+# Outputs of the reference data steps (specialties, coverage types, doctors), kept between scheduled runs
+# so they are not re-run while the source tables do not change. The steps over new rows are not cached.
+REFERENCE_CACHE = {}
+
+# Transform steps with the values they read and produce; the appointment and patient branches run in parallel
+def appointment_nodes():
+    return [
+        Node('create_dim_date', create_dim_date, ['appointments'], ['appointments_dated', 'dim_date']),
+        Node('create_dim_time', create_dim_time, ['appointments_dated'], ['appointments_timed', 'dim_time']),
+        Node('create_dim_appointment_status', create_dim_appointment_status,
+             ['appointments_timed', 'existing_status'], ['appointments_with_status', 'dim_appointment_status']),
+        Node('map_doctor_to_appointments', map_doctor_to_appointments,
+             ['appointments_with_status', 'doctor_appointment'], ['appointments_with_doctor']),
+        Node('format_appointment', format_appointment, ['appointments_with_doctor'], ['fact_appointment'])
+    ]
+
+def patient_nodes():
+    return [
+        Node('map_insurance_to_patients', map_insurance_to_patients,
+             ['patients', 'insurance_company'], ['patients_with_insurance']),
+        Node('transform_patient', transform_patient, ['patients_with_insurance', 'coverage_type'], ['dim_patient'])
+    ]
+
+def reference_nodes():
+    return [
+        Node('format_specialty', format_specialty, ['specialty'], ['dim_doctor_specialty'], cacheable=True),
+        Node('format_coverage_type', format_coverage_type, ['coverage_type'], ['dim_coverage_type'], cacheable=True),
+        Node('format_doctors', format_doctors, ['doctors'], ['dim_doctor'], cacheable=True)
+    ]
+
+def build_transform_dag(has_appointments=True, has_patients=True):
+    nodes = []
+    if has_appointments:
+        nodes += appointment_nodes()
+    if has_patients:
+        nodes += patient_nodes()
+    nodes += reference_nodes()
+    nodes.append(Node('format_slots', format_slots, ['slots'], ['dim_slot']))
+    return nodes
+
+# Streaming variant of the pipeline: the flat files are read in chunks and each chunk is transformed
+# and loaded before the next one is read, so memory is bounded by the chunk size, not the file size
+@instrument
+def run_streaming_pipeline(watermarks, incremental, chunksize):
+    started_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+    new_watermarks = dict(watermarks)
+
+    # --- EXTRACT the small sources in full ---
+    print("\n-- START ETRACTION OF DATABASE AND API --")
+    db_data = extract_from_db(min_appointment_id=watermarks.get('appointments_max_id'))
+    insurance_company_df = extract_from_api()
+    report_memory({**db_data, 'insurance_company': insurance_company_df})
+    # Status ids must stay stable across chunks and incremental runs
+    status_df = read_warehouse_table('dim_appointment_status') if incremental else None
+    reference, _ = run_dag(reference_nodes(), {
+        'specialty': db_data['specialty'],
+        'coverage_type': db_data['coverage_type'],
+        'doctors': db_data['doctor']
+    })
+
+    # --- STREAM flat files through TRANSFORM and LOAD ---
+    print(f"\n-- START STREAMING FLAT FILES IN CHUNKS OF {chunksize} ROWS --")
+    rows_loaded = 0
+    changes = {}
+
+    def sync_chunk(df, table_name, conn):
+        add_change_summary(changes, table_name, sync_dimension(df, table_name, conn, started_at, complete=False))
+        # The keys are collected in the warehouse, to count every key once in the change summary and,
+        # in a full refresh, to delete the rows whose key was in no chunk
+        stage_loaded_keys(table_name, df[TABLE_KEYS[table_name]], conn)
+
+    with warehouse_transaction() as conn:
+        # The small sources are complete frames, rows gone from them are deleted
+        for table_name, df in [
+            ('dim_doctor_specialty', reference['dim_doctor_specialty']),
+            ('dim_insurance_company', insurance_company_df),
+            ('dim_coverage_type', reference['dim_coverage_type']),
+            ('dim_doctor', reference['dim_doctor'])
+        ]:
+            add_change_summary(changes, table_name, sync_dimension(df, table_name, conn, started_at))
+
+        for slots_chunk in iter_new_flat_file_chunks('slots', watermarks, new_watermarks, chunksize=chunksize):
+            sync_chunk(format_slots(slots_chunk), 'dim_slot', conn)
+
+        for patients_chunk in iter_new_flat_file_chunks('patients', watermarks, new_watermarks, chunksize=chunksize):
+            outputs, _ = run_dag(patient_nodes(), {
+                'patients': patients_chunk,
+                'insurance_company': insurance_company_df,
+                'coverage_type': db_data['coverage_type']
+            })
+            sync_chunk(outputs['dim_patient'], 'dim_patient', conn)
+
+        for appointments_chunk in iter_new_flat_file_chunks('appointments', watermarks, new_watermarks, chunksize=chunksize):
+            outputs, _ = run_dag(appointment_nodes(), {
+                'appointments': appointments_chunk,
+                'existing_status': status_df,
+                'doctor_appointment': db_data['doctor_appointment']
+            })
+            status_df = outputs['dim_appointment_status']
+            sync_chunk(outputs['dim_date'], 'dim_date', conn)
+            sync_chunk(outputs['dim_time'], 'dim_time', conn)
+            sync_chunk(status_df, 'dim_appointment_status', conn)
+            # Fact rows are upserted, existing appointments keep their dimension versions
+            upsert_data_into_table(outputs['fact_appointment'], 'fact_appointment', conn)
+            if not incremental:
+                stage_loaded_keys('fact_appointment', outputs['fact_appointment']['appointment_id'], conn)
+            rows_loaded += len(outputs['fact_appointment'])
+
+        for table_name in ['dim_slot', 'dim_patient', 'dim_date', 'dim_time', 'dim_appointment_status']:
+            summary = changes.setdefault(table_name, {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+            # Dates, times and statuses recur in many chunks: count the distinct keys left unchanged
+            summary['unchanged'] = max(count_loaded_keys(table_name, conn) - summary['inserted'] - summary['updated'], 0)
+            if incremental:
+                drop_loaded_keys(table_name, conn)
+            else:
+                summary['deleted'] = delete_missing_rows(table_name, conn, started_at)
+        if not incremental:
+            deleted = delete_missing_rows('fact_appointment', conn)
+            logger.info("Deleted %s appointments gone from the source", deleted)
+
+        run_id = finish_load(
+            conn, incremental, started_at, rows_loaded, new_watermarks, changed=load_changed(changes, rows_loaded)
+        )
+
+    print_change_summary(changes)
+
+    logger.info("Streaming load committed as run %s with %s appointments", run_id, rows_loaded)
+    write_snapshot(run_id)
+    print("-- STREAMING LOAD COMPLETE --")
+
 #ETL Pipeline Function
-def etl_pipeline():
+# Every run writes a report of its stages (time, rows, memory) to logs/ (see etl/etl_instrumentation.py)
+@reported_run
+def etl_pipeline(full_refresh=False, chunksize=None):
     logger.info("Starting ETL pipeline")
     
     try:
         print("\n STARTING FULL ETL PIPELINE FOR PATIENT APPOINMENT MANAGEMENT DATA WAREHOUSE")
         
+        # Continue from the high-water marks of the last run; without them everything is reloaded
+        watermarks = {} if full_refresh else read_watermarks()
+        incremental = bool(watermarks)
+        if incremental:
+            print("\nRunning INCREMENTAL load (use --full-refresh to reload everything)")
+            logger.info("Running incremental load from high-water marks %s", watermarks)
+        else:
+            print("\nRunning FULL REFRESH load")
+            logger.info("Running full refresh load")
+
+        if chunksize:
+            run_streaming_pipeline(watermarks, incremental, chunksize)
+            print("-------------------------------------------------")
+            logger.info("ETL pipeline completed successfully in streaming mode")
+            return
 
         # --- EXTRACT PHASE ---
         print("\n-- START ETRACTION --")
-        print("\nExtracting from flat files...")
-        appointments_df, patients_df, slots_df = extract_from_flat_file()
+        print("\nExtracting from flat files, database and API concurrently...")
+        sources = extract_all_sources(watermarks)
+
+        appointments_df, patients_df, slots_df, new_watermarks = sources['flat_files']
         logger.debug("Extracted flat files")
 
-        print("\nExtracting from database...")
-        db_data = extract_from_db()
+        db_data = sources['database']
         logger.debug("Extracted database data")
         doctors_df = db_data['doctor']
         doctor_appointment_df = db_data['doctor_appointment']
         specialty_df = db_data['specialty']
         coverage_type_df = db_data['coverage_type']
 
-        print("\nExtracting from API...")
-        insurance_company_df = extract_from_api()
+        insurance_company_df = sources['api']
         logger.debug("Extracted API data")
+        report_memory({
+            'appointments': appointments_df,
+            'patients': patients_df,
+            'slots': slots_df,
+            'doctor': doctors_df,
+            'doctor_appointment': doctor_appointment_df,
+            'specialty': specialty_df,
+            'coverage_type': coverage_type_df,
+            'insurance_company': insurance_company_df
+        })
         print("-- ETRACTION COMPLETE --")
         print("---------------------------------------------------------------")
         
         # --- TRANSFORM PHASE ---
         print("\n-- START TRANSFORM --")
-        print("Transforming appointments...")
-        appointments_df, date_df = create_dim_date(appointments_df)
-        appointments_df, time_df = create_dim_time(appointments_df)
-        appointments_df, appointment_status_df = create_dim_appointment_status(appointments_df)
-        appointments_df = map_doctor_to_appointments(appointments_df, doctor_appointment_df)
-
-        print("Transforming patients...")
-        patients_df = map_insurance_to_patients(patients_df, insurance_company_df)    
-        patients_df = transform_patient(patients_df, db_data['coverage_type'])
-
-        print("Formatting some tables")
-        fact_appointments_df = format_appointment(appointments_df)
-        specialty_df = format_specialty(specialty_df)
-        coverage_type_df = format_coverage_type(coverage_type_df)
-        slots_df = format_slots(slots_df)   
-        doctors_df = format_doctors(doctors_df)
-        print("  Formatting completed successfully")
+        # Status ids must stay stable across incremental runs
+        existing_status_df = read_warehouse_table('dim_appointment_status') if incremental else None
+        if appointments_df.empty:
+            print("No new appointments to transform.")
+        if patients_df.empty:
+            print("No new patients to transform.")
+
+        nodes = build_transform_dag(not appointments_df.empty, not patients_df.empty)
+        outputs, transform_stats = run_dag(nodes, {
+            'appointments': appointments_df,
+            'existing_status': existing_status_df,
+            'doctor_appointment': doctor_appointment_df,
+            'patients': patients_df,
+            'insurance_company': insurance_company_df,
+            'coverage_type': coverage_type_df,
+            'specialty': specialty_df,
+            'slots': slots_df,
+            'doctors': doctors_df
+        }, cache=REFERENCE_CACHE)
+        print_dag_stats(transform_stats)
+
+        # Branches skipped for lack of new rows load nothing
+        date_df = outputs.get('dim_date', pd.DataFrame())
+        time_df = outputs.get('dim_time', pd.DataFrame())
+        appointment_status_df = outputs.get('dim_appointment_status', pd.DataFrame())
+        fact_appointments_df = outputs.get('fact_appointment', pd.DataFrame())
+        patients_df = outputs.get('dim_patient', patients_df)
+        specialty_df = outputs['dim_doctor_specialty']
+        coverage_type_df = outputs['dim_coverage_type']
+        slots_df = outputs['dim_slot']
+        doctors_df = outputs['dim_doctor']
         print("-- TRANSFORM COMPLETE --")
         print("---------------------------------------------------------------")
         
@@ -71,7 +258,9 @@ def etl_pipeline():
             doctors_df,
             slots_df,
             appointment_status_df,
-            fact_appointments_df
+            fact_appointments_df,
+            incremental=incremental,
+            watermarks=new_watermarks
         )
         logger.debug("Completed data loading")
         print("-- LOAD COMPLETE --")
@@ -81,12 +270,12 @@ def etl_pipeline():
         now = datetime.now(tz)
         currentTime = now.strftime("%d %B %Y - %H:%M")
         print(f"ETL PIPELINE COMPLETED AT {currentTime}")
-        logger.info(f"ETL pipeline completed successfully at {currentTime}")
+        logger.info("ETL pipeline completed successfully at %s", currentTime)
         
     except Exception as e:
-        error_msg = f"ETL pipeline failed: {str(e)}"
-        logger.error(error_msg)
+        logger.error("ETL pipeline failed: %s", e)
         raise
 
 if __name__ == "__main__":
-    etl_pipeline()
+    args = parse_args()
+    etl_pipeline(full_refresh=args.full_refresh, chunksize=args.chunksize)
@@ -0,0 +1,19 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+# Import the project packages (etl, olap, db_init, ...) from the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db_init.warehouse_create import ensure_warehouse_schema
+
+
+# Empty warehouse in a temporary file, with autocommit like the loader's own connection
+@pytest.fixture
+def warehouse(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'warehouse.db', isolation_level=None)
+    ensure_warehouse_schema(connection)
+    yield connection
+    connection.close()
@@ -0,0 +1,110 @@
+import pandas as pd
+
+from etl.etl_loading import create_hash_staging_table, delete_missing_rows, row_hashes, sync_table
+
+
+def slot_frame(times=('08:00', '09:00', '10:00')):
+    return pd.DataFrame({
+        'slot_id': range(1, len(times) + 1),
+        'appointment_date': pd.to_datetime(['2024-01-01'] * len(times)),
+        'appointment_time': list(times)
+    })
+
+
+# Count every write to the table and its stored hashes, through temporary triggers
+def count_writes(connection):
+    connection.execute("CREATE TEMP TABLE write_log (table_name TEXT)")
+    for table_name in ('dim_slot', 'etl_row_hash'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            connection.execute(
+                f"CREATE TEMP TRIGGER log_{table_name}_{event.lower()} AFTER {event} ON main.{table_name} "
+                f"BEGIN INSERT INTO write_log VALUES ('{table_name}'); END"
+            )
+
+
+def writes(connection):
+    return connection.execute("SELECT COUNT(*) FROM write_log").fetchone()[0]
+
+
+def stored_slots(connection):
+    return connection.execute("SELECT slot_id, appointment_time FROM dim_slot ORDER BY slot_id").fetchall()
+
+
+def stored_hash_keys(connection):
+    rows = connection.execute("SELECT row_key FROM etl_row_hash WHERE table_name = 'dim_slot' ORDER BY row_key")
+    return [row_key for row_key, in rows]
+
+
+def test_row_hashes_change_with_values_only():
+    df = slot_frame()
+    coarse = df.assign(appointment_date=df['appointment_date'].astype('datetime64[s]'))
+    changed = slot_frame(times=('08:00', '09:30', '10:00'))
+
+    assert (row_hashes(df) == row_hashes(coarse)).all()
+    assert (row_hashes(df) != row_hashes(changed)).tolist() == [False, True, False]
+
+
+def test_first_load_inserts_rows_and_hashes(warehouse):
+    summary = sync_table(slot_frame(), 'dim_slot', warehouse)
+
+    assert summary == {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    assert stored_slots(warehouse) == [(1, '08:00'), (2, '09:00'), (3, '10:00')]
+    assert stored_hash_keys(warehouse) == [1, 2, 3]
+
+
+def test_reload_of_unchanged_rows_writes_nothing(warehouse):
+    sync_table(slot_frame(), 'dim_slot', warehouse)
+    count_writes(warehouse)
+
+    summary = sync_table(slot_frame(), 'dim_slot', warehouse)
+
+    assert summary == {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 3}
+    assert writes(warehouse) == 0
+
+
+def test_changed_row_is_updated(warehouse):
+    sync_table(slot_frame(), 'dim_slot', warehouse)
+    count_writes(warehouse)
+
+    summary = sync_table(slot_frame(times=('08:00', '09:30', '10:00')), 'dim_slot', warehouse)
+
+    assert summary == {'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 2}
+    assert stored_slots(warehouse) == [(1, '08:00'), (2, '09:30'), (3, '10:00')]
+    # Only the changed row and its hash are written
+    assert warehouse.execute("SELECT table_name, COUNT(*) FROM write_log GROUP BY table_name ORDER BY 1").fetchall() \
+        == [('dim_slot', 1), ('etl_row_hash', 1)]
+
+
+def test_missing_key_is_deleted_with_its_hash(warehouse):
+    sync_table(slot_frame(), 'dim_slot', warehouse)
+
+    summary = sync_table(slot_frame().iloc[[0, 2]], 'dim_slot', warehouse)
+
+    assert summary == {'inserted': 0, 'updated': 0, 'deleted': 1, 'unchanged': 2}
+    assert stored_slots(warehouse) == [(1, '08:00'), (3, '10:00')]
+    assert stored_hash_keys(warehouse) == [1, 3]
+
+
+def test_partial_load_keeps_missing_keys(warehouse):
+    sync_table(slot_frame(), 'dim_slot', warehouse)
+
+    summary = sync_table(slot_frame().iloc[[0]], 'dim_slot', warehouse, complete=False)
+
+    assert summary == {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 1}
+    assert [slot_id for slot_id, _ in stored_slots(warehouse)] == [1, 2, 3]
+
+
+def test_delete_missing_rows_without_staged_keys_empties_the_table(warehouse):
+    sync_table(slot_frame(), 'dim_slot', warehouse)
+
+    assert delete_missing_rows('dim_slot', warehouse) == 3
+    assert stored_slots(warehouse) == []
+    assert stored_hash_keys(warehouse) == []
+
+
+def test_hash_staging_table_is_temporary(warehouse):
+    create_hash_staging_table(warehouse)
+
+    tables = warehouse.execute("SELECT name FROM sqlite_master WHERE name = 'staging_row_hash'").fetchall()
+    assert tables == []
+    assert warehouse.execute("SELECT COUNT(*) FROM temp.staging_row_hash").fetchone()[0] == 0
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from olap.filters import FilterEngine
+from olap.query import FRAME_MEASURES, Range, normalize_filters
+
+FILTER_STATES = [
+    {},
+    {'year': 'All', 'month': [1, 2, 3]},
+    {'year': [2023], 'status_title': ['attended', 'cancelled']},
+    {'patient_age': Range(18, 40), 'gender': 'F'},
+    {'patient_age': Range(30, 30), 'specialty_title': ['Cardiology', 'Dermatology'], 'doctor_gender': ['M']},
+    # Empty selections: a value that is not in the cube, no value at all and a range outside the data
+    {'status_title': ['unknown']},
+    {'specialty_title': []},
+    {'patient_age': Range(200, 300), 'year': [2024]}
+]
+
+GROUP_BYS = [
+    [],
+    ['specialty_title'],
+    ['year', 'month'],
+    ['insurance_company_name', 'doctor_gender']
+]
+
+
+# Random appointment cube with every filter dimension and measure column, with missing values in a
+# grouped dimension and in the measures
+def cube(size=2000, seed=7):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'appointment_id': np.arange(size),
+        'year': rng.choice([2022, 2023, 2024], size),
+        'month': rng.integers(1, 13, size),
+        'weekday': rng.choice(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday'], size),
+        'status_title': rng.choice(['attended', 'cancelled', 'did not attend', 'scheduled'], size),
+        'specialty_title': rng.choice(['Cardiology', 'Dermatology', 'Neurology', 'Pediatrics'], size),
+        'insurance_company_name': rng.choice(['Aetna', 'Cigna', 'Humana', None], size),
+        'gender': rng.choice(['F', 'M'], size),
+        'doctor_gender': rng.choice(['F', 'M'], size),
+        'coverage_type': rng.choice(['Basic', 'Premium'], size),
+        'patient_age': rng.integers(0, 90, size),
+        'appointment_fee': rng.choice([50.0, 80.0, 120.0, np.nan], size),
+        'waiting_duration_min': rng.exponential(20, size).round(1),
+        'doctor_id': rng.integers(1, 40, size),
+        'patient_id': rng.integers(1, 500, size)
+    })
+
+
+# The same aggregate with a boolean mask and a pandas groupby on the filtered copy
+def pandas_aggregate(df, filters, group_by, measures):
+    mask = np.ones(len(df), dtype=bool)
+    for dimension, value in filters.items():
+        if isinstance(value, Range):
+            mask &= df[dimension].between(value.low, value.high).to_numpy()
+        else:
+            mask &= df[dimension].isin(value).to_numpy()
+    selected = df[mask]
+    aggregations = {measure: FRAME_MEASURES[measure] for measure in measures}
+    if not group_by:
+        return pd.DataFrame({measure: [selected[column].agg(func)] for measure, (column, func) in aggregations.items()})
+    return selected.groupby(group_by, sort=True).agg(**aggregations).reset_index()
+
+
+def assert_same_aggregate(result, expected):
+    pd.testing.assert_frame_equal(
+        result.reset_index(drop=True), expected.reset_index(drop=True),
+        check_dtype=False, check_index_type=False
+    )
+
+
+@pytest.mark.parametrize('filters', FILTER_STATES)
+def test_rows_match_a_boolean_mask(filters):
+    df = cube()
+    filters = normalize_filters(filters)
+    rows = FilterEngine(df).rows(filters)
+
+    if not filters:
+        assert rows is None
+        return
+    mask = np.ones(len(df), dtype=bool)
+    for dimension, value in filters.items():
+        column = df[dimension]
+        mask &= (column.between(value.low, value.high) if isinstance(value, Range) else column.isin(value)).to_numpy()
+    assert rows.tolist() == np.flatnonzero(mask).tolist()
+
+
+@pytest.mark.parametrize('group_by', GROUP_BYS)
+@pytest.mark.parametrize('filters', FILTER_STATES)
+def test_aggregate_matches_pandas(filters, group_by):
+    df = cube()
+    engine = FilterEngine(df)
+    filters = normalize_filters(filters)
+    measures = list(FRAME_MEASURES)
+
+    assert_same_aggregate(engine.aggregate(filters, group_by, measures), pandas_aggregate(df, filters, group_by, measures))
+
+
+# An Arrow cube as the shared store maps it: dictionary-encoded columns read as codes, once with the
+# sorted dictionaries the snapshot writes and once with unsorted ones that are remapped
+@pytest.mark.parametrize('sorted_dictionaries', [True, False])
+@pytest.mark.parametrize('filters', FILTER_STATES)
+def test_arrow_cube_matches_pandas(filters, sorted_dictionaries):
+    pa = pytest.importorskip('pyarrow')
+    df = cube()
+    encoded = df.copy()
+    for column in ['weekday', 'status_title', 'specialty_title', 'coverage_type']:
+        categories = sorted(df[column].unique(), reverse=not sorted_dictionaries)
+        encoded[column] = pd.Categorical(df[column], categories=categories)
+    engine = FilterEngine(pa.Table.from_pandas(encoded, preserve_index=False))
+    filters = normalize_filters(filters)
+    measures = list(FRAME_MEASURES)
+
+    for group_by in GROUP_BYS + [['status_title', 'weekday']]:
+        assert_same_aggregate(engine.aggregate(filters, group_by, measures), pandas_aggregate(df, filters, group_by, measures))
+
@@ -0,0 +1,145 @@
+import pandas as pd
+
+from etl.etl_loading import (
+    bulk_insert, create_staging_table, delete_missing_rows, expire_missing_versions, merge_versions,
+    resolve_fact_versions, stage_loaded_keys
+)
+
+FIRST_LOAD = '2024-01-01 00:00:00'
+SECOND_LOAD = '2024-06-01 00:00:00'
+
+
+def patient_frame(insurance_company_ids=(1, 1, 1)):
+    return pd.DataFrame({
+        'patient_id': range(1, len(insurance_company_ids) + 1),
+        'first_name': ['Ann', 'Bob', 'Cleo'][:len(insurance_company_ids)],
+        'last_name': ['Lee', 'Ray', 'Moss'][:len(insurance_company_ids)],
+        'date_of_birth': pd.to_datetime(['1980-02-03', '1975-10-11', '1999-07-30'][:len(insurance_company_ids)]),
+        'gender': ['F', 'M', 'F'][:len(insurance_company_ids)],
+        'insurance_company_id': list(insurance_company_ids),
+        'coverage_type_id': [1, 2, 1][:len(insurance_company_ids)]
+    })
+
+
+def doctor_frame(fees=(100.0, 150.0)):
+    return pd.DataFrame({
+        'doctor_id': range(1, len(fees) + 1),
+        'first_name': ['Dana', 'Eli'][:len(fees)],
+        'last_name': ['Fox', 'Gray'][:len(fees)],
+        'gender': ['F', 'M'][:len(fees)],
+        'years_of_experience': [10, 4][:len(fees)],
+        'appointment_fee': list(fees),
+        'specialty_id': [1, 2][:len(fees)]
+    })
+
+
+def patient_versions(connection, patient_id):
+    return connection.execute(
+        "SELECT patient_key, insurance_company_id, valid_from, valid_to, is_current FROM dim_patient "
+        "WHERE patient_id = ? ORDER BY patient_key", (patient_id,)
+    ).fetchall()
+
+
+def insert_facts(connection, rows):
+    facts = pd.DataFrame(rows, columns=['appointment_id', 'patient_id', 'doctor_id', 'appointment_date_id'])
+    bulk_insert(facts, 'fact_appointment', connection, key='appointment_id')
+
+
+def fact_keys(connection):
+    return connection.execute(
+        "SELECT appointment_id, patient_key, doctor_key FROM fact_appointment ORDER BY appointment_id"
+    ).fetchall()
+
+
+def test_first_merge_adds_current_versions(warehouse):
+    summary = merge_versions(patient_frame(), 'dim_patient', warehouse, FIRST_LOAD)
+
+    assert summary == {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    assert patient_versions(warehouse, 2) == [(2, 1, FIRST_LOAD, None, 1)]
+
+
+def test_changed_row_closes_version_and_adds_current_one(warehouse):
+    merge_versions(patient_frame(), 'dim_patient', warehouse, FIRST_LOAD)
+
+    summary = merge_versions(patient_frame((1, 2, 1)), 'dim_patient', warehouse, SECOND_LOAD)
+
+    assert summary == {'inserted': 0, 'updated': 1, 'deleted': 0, 'unchanged': 2}
+    assert patient_versions(warehouse, 2) == [
+        (2, 1, FIRST_LOAD, SECOND_LOAD, 0),
+        (4, 2, SECOND_LOAD, None, 1)
+    ]
+    assert patient_versions(warehouse, 1) == [(1, 1, FIRST_LOAD, None, 1)]
+
+
+def test_missing_keys_are_closed_not_deleted(warehouse):
+    merge_versions(patient_frame(), 'dim_patient', warehouse, FIRST_LOAD)
+    merge_versions(doctor_frame(), 'dim_doctor', warehouse, FIRST_LOAD)
+
+    patients = merge_versions(patient_frame().iloc[[0, 2]], 'dim_patient', warehouse, SECOND_LOAD)
+    doctors = merge_versions(doctor_frame().iloc[[1]], 'dim_doctor', warehouse, SECOND_LOAD)
+
+    assert patients['deleted'] == 1 and doctors['deleted'] == 1
+    assert patient_versions(warehouse, 2) == [(2, 1, FIRST_LOAD, SECOND_LOAD, 0)]
+    assert warehouse.execute("SELECT doctor_id, valid_to, is_current FROM dim_doctor ORDER BY doctor_id").fetchall() \
+        == [(1, SECOND_LOAD, 0), (2, None, 1)]
+
+
+def test_expire_missing_versions_closes_current_versions_only(warehouse):
+    merge_versions(patient_frame(), 'dim_patient', warehouse, FIRST_LOAD)
+    merge_versions(patient_frame((1, 2, 1)), 'dim_patient', warehouse, SECOND_LOAD)
+    stage_loaded_keys('dim_patient', [1, 3], warehouse)
+
+    assert expire_missing_versions('dim_patient', warehouse, '2024-09-01 00:00:00') == 1
+    assert [row[3:] for row in patient_versions(warehouse, 2)] == [
+        (SECOND_LOAD, 0), ('2024-09-01 00:00:00', 0)
+    ]
+    # delete_missing_rows expires versioned dimensions as well, and drops the staged keys
+    assert delete_missing_rows('dim_patient', warehouse, '2024-09-01 00:00:00') == 0
+    assert warehouse.execute("SELECT COUNT(*) FROM dim_patient").fetchone()[0] == 4
+
+
+def test_duplicate_key_keeps_its_last_row(warehouse):
+    duplicated = pd.concat([patient_frame(), patient_frame((1, 5, 1)).iloc[[1]]], ignore_index=True)
+
+    summary = merge_versions(duplicated, 'dim_patient', warehouse, FIRST_LOAD)
+
+    assert summary == {'inserted': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+    assert [row[1] for row in patient_versions(warehouse, 2)] == [5]
+
+
+def test_staging_table_has_the_frame_columns_and_row_hash(warehouse):
+    staging_table = create_staging_table(patient_frame(), 'dim_patient', warehouse)
+
+    columns = [row[1] for row in warehouse.execute(f"PRAGMA temp.table_info({staging_table})")]
+    assert columns == list(patient_frame().columns) + ['row_hash']
+
+
+def test_new_facts_resolve_to_the_version_valid_on_their_date(warehouse):
+    merge_versions(patient_frame(), 'dim_patient', warehouse, FIRST_LOAD)
+    merge_versions(doctor_frame(), 'dim_doctor', warehouse, FIRST_LOAD)
+    merge_versions(patient_frame((1, 2, 1)), 'dim_patient', warehouse, SECOND_LOAD)
+    merge_versions(doctor_frame((100.0, 175.0)), 'dim_doctor', warehouse, SECOND_LOAD)
+
+    insert_facts(warehouse, [
+        (1, 2, 2, 20240301),  # between the two loads: first versions
+        (2, 2, 2, 20240601),  # on the day of the change: new versions
+        (3, 2, 2, 20230101),  # before the history: first versions
+        (4, 1, 1, 20240701)   # unchanged patient and doctor
+    ])
+    resolve_fact_versions(warehouse)
+
+    assert fact_keys(warehouse) == [(1, 2, 2), (2, 4, 3), (3, 2, 2), (4, 1, 1)]
+
+
+def test_resolved_facts_keep_their_version_unless_their_patient_changes(warehouse):
+    merge_versions(patient_frame(), 'dim_patient', warehouse, FIRST_LOAD)
+    merge_versions(doctor_frame(), 'dim_doctor', warehouse, FIRST_LOAD)
+    insert_facts(warehouse, [(1, 2, 2, 20240701), (2, 2, 2, 20240701)])
+    resolve_fact_versions(warehouse)
+
+    merge_versions(patient_frame((1, 2, 1)), 'dim_patient', warehouse, SECOND_LOAD)
+    # Reloaded facts: the first with the same patient, the second moved to patient 3
+    insert_facts(warehouse, [(1, 2, 2, 20240701), (2, 3, 2, 20240701)])
+    resolve_fact_versions(warehouse)
+
+    assert fact_keys(warehouse) == [(1, 2, 2), (2, 3, 2)]